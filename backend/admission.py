@@ -0,0 +1,79 @@
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when the admission queue is full.
+    retry_after is a hint in seconds for the Retry-After header.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f"Server busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionGate:
+    """
+    Bounds the number of model calls in flight (max_concurrent) and the number of callers
+    waiting for a slot (max_queue). Callers beyond that are rejected straight away instead of
+    piling up behind slow extractions, so latency stays bounded as load grows.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=16):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._waiting = 0
+        self._in_flight = 0
+        # Moving average of call duration, used for the Retry-After hint
+        self._avg_seconds = 30.0
+        self.stats = {"admitted": 0, "rejected": 0, "completed": 0}
+
+    def retry_after(self):
+        """
+        Rough time until a queue position frees up.
+        """
+        waves = (self._waiting + self._in_flight) / max(self.max_concurrent, 1)
+        return max(1, math.ceil(self._avg_seconds * max(waves, 1) / 2))
+
+    @asynccontextmanager
+    async def slot(self, wait=False):
+        """
+        Holds one concurrency slot for the duration of the block.
+        With wait=False a full queue raises AdmissionRejected; with wait=True the caller
+        always queues (used by callers that already bound their own fan-out, like batches).
+        """
+        if not wait and self._waiting >= self.max_queue and self._semaphore.locked():
+            self.stats["rejected"] += 1
+            raise AdmissionRejected(self.retry_after())
+
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._in_flight += 1
+        self.stats["admitted"] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+            self._in_flight -= 1
+            self.stats["completed"] += 1
+            self._semaphore.release()
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "avg_call_seconds": round(self._avg_seconds, 3),
+        }
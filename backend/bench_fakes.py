@@ -0,0 +1,218 @@
+import os
+import json
+import glob
+import time
+import random
+import asyncio
+import itertools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+RESPONSES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "responses")
+
+
+def load_payloads(responses_dir=RESPONSES_DIR):
+    """
+    The stored extractions in responses/*.json, used as canned model replies.
+    """
+    payloads = []
+    for path in sorted(glob.glob(os.path.join(responses_dir, "*.json"))):
+        with open(path) as f:
+            payloads.append(json.load(f))
+    if not payloads:
+        raise SystemExit(f"No response payloads found in {responses_dir}")
+    return payloads
+
+
+class _UsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class _StubResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class _StubStream:
+    """
+    Async iterable over a reply in `pieces` chunks spread over `delay` seconds, like the
+    SDK's response to generate_content_async(..., stream=True).
+    """
+
+    def __init__(self, reply, delay, pieces=8):
+        self.usage_metadata = reply.usage_metadata
+        self._text = reply.text
+        self._delay = delay
+        self._pieces = pieces
+
+    async def __aiter__(self):
+        size = max(1, -(-len(self._text) // self._pieces))
+        for start in range(0, len(self._text), size):
+            await asyncio.sleep(self._delay / self._pieces)
+            yield _StubResponse(self._text[start:start + size], None)
+
+
+class StubQuotaError(Exception):
+    """
+    Shaped like google.api_core's ResourceExhausted (HTTP 429).
+    """
+
+    code = 429
+
+
+class StubGenerativeModel:
+    """
+    Stand-in for genai.GenerativeModel. Replies with the stored payloads in turn after
+    latency + uniform(0, jitter) seconds, without any network access.
+    With quota_rpm set, calls beyond that many in the last 60 seconds raise StubQuotaError,
+    like Gemini's per-minute quota. A tail_ratio share of calls take tail_latency seconds
+    instead, like the occasional call that hangs.
+    Configure it through the class attributes before the run.
+    """
+
+    latency = 0.5
+    jitter = 0.0
+    payloads = None
+    quota_rpm = None
+    tail_ratio = 0.0
+    tail_latency = 0.0
+    quota_rejections = 0
+    _counter = itertools.count()
+    _calls = []
+
+    def __init__(self, model_name, generation_config=None, **kwargs):
+        self.model_name = model_name
+        self.generation_config = generation_config
+
+    def _next_reply(self):
+        payloads = type(self).payloads or load_payloads()
+        type(self).payloads = payloads
+        payload = payloads[next(self._counter) % len(payloads)]
+        text = json.dumps(payload, ensure_ascii=False)
+        # Rough token counts: a one-page PDF is ~260 tokens, text ~4 characters per token
+        return _StubResponse(text, _UsageMetadata(260, len(text) // 4))
+
+    def _check_quota(self):
+        cls = type(self)
+        if not cls.quota_rpm:
+            return
+        now = time.monotonic()
+        cls._calls = [t for t in cls._calls if t > now - 60]
+        if len(cls._calls) >= cls.quota_rpm:
+            cls.quota_rejections += 1
+            raise StubQuotaError("429 Resource has been exhausted (e.g. check quota).")
+        cls._calls.append(now)
+
+    def _delay(self):
+        if self.tail_ratio and random.random() < self.tail_ratio:
+            return self.tail_latency
+        return self.latency + random.uniform(0, self.jitter)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        self._check_quota()
+        delay = self._delay()
+        if stream:
+            return _StubStream(self._next_reply(), delay)
+        await asyncio.sleep(delay)
+        return self._next_reply()
+
+    def generate_content(self, contents, **kwargs):
+        self._check_quota()
+        time.sleep(self._delay())
+        return self._next_reply()
+
+
+class _FakeZohoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_POST(self):
+        server = self.server
+        path = urlparse(self.path).path
+        body = self._read_body()
+        time.sleep(server.latency)
+
+        if path == "/oauth/v2/token":
+            return self._send(200, {"access_token": "bench-token", "expires_in": 3600})
+        if path == "/books/v3/invoices":
+            invoice = json.loads(body or b"{}")
+            with server.lock:
+                invoice["invoice_id"] = str(len(server.invoices) + 1)
+                server.invoices.append(invoice)
+            return self._send(201, {"code": 0, "message": "The invoice has been created.", "invoice": invoice})
+        self._send(404, {"code": 404, "message": "Not found"})
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+        time.sleep(server.latency)
+
+        if path == "/books/v3/contacts":
+            return self._send(200, {"contacts": server.contacts, "page_context": {"has_more_page": False}})
+        if path == "/books/v3/invoices":
+            with server.lock:
+                # Like Zoho, the list leaves out notes
+                invoices = [{k: v for k, v in invoice.items() if k != "notes"} for invoice in server.invoices]
+            return self._send(200, {"invoices": invoices, "page_context": {"has_more_page": False}})
+        if path.startswith("/books/v3/invoices/"):
+            invoice_id = path.rsplit("/", 1)[1]
+            with server.lock:
+                matches = [invoice for invoice in server.invoices if invoice["invoice_id"] == invoice_id]
+            if matches:
+                return self._send(200, {"code": 0, "invoice": matches[0]})
+        self._send(404, {"code": 404, "message": "Not found"})
+
+
+class FakeZohoServer:
+    """
+    Local Zoho Books + accounts server on 127.0.0.1: token refresh, contact list,
+    invoice create, list and get. Every request takes `latency` seconds.
+    """
+
+    def __init__(self, contacts=(), latency=0.05):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeZohoHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.lock = threading.Lock()
+        self.httpd.invoices = []
+        self.httpd.contacts = list(contacts)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def invoices(self):
+        return self.httpd.invoices
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def point_client(self, client):
+        """
+        Sends a ZohoClient's accounts and Books API calls to this server.
+        """
+        client.accounts_url_map = {client.dc: self.url, "com": self.url}
+        client.base_url = f"{self.url}/books/v3"
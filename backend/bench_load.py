@@ -0,0 +1,185 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_PDF = os.path.join(os.path.dirname(HERE), "test_invoice.pdf")
+BENCH_CUSTOMER = "Bench Customer"
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def summarize(name, concurrency, latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    ok = sum(1 for status in statuses if 200 <= status < 300)
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(statuses),
+        "ok": ok,
+        "errors": {str(s): statuses.count(s) for s in sorted(set(statuses)) if not 200 <= s < 300},
+        "p50_ms": round(percentile(ordered, 50) * 1000, 1),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 1),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 1),
+        "throughput_rps": round(len(statuses) / elapsed, 2),
+    }
+
+
+async def drive(make_request, total, concurrency):
+    """
+    Sends `total` requests with at most `concurrency` in flight.
+    make_request(i) returns the awaitable for request i.
+    """
+    latencies = []
+    statuses = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await make_request(i)
+                status = response.status_code
+            except Exception:
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            statuses.append(status)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def unique_pdf(pdf_bytes, i, run_id):
+    # A trailing comment after %%EOF changes the hash (so every upload is a cache miss)
+    # without making the PDF unreadable
+    return pdf_bytes + f"\n% bench {run_id} {i}\n".encode()
+
+
+async def run(args):
+    import httpx
+    import main
+    import gemini
+    from bench_fakes import StubGenerativeModel, FakeZohoServer, load_payloads
+    from zoho_client import get_zoho_client
+
+    payloads = load_payloads()
+    StubGenerativeModel.latency = args.model_latency
+    StubGenerativeModel.jitter = args.model_jitter
+    StubGenerativeModel.payloads = payloads
+    StubGenerativeModel.quota_rpm = args.quota_rpm
+    StubGenerativeModel.tail_ratio = args.model_tail_ratio
+    StubGenerativeModel.tail_latency = args.model_tail_latency
+    gemini.model_class = StubGenerativeModel
+
+    contact = {"contact_id": "1", "contact_name": BENCH_CUSTOMER, "last_modified_time": "2025-01-01T00:00:00+0000"}
+    zoho_server = FakeZohoServer(contacts=[contact], latency=args.zoho_latency).start()
+    zoho_server.point_client(get_zoho_client())
+
+    with open(args.pdf, "rb") as f:
+        pdf_bytes = f.read()
+
+    transport = httpx.ASGITransport(app=main.app)
+    results = []
+    run_id = int(time.time())
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for concurrency in args.concurrency:
+            if "extract" in args.scenarios:
+                def extract(i, concurrency=concurrency):
+                    content = pdf_bytes if args.cache_hits else unique_pdf(pdf_bytes, f"{concurrency}-{i}", run_id)
+                    return client.post("/extract", files={"file": (f"bench-{i}.pdf", content, "application/pdf")})
+
+                latencies, statuses, elapsed = await drive(extract, args.requests, concurrency)
+                results.append(summarize("extract", concurrency, latencies, statuses, elapsed))
+
+            if "zoho" in args.scenarios:
+                def push(i, concurrency=concurrency):
+                    invoice = dict(payloads[i % len(payloads)])
+                    # A new invoice number per request, so the ledger never short-circuits the push
+                    invoice["invoice_number"] = f"BENCH-{run_id}-{concurrency}-{i}"
+                    return client.post("/zoho/create-invoice", json={"customer_name": BENCH_CUSTOMER, "invoice_data": invoice})
+
+                latencies, statuses, elapsed = await drive(push, args.requests, concurrency)
+                results.append(summarize("zoho", concurrency, latencies, statuses, elapsed))
+
+    zoho_server.stop()
+    if args.quota_rpm:
+        print(json.dumps({"quota_rejections": StubGenerativeModel.quota_rejections, **main.gemini_limiter.snapshot()}))
+    if args.model_tail_ratio:
+        print(json.dumps({name: hedger.snapshot() for name, hedger in main.model_hedgers.items()}))
+    return results
+
+
+def configure_environment(workdir):
+    # Must run before main is imported; explicit environment settings win
+    defaults = {
+        "GEMINI_API_KEY": "bench",
+        "EXTRACTION_CACHE_DIR": os.path.join(workdir, "cache"),
+        "JOBS_DB": os.path.join(workdir, "jobs.db"),
+        "INVOICES_DB": os.path.join(workdir, "invoices.db"),
+        "JOB_WORKERS": "0",
+        "TEXT_FAST_PATH": "false",
+        "LOG_LEVEL": "WARNING",
+        "ZOHO_CLIENT_ID": "bench",
+        "ZOHO_CLIENT_SECRET": "bench",
+        "ZOHO_REFRESH_TOKEN": "bench",
+        "ZOHO_ORG_ID": "bench",
+        "ZOHO_CONTACTS_INDEX": os.path.join(workdir, "contacts.json"),
+        "ZOHO_PUSH_LEDGER": os.path.join(workdir, "push_ledger.db"),
+        # Measure the service, not Zoho's per-minute quota
+        "ZOHO_REQUESTS_PER_MINUTE": "1000000",
+        "ZOHO_REQUEST_BURST": "1000",
+        # Likewise for Gemini's quotas, unless --quota-rpm simulates one
+        "GEMINI_LIMITER_DB": os.path.join(workdir, "gemini_limiter.db"),
+        "GEMINI_RPM": "1000000",
+        "GEMINI_TPM": "1000000000",
+        "GEMINI_MAX_CONCURRENCY": "1000",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline load test: runs the API in-process against a stub Gemini model and a fake Zoho server"
+    )
+    parser.add_argument("--scenarios", default="extract,zoho", help="Comma-separated: extract, zoho")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario and concurrency level")
+    parser.add_argument("--model-latency", type=float, default=0.5, help="Stub model latency in seconds")
+    parser.add_argument("--model-jitter", type=float, default=0.2, help="Extra random model latency, up to this many seconds")
+    parser.add_argument("--model-tail-ratio", type=float, default=0.0, help="Share of model calls that take --model-tail-latency")
+    parser.add_argument("--model-tail-latency", type=float, default=10.0, help="Latency of those slow calls in seconds")
+    parser.add_argument("--zoho-latency", type=float, default=0.05, help="Fake Zoho latency per API call in seconds")
+    parser.add_argument("--quota-rpm", type=int, default=None, help="Stub model rejects calls past this many per minute (429)")
+    parser.add_argument("--cache-hits", action="store_true", help="Upload the same PDF every time (measures the cache-hit path)")
+    parser.add_argument("--pdf", default=DEFAULT_PDF, help="PDF to upload")
+    parser.add_argument("--output", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+    args.scenarios = {s.strip() for s in args.scenarios.split(",") if s.strip()}
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    with tempfile.TemporaryDirectory(prefix="bench-load-") as workdir:
+        if args.quota_rpm:
+            # The limiter budgets a little under the stub's quota; 429s then only come from bursts
+            os.environ.setdefault("GEMINI_RPM", str(args.quota_rpm))
+        configure_environment(workdir)
+        sys.path.insert(0, HERE)
+        results = asyncio.run(run(args))
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+            f.write("\n")
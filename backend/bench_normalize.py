@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+
+from normalize import parse_date, normalize_line_items
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "bench_normalize_baseline.json")
+
+# Date values as they come out of extractions, one per supported layout
+DATES = [
+    "Aug 14, 2025", "August 14, 2025", "14 Aug 2025", "14 August 2025", "2025-08-14",
+    "14-08-2025", "14/08/2025", "08/14/2025", "2025/08/14", "١٤/٠٨/٢٠٢٥", "1447/02/20 هـ",
+]
+LINE_ITEM = {"description": "Item", "quantity": "1.00", "unit_price": "1,098.25", "total": "SAR 1,098.25"}
+
+# The strptime loop normalize.parse_date replaced in zoho_client, kept for comparison
+STRPTIME_FORMATS = [
+    "%b %d, %Y", "%B %d, %Y", "%d %b %Y", "%d %B %Y", "%Y-%m-%d",
+    "%d-%m-%Y", "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d",
+]
+
+
+def strptime_date(value):
+    for fmt in STRPTIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def float_line_items(items):
+    # The amount cleanup normalize_line_items replaced in zoho_client, kept for comparison
+    for item in items:
+        for field in ("quantity", "unit_price", "total"):
+            value = item.get(field)
+            if not value:
+                item[field] = 0.0
+                continue
+            try:
+                item[field] = float(str(value).replace(",", "").replace("$", "").strip())
+            except ValueError:
+                item[field] = 0.0
+    return items
+
+
+def rate(func, values, min_seconds):
+    """
+    Calls func on every value repeatedly for at least min_seconds; returns calls per second.
+    """
+    for value in values:
+        func(value)
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for value in values:
+            func(value)
+        calls += len(values)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+
+def paired_rates(func, reference, values, min_seconds, slices=4):
+    """
+    Rates of func and reference, measured in alternating slices so both see the same
+    machine load. Returns (func calls/s, reference calls/s).
+    """
+    rates = ([], [])
+    for _ in range(slices):
+        for index, target in enumerate((func, reference)):
+            rates[index].append(rate(target, values, min_seconds / slices))
+    return sum(rates[0]) / slices, sum(rates[1]) / slices
+
+
+def run_benchmark(min_seconds=1.0):
+    """
+    Each rate is paired with the code it replaced, timed in the same run; the gate compares
+    those ratios, which hold across machines where absolute rates do not.
+    """
+    sellers = [f"3{i:013d}3" for i in range(len(DATES))]
+    with_seller = list(zip(DATES, sellers))
+
+    dates_per_second, strptime_per_second = paired_rates(parse_date, strptime_date, DATES, min_seconds)
+
+    items_per_list = 50
+    line_items, float_items = paired_rates(
+        lambda _: normalize_line_items([dict(LINE_ITEM) for _ in range(items_per_list)]),
+        lambda _: float_line_items([dict(LINE_ITEM) for _ in range(items_per_list)]),
+        [None], min_seconds,
+    )
+
+    return {
+        "dates_per_second": round(dates_per_second),
+        "seller_cached_dates_per_second": round(rate(lambda pair: parse_date(*pair), with_seller, min_seconds)),
+        "strptime_dates_per_second": round(strptime_per_second),
+        "line_items_per_second": round(line_items * items_per_list),
+        "float_line_items_per_second": round(float_items * items_per_list),
+        "dates_vs_strptime": round(dates_per_second / strptime_per_second, 3),
+        "line_items_vs_float": round(line_items / float_items, 3),
+        "unparsed_by_strptime": [value for value in DATES if strptime_date(value) is None],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark for normalize.parse_date and normalize_line_items")
+    parser.add_argument("--seconds", type=float, default=1.0, help="Minimum run time per measurement")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed drop in each ratio vs. baseline (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run's ratios as the new baseline")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.seconds)
+    print(json.dumps(result, indent=4, ensure_ascii=False))
+
+    gated = ("dates_vs_strptime", "line_items_vs_float")
+    if args.update_baseline:
+        # Only the ratios are recorded; absolute rates depend on the machine
+        with open(args.baseline, "w") as f:
+            json.dump({metric: result[metric] for metric in gated}, f, indent=4)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --update-baseline to record one.")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    failed = False
+    for metric in gated:
+        floor = baseline[metric] * (1 - args.tolerance)
+        print(f"Baseline: {baseline[metric]} {metric}, floor: {floor:.3f}")
+        if result[metric] < floor:
+            print(f"FAIL: {metric} regressed")
+            failed = True
+    if failed:
+        sys.exit(1)
+    print("PASS")
@@ -0,0 +1,155 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+from parser import parse_invoice_text, iter_corpus, count_pages, iter_lines
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "text_dumps")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "bench_parser_baseline.json")
+
+
+def reference_parse_invoice_text(text):
+    """
+    Frozen copy of the original multi-pass parser, timed in the same run as the current
+    one. The gate compares the ratio of the two, which holds across machines where an
+    absolute pages/s figure does not.
+    """
+    data = {
+        "invoice_number": None, "citation_date": None, "due_date": None, "total_amount": None,
+        "vat_number": None, "company_name_en": None, "company_name_ar": None,
+        "potential_line_items": [], "arabic_lines": [], "all_lines": [],
+    }
+    lines = [line.strip() for line in text.split('\n') if line.strip()]
+    data["all_lines"] = lines
+
+    date_pattern = re.compile(r'([A-Za-z]{3}\s+\d{1,2},\s+\d{4})')
+    amount_pattern = re.compile(r'\b\d+\.\d{2}\b')
+    vat_pattern = re.compile(r'\b3\d{14}\b')
+    arabic_pattern = re.compile(r'[\u0600-\u06FF]+')
+
+    dates_found = []
+    amounts_found = []
+    for line in lines:
+        if arabic_pattern.search(line):
+            data["arabic_lines"].append(line)
+            if not data["company_name_ar"] and len(line) > 10:
+                data["company_name_ar"] = line
+        dates = date_pattern.findall(line)
+        if dates:
+            dates_found.extend(dates)
+        amounts = amount_pattern.findall(line)
+        if amounts:
+            amounts_found.extend([float(x) for x in amounts])
+        vat = vat_pattern.search(line)
+        if vat and not data["vat_number"]:
+            data["vat_number"] = vat.group(0)
+        if "Invoice No" in line or "6051" in line:
+            clean_line = re.sub(r'[^\w\s]', '', line)
+            if clean_line.strip().isdigit():
+                data["invoice_number"] = clean_line.strip()
+
+    if not data["invoice_number"]:
+        for line in lines:
+            clean_line = line.strip()
+            if clean_line.isdigit() and len(clean_line) >= 4 and clean_line != "2025":
+                if "202" not in clean_line:
+                    data["invoice_number"] = clean_line
+                    break
+
+    if dates_found:
+        data["citation_date"] = dates_found[0]
+        if len(dates_found) > 1:
+            data["due_date"] = dates_found[-1]
+    if amounts_found:
+        data["total_amount"] = max(amounts_found)
+
+    for line in lines[:10]:
+        if "EST" in line or "TRADING" in line or "COMPANY" in line or "LTD" in line:
+            data["company_name_en"] = line
+            break
+
+    for line in lines:
+        nums = amount_pattern.findall(line)
+        if len(nums) >= 2:
+            data["potential_line_items"].append({"raw_line": line, "values": nums})
+
+    return data
+
+
+def _time_rounds(parse, documents, seconds):
+    # Warm up once so imports and regex caches are not timed
+    for text in documents:
+        parse(text)
+    rounds = 0
+    started = time.perf_counter()
+    while True:
+        for text in documents:
+            parse(text)
+        rounds += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds:
+            return rounds, elapsed
+
+
+def run_benchmark(corpus, min_seconds=2.0, slices=4):
+    """
+    Parses the whole corpus with the current and the reference parser, alternating in
+    `slices` slices so both see the same machine load, for at least min_seconds each.
+    Returns pages per second for both and the speedup of the current parser over the reference.
+    """
+    documents = [text for _, text in iter_corpus([corpus])]
+    if not documents:
+        raise SystemExit(f"No .txt files found in {corpus}")
+    pages_per_round = sum(count_pages(list(iter_lines(text))) for text in documents)
+
+    totals = {"current": [0, 0.0], "reference": [0, 0.0]}
+    for _ in range(slices):
+        for name, parse in (("current", parse_invoice_text), ("reference", reference_parse_invoice_text)):
+            rounds, elapsed = _time_rounds(parse, documents, min_seconds / slices)
+            totals[name][0] += rounds
+            totals[name][1] += elapsed
+
+    pages_per_second = {name: pages_per_round * rounds / elapsed for name, (rounds, elapsed) in totals.items()}
+    return {
+        "documents": len(documents),
+        "pages_per_second": round(pages_per_second["current"], 1),
+        "reference_pages_per_second": round(pages_per_second["reference"], 1),
+        "speedup": round(pages_per_second["current"] / pages_per_second["reference"], 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmark for parser.parse_invoice_text")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Directory of .txt text dumps")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Minimum run time per parser")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed drop in speedup vs. baseline (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run's speedup as the new baseline")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.corpus, args.seconds)
+    print(json.dumps(result, indent=4))
+
+    if args.update_baseline:
+        # Only the ratio is recorded; absolute throughput depends on the machine
+        with open(args.baseline, "w") as f:
+            json.dump({"speedup": result["speedup"]}, f, indent=4)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --update-baseline to record one.")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    floor = baseline["speedup"] * (1 - args.tolerance)
+    print(f"Baseline speedup over the reference parser: {baseline['speedup']}x, floor: {floor:.2f}x")
+    if result["speedup"] < floor:
+        print("FAIL: parser throughput regressed")
+        sys.exit(1)
+    print("PASS")
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(HERE, "fixtures", "bench_startup_baseline.json")
+
+# Modules that must not be imported until the first request needs them
+LAZY_MODULES = ["google.generativeai", "pypdf", "openpyxl", "pyarrow"]
+
+# Runs in a fresh interpreter: time `import main` plus the first request to /
+PROBE = """
+import sys, time, json
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from starlette.testclient import TestClient
+TestClient(main.app).get("/")
+served = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "first_request_seconds": served - started,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+# Reference timed in the same run: importing the framework alone. The gate compares the ratio,
+# which holds across machines where an absolute import time does not.
+REFERENCE_PROBE = """
+import time, json
+started = time.perf_counter()
+import fastapi
+print(json.dumps({"import_seconds": time.perf_counter() - started}))
+"""
+
+
+def measure_once(env, probe=None):
+    output = subprocess.run(
+        [sys.executable, "-c", probe or PROBE % LAZY_MODULES],
+        cwd=HERE, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env, count=10):
+    """
+    The modules with the largest cumulative import time, from python -X importtime.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=HERE, env=env, capture_output=True, text=True, check=True,
+    ).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time:  self [us] | cumulative | imported package" (nesting shown by indentation)
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings.append((int(cumulative), name.strip()))
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in sorted(timings, reverse=True)[:count]]
+
+
+def run_benchmark(runs=5):
+    env = dict(os.environ)
+    # Startup must not depend on credentials; the readiness probe reports them instead
+    env.pop("GEMINI_API_KEY", None)
+    env.setdefault("LOG_LEVEL", "WARNING")
+    env.setdefault("JOB_WORKERS", "0")
+
+    samples, references = [], []
+    for _ in range(runs):
+        # Alternate, so both see the same machine load
+        samples.append(measure_once(env))
+        references.append(measure_once(env, REFERENCE_PROBE))
+    import_seconds = statistics.median(s["import_seconds"] for s in samples)
+    reference_seconds = statistics.median(s["import_seconds"] for s in references)
+    return {
+        "runs": runs,
+        "import_seconds": round(import_seconds, 3),
+        "first_request_seconds": round(statistics.median(s["first_request_seconds"] for s in samples), 3),
+        "fastapi_import_seconds": round(reference_seconds, 3),
+        "import_vs_fastapi": round(import_seconds / reference_seconds, 3),
+        "eagerly_loaded": sorted({m for s in samples for m in s["loaded"]}),
+        "slowest_imports": slowest_imports(env),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: time to import main and serve the first request")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to measure (the median is reported)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed rise in the ratio vs. baseline (0.25 = 25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="Write this run's ratio as the new baseline")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.runs)
+    print(json.dumps(result, indent=4))
+
+    if result["eagerly_loaded"]:
+        print(f"FAIL: imported at startup: {', '.join(result['eagerly_loaded'])}")
+        sys.exit(1)
+
+    if args.update_baseline:
+        # Only the ratio is recorded; absolute import time depends on the machine
+        with open(args.baseline, "w") as f:
+            json.dump({"import_vs_fastapi": result["import_vs_fastapi"]}, f, indent=4)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --update-baseline to record one.")
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    ceiling = baseline["import_vs_fastapi"] * (1 + args.tolerance)
+    print(f"Baseline: import main takes {baseline['import_vs_fastapi']}x import fastapi, ceiling: {ceiling:.2f}x")
+    if result["import_vs_fastapi"] > ceiling:
+        print("FAIL: startup time regressed")
+        sys.exit(1)
+    print("PASS")
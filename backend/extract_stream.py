@@ -0,0 +1,183 @@
+import json
+import time
+import asyncio
+import contextvars
+
+from metrics import FIRST_FIELD_SECONDS
+from normalize import normalize_invoice, normalize_line_items
+
+# SSE comment sent when no event went out for this long, so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+
+# Set while /extract/stream runs an extraction. run_model_extraction then streams the
+# model's reply and reports fields here as they complete; otherwise nothing changes.
+current_events = contextvars.ContextVar("current_events", default=None)
+
+
+class InvoiceStreamParser:
+    """
+    Incremental scanner over the invoice JSON as the model streams it.
+    feed() takes the next text chunk and returns what became complete in it:
+    ("field", name, value) for top-level fields and ("line_item", index, item) for each
+    element of line_items. Each character is scanned once, however the text is chunked.
+    """
+
+    def __init__(self, list_key="line_items"):
+        self.list_key = list_key
+        self.text = ""
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.key = None
+        self.key_start = None
+        self.value_start = None
+        self.item_start = None
+        self.items = 0
+
+    def feed(self, chunk):
+        start = len(self.text)
+        self.text += chunk
+        text = self.text
+        found = []
+        for pos in range(start, len(text)):
+            ch = text[pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                    if self.key_start is not None:
+                        self.key = self._decode(text[self.key_start:pos + 1])
+                        self.key_start = None
+            elif ch == '"':
+                self.in_string = True
+                # A string at the top level before the colon is a key
+                if self.depth == 1 and self.key is None and self.value_start is None:
+                    self.key_start = pos
+            elif ch == ":" and self.depth == 1 and self.value_start is None:
+                self.value_start = pos + 1
+            elif ch == "{" or ch == "[":
+                if ch == "{" and self.depth == 2 and self.key == self.list_key:
+                    self.item_start = pos
+                self.depth += 1
+            elif ch == "}" or ch == "]":
+                self.depth -= 1
+                if self.depth == 2 and self.item_start is not None:
+                    item = self._decode(text[self.item_start:pos + 1])
+                    self.item_start = None
+                    if item is not None:
+                        found.append(("line_item", self.items, item))
+                        self.items += 1
+                elif self.depth == 0:
+                    self._end_value(pos, found)
+            elif ch == "," and self.depth == 1:
+                self._end_value(pos, found)
+        return found
+
+    def _end_value(self, pos, found):
+        if self.key is not None and self.value_start is not None and self.key != self.list_key:
+            value = self._decode(self.text[self.value_start:pos])
+            found.append(("field", self.key, value))
+        self.key = None
+        self.value_start = None
+
+    @staticmethod
+    def _decode(fragment):
+        # A malformed reply is caught by schema validation at the end; skip the event here
+        try:
+            return json.loads(fragment)
+        except ValueError:
+            return None
+
+
+def _normalized(kind, name, value):
+    # Same normalization as the final result, so values do not change when it arrives
+    if kind == "line_item":
+        return normalize_line_items([value])[0] if isinstance(value, dict) else value
+    return normalize_invoice({name: value})[name]
+
+
+class ExtractionEvents:
+    """
+    The events of one streamed extraction, in order, plus when the first field arrived.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.started = time.perf_counter()
+        self.first_field_seconds = None
+        self.source = None
+
+    def emit(self, event, data):
+        if event == "model":
+            self.source = data["model"]
+        elif event in ("field", "line_item", "result") and self.first_field_seconds is None:
+            self.first_field_seconds = time.perf_counter() - self.started
+            source = self.source
+            if event == "result":
+                # A cache hit or text-layer result arrives whole, as the "result" event
+                source = "cache" if data.get("cache") == "hit" else data.get("source")
+            FIRST_FIELD_SECONDS.observe(self.first_field_seconds, source=source or "unknown")
+        if event == "result":
+            data = {**data, "first_field_ms": round(self.first_field_seconds * 1000, 1)}
+        self.queue.put_nowait((event, data))
+
+    def close(self):
+        self.queue.put_nowait((None, None))
+
+    async def stream(self, work):
+        """
+        Runs the work coroutine and yields its events as SSE messages until close().
+        If the client disconnects, the work is cancelled.
+        """
+        task = asyncio.create_task(work)
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(self.queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        finally:
+            if not task.done():
+                task.cancel()
+
+
+def emit(event, data):
+    """
+    Sends an event to the streamed extraction running in this context, if any.
+    """
+    events = current_events.get()
+    if events is not None:
+        events.emit(event, data)
+
+
+def _chunk_text(chunk):
+    # The last chunk of a stream can carry only the finish reason and no text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+async def relay_stream(response, events):
+    """
+    Reads a streamed generate_content reply, emitting fields and line items as they become
+    complete. Returns the full reply text.
+    """
+    parser = InvoiceStreamParser()
+    parts = []
+    async for chunk in response:
+        text = _chunk_text(chunk)
+        parts.append(text)
+        for kind, name, value in parser.feed(text):
+            if kind == "field":
+                events.emit("field", {"name": name, "value": _normalized(kind, name, value)})
+            else:
+                events.emit("line_item", {"index": name, "item": _normalized(kind, name, value)})
+    return "".join(parts)
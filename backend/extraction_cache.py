@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def key_for_digest(digest, model_name, prompt_version):
+    """
+    Content-addressed key for an extraction, from the SHA-256 digest of the PDF bytes.
+    The same PDF sent to the same model with the same prompt always maps to the same key,
+    whatever the uploaded filename was.
+    """
+    return hashlib.sha256(f"{digest}:{model_name}:{prompt_version}".encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-tier cache for model extractions.
+
+    - Memory tier: bounded LRU of parsed responses (max_entries).
+    - Disk tier: one JSON file per key under cache_dir, evicted by age (max_age_seconds)
+      and by total size (max_disk_bytes, oldest first).
+    """
+
+    def __init__(self, cache_dir="cache/extractions", max_entries=256,
+                 max_disk_bytes=512 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # key -> (size, mtime) for the disk tier, so eviction does not rescan the directory
+        self._disk_index = {}
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                path = os.path.join(self.cache_dir, name)
+                st = os.stat(path)
+                self._disk_index[name[:-5]] = (st.st_size, st.st_mtime)
+        self._evict_disk()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key, disk=True):
+        """
+        Returns the cached entry for key, or None.
+        Disk hits are promoted into the memory tier.
+        With disk=False only the memory tier is looked at (no file I/O, safe on the event
+        loop) and a miss is not counted, since the caller goes on to the full lookup.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry["created_at"]):
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry
+            if not disk:
+                return None
+            if entry is not None:
+                self._drop(key)
+
+            if key in self._disk_index:
+                try:
+                    with open(self.path_for(key), "r") as f:
+                        entry = json.load(f)
+                except (OSError, ValueError):
+                    entry = None
+
+                if entry is not None and not self._expired(entry.get("created_at", 0)):
+                    self._remember(key, entry)
+                    self.stats["disk_hits"] += 1
+                    return entry
+                self._drop(key)
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key, response, **metadata):
+        """
+        Stores a parsed model response under key in both tiers.
+        Returns the stored entry.
+        """
+        entry = dict(metadata)
+        entry["key"] = key
+        entry["created_at"] = time.time()
+        entry["response"] = response
+
+        path = self.path_for(key)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._disk_index[key] = (os.path.getsize(path), entry["created_at"])
+            self._remember(key, entry)
+            self.stats["writes"] += 1
+            self._evict_disk()
+        return entry
+
+    def invalidate(self, key):
+        with self._lock:
+            self._drop(key)
+
+    def snapshot(self):
+        with self._lock:
+            hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+            lookups = hits + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": sum(size for size, _ in self._disk_index.values()),
+            }
+
+    def _expired(self, created_at):
+        return self.max_age_seconds and time.time() - created_at > self.max_age_seconds
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _drop(self, key):
+        self._memory.pop(key, None)
+        if self._disk_index.pop(key, None) is not None:
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def _evict_disk(self):
+        now = time.time()
+        if self.max_age_seconds:
+            for key, (_, mtime) in list(self._disk_index.items()):
+                if now - mtime > self.max_age_seconds:
+                    self._drop(key)
+                    self.stats["evictions"] += 1
+
+        total = sum(size for size, _ in self._disk_index.values())
+        if total <= self.max_disk_bytes:
+            return
+        for key, (size, _) in sorted(self._disk_index.items(), key=lambda kv: kv[1][1]):
+            self._drop(key)
+            self.stats["evictions"] += 1
+            total -= size
+            if total <= self.max_disk_bytes:
+                break
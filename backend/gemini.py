@@ -0,0 +1,73 @@
+import os
+import threading
+
+# google.generativeai takes most of a second to import (gRPC stubs, protobuf types), so it is
+# imported on first use instead of at startup. Scale-to-zero containers then answer health
+# checks straight away and pay the import on the first extraction (or on /ready).
+
+_sdk = None
+_sdk_lock = threading.Lock()
+_models = {}
+_models_lock = threading.Lock()
+
+# Replaces genai.GenerativeModel when set (bench_load.py uses a stub)
+model_class = None
+
+
+class GeminiNotConfigured(RuntimeError):
+    pass
+
+
+def is_configured():
+    return bool(os.getenv("GEMINI_API_KEY"))
+
+
+def sdk():
+    """
+    Returns the google.generativeai module, importing and configuring it on first call.
+    Raises GeminiNotConfigured when GEMINI_API_KEY is missing.
+    """
+    global _sdk
+    if _sdk is None:
+        with _sdk_lock:
+            if _sdk is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise GeminiNotConfigured("GEMINI_API_KEY not found in environment variables")
+                import google.generativeai as genai
+
+                genai.configure(api_key=api_key)
+                _sdk = genai
+    return _sdk
+
+
+def get_model(model_name, response_schema=None):
+    """
+    Returns the GenerativeModel for model_name with JSON output constrained to
+    response_schema (a dict from schemas.gemini_schema), built once and reused.
+    The schema is converted to protobuf when the model is built, so reuse also saves that.
+    """
+    # Schemas are module-level constants, so their identity is a stable key
+    config_key = (model_name, id(response_schema))
+    model = _models.get(config_key)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        model = _models.get(config_key)
+        if model is None:
+            cls = model_class or sdk().GenerativeModel
+            generation_config = None
+            if response_schema is not None:
+                generation_config = {"response_mime_type": "application/json", "response_schema": response_schema}
+            model = cls(model_name, generation_config=generation_config)
+            _models[config_key] = model
+    return model
+
+
+def reset():
+    """
+    Drops the cached models (after changing model_class or the environment).
+    """
+    with _models_lock:
+        _models.clear()
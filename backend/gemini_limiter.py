@@ -0,0 +1,341 @@
+import os
+import time
+import uuid
+import random
+import asyncio
+import sqlite3
+import logging
+import threading
+
+from admission import AdmissionRejected
+from metrics import GEMINI_QUOTA_ERRORS, stage
+
+logger = logging.getLogger(__name__)
+
+# Longest single sleep while waiting for budget; other processes may free capacity sooner
+MAX_WAIT_STEP = 0.5
+
+
+class QuotaExceeded(AdmissionRejected):
+    """
+    Raised when a call still hit the Gemini quota after every retry.
+    An AdmissionRejected, so callers answer it with 503 and Retry-After the same way.
+    """
+
+    def __init__(self, model, retry_after):
+        super().__init__(retry_after)
+        self.args = (f"Gemini quota exceeded for {model}, retry after {retry_after}s",)
+        self.model = model
+
+
+def is_quota_error(error):
+    """
+    True for the SDK's ResourceExhausted / TooManyRequests (HTTP 429) errors, without
+    importing google.api_core.
+    """
+    return getattr(error, "code", None) == 429 or type(error).__name__ in ("ResourceExhausted", "TooManyRequests")
+
+
+def parse_limits(value):
+    """
+    "1000" (every model) or "gemini-2.5-flash=1000,gemini-2.5-pro=150" -> ({model: limit}, default).
+    """
+    limits, default = {}, None
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "=" in part:
+            model, limit = part.split("=", 1)
+            limits[model.strip()] = float(limit)
+        else:
+            default = float(part)
+    return limits, default
+
+
+class Lease:
+    """
+    One admitted call. Set tokens to the call's total_token_count once it is known, so
+    the limiter can correct its estimate.
+    """
+
+    def __init__(self, lease_id, model, estimate):
+        self.id = lease_id
+        self.model = model
+        self.estimate = estimate
+        self.tokens = None
+
+
+class GeminiRateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute budgets per model, shared by every process
+    on the host through one SQLite file, plus an AIMD concurrency limit.
+
+    Each budget is a token bucket refilling at (per_minute - burst) / 60 per second, as in
+    zoho_client.TokenBucket, so a steady stream of calls runs at the quota without
+    tripping it. A call is charged its estimated tokens up front (a moving average of
+    actual usage) and corrected when it finishes.
+    The concurrency limit grows by 1/limit per successful call and halves on a quota
+    error, which also pauses the model for every process until retry_after has passed.
+    Callers wait for budget; they are never turned away.
+    """
+
+    def __init__(self, db_path="data/gemini_limiter.db", rpm=None, tpm=None, max_concurrency=16,
+                 min_concurrency=1, token_estimate=4000, lease_seconds=600, quota_backoff=10.0):
+        self.db_path = db_path
+        self.rpm_limits, self.default_rpm = rpm or ({}, None)
+        self.tpm_limits, self.default_tpm = tpm or ({}, None)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.token_estimate = token_estimate
+        self.lease_seconds = lease_seconds
+        self.quota_backoff = quota_backoff
+        self.stats = {"admitted": 0, "waited": 0, "quota_errors": 0, "wait_seconds": 0.0}
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS gemini_budget (
+                model TEXT PRIMARY KEY,
+                requests REAL NOT NULL,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL,
+                concurrency REAL NOT NULL,
+                paused_until REAL NOT NULL DEFAULT 0,
+                avg_tokens REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS gemini_leases (
+                id TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                pid INTEGER NOT NULL,
+                expires REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_gemini_leases_model ON gemini_leases (model);
+        """)
+
+    def _limits(self, model):
+        rpm = self.rpm_limits.get(model, self.default_rpm)
+        tpm = self.tpm_limits.get(model, self.default_tpm)
+        return rpm, tpm
+
+    @staticmethod
+    def _bucket(per_minute):
+        # (capacity, refill per second); a tenth of the minute's budget may go out at once
+        burst = max(1.0, per_minute / 10)
+        return burst, max(per_minute - burst, 1) / 60.0
+
+    def _state(self, model, now):
+        row = self._conn.execute("SELECT * FROM gemini_budget WHERE model = ?", (model,)).fetchone()
+        rpm, tpm = self._limits(model)
+        if row is None:
+            state = {
+                "requests": self._bucket(rpm)[0] if rpm else 0.0,
+                "tokens": self._bucket(tpm)[0] if tpm else 0.0,
+                "updated": now, "concurrency": float(self.max_concurrency),
+                "paused_until": 0.0, "avg_tokens": float(self.token_estimate),
+            }
+        else:
+            state = dict(row)
+            state.pop("model")
+        elapsed = max(0.0, now - state["updated"])
+        if rpm:
+            capacity, rate = self._bucket(rpm)
+            state["requests"] = min(capacity, state["requests"] + elapsed * rate)
+        if tpm:
+            capacity, rate = self._bucket(tpm)
+            state["tokens"] = min(capacity, state["tokens"] + elapsed * rate)
+        state["updated"] = now
+        return state
+
+    def _save(self, model, state):
+        self._conn.execute(
+            "INSERT INTO gemini_budget (model, requests, tokens, updated, concurrency, paused_until, avg_tokens) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (model) DO UPDATE SET requests = excluded.requests, tokens = excluded.tokens, "
+            "updated = excluded.updated, concurrency = excluded.concurrency, "
+            "paused_until = excluded.paused_until, avg_tokens = excluded.avg_tokens",
+            (model, state["requests"], state["tokens"], state["updated"], state["concurrency"],
+             state["paused_until"], state["avg_tokens"]),
+        )
+
+    def _in_flight(self, model, now):
+        rows = self._conn.execute("SELECT id, pid, expires FROM gemini_leases WHERE model = ?", (model,)).fetchall()
+        live = 0
+        for row in rows:
+            if row["expires"] < now or not _pid_alive(row["pid"]):
+                # The process holding it crashed or hung past the lease
+                self._conn.execute("DELETE FROM gemini_leases WHERE id = ?", (row["id"],))
+            else:
+                live += 1
+        return live
+
+    def try_acquire(self, model):
+        """
+        Takes a lease for one call to model if the budgets and the concurrency limit allow.
+        Returns (lease, 0) or (None, seconds to wait before trying again).
+        """
+        now = time.time()
+        rpm, tpm = self._limits(model)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                state = self._state(model, now)
+                estimate = state["avg_tokens"]
+                wait = state["paused_until"] - now
+                if rpm and state["requests"] < 1:
+                    wait = max(wait, (1 - state["requests"]) / self._bucket(rpm)[1])
+                if tpm:
+                    # A call larger than the burst only needs a full bucket, and leaves it in debt
+                    needed = min(estimate, self._bucket(tpm)[0])
+                    if state["tokens"] < needed:
+                        wait = max(wait, (needed - state["tokens"]) / self._bucket(tpm)[1])
+                if wait <= 0 and self._in_flight(model, now) >= max(self.min_concurrency, int(state["concurrency"])):
+                    wait = MAX_WAIT_STEP
+
+                lease = None
+                if wait <= 0:
+                    if rpm:
+                        state["requests"] -= 1
+                    if tpm:
+                        state["tokens"] -= estimate
+                    lease = Lease(uuid.uuid4().hex, model, estimate)
+                    self._conn.execute(
+                        "INSERT INTO gemini_leases (id, model, pid, expires) VALUES (?, ?, ?, ?)",
+                        (lease.id, model, os.getpid(), now + self.lease_seconds),
+                    )
+                self._save(model, state)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return lease, max(wait, 0.0)
+
+    def release(self, lease, quota_error=False, retry_after=None):
+        """
+        Ends a lease. A quota error halves the model's concurrency limit and pauses it for
+        retry_after seconds; any other outcome grows the limit by 1/limit.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM gemini_leases WHERE id = ?", (lease.id,))
+                state = self._state(lease.model, now)
+                if quota_error:
+                    state["concurrency"] = max(float(self.min_concurrency), state["concurrency"] / 2)
+                    state["paused_until"] = max(state["paused_until"], now + (retry_after or self.quota_backoff))
+                    # The quota is already used up: the requests budget starts over empty
+                    state["requests"] = min(state["requests"], 0.0)
+                else:
+                    state["concurrency"] = min(float(self.max_concurrency), state["concurrency"] + 1 / state["concurrency"])
+                if lease.tokens is not None:
+                    if self._limits(lease.model)[1]:
+                        state["tokens"] -= lease.tokens - lease.estimate
+                    state["avg_tokens"] = 0.8 * state["avg_tokens"] + 0.2 * lease.tokens
+                self._save(lease.model, state)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def acquire(self, model):
+        """
+        Waits until a call to model fits the budgets, then returns its Lease.
+        """
+        started = time.monotonic()
+        waited = False
+        with stage("gemini_rate_wait"):
+            while True:
+                lease, wait = await asyncio.to_thread(self.try_acquire, model)
+                if lease is not None:
+                    break
+                waited = True
+                # Jitter keeps waiting processes from retrying in lockstep
+                await asyncio.sleep(min(wait, MAX_WAIT_STEP) * random.uniform(0.8, 1.2))
+        self.stats["admitted"] += 1
+        if waited:
+            self.stats["waited"] += 1
+            self.stats["wait_seconds"] += time.monotonic() - started
+        return lease
+
+    async def call(self, model, func, retries=5):
+        """
+        Runs func(lease) within the budgets of model. On a quota error the call waits for
+        the pause and is retried, up to `retries` times; then QuotaExceeded is raised.
+        """
+        attempt = 0
+        while True:
+            lease = await self.acquire(model)
+            try:
+                result = await func(lease)
+            except Exception as e:
+                if not is_quota_error(e):
+                    await asyncio.to_thread(self.release, lease)
+                    raise
+                self.stats["quota_errors"] += 1
+                GEMINI_QUOTA_ERRORS.inc(model=model)
+                retry_after = _retry_after(e) or self.quota_backoff * 2 ** min(attempt, 4)
+                await asyncio.to_thread(self.release, lease, True, retry_after)
+                attempt += 1
+                logger.warning("Gemini quota exceeded", extra={"model": model, "attempt": attempt, "retry_after": retry_after})
+                if attempt > retries:
+                    raise QuotaExceeded(model, int(retry_after) + 1) from e
+                continue
+            except BaseException:
+                # Cancelled: hand the lease back without counting it either way
+                await asyncio.shield(asyncio.to_thread(self._drop, lease))
+                raise
+            await asyncio.to_thread(self.release, lease)
+            return result
+
+    def _drop(self, lease):
+        with self._lock:
+            self._conn.execute("DELETE FROM gemini_leases WHERE id = ?", (lease.id,))
+
+    def snapshot(self):
+        now = time.time()
+        with self._lock:
+            models = [row["model"] for row in self._conn.execute("SELECT model FROM gemini_budget").fetchall()]
+            budgets = {}
+            for model in models:
+                state = self._state(model, now)
+                rpm, tpm = self._limits(model)
+                budgets[model] = {
+                    "rpm": rpm,
+                    "tpm": tpm,
+                    "requests_available": round(state["requests"], 2),
+                    "tokens_available": round(state["tokens"]),
+                    "concurrency_limit": round(state["concurrency"], 2),
+                    "in_flight": self._conn.execute(
+                        "SELECT COUNT(*) FROM gemini_leases WHERE model = ?", (model,)
+                    ).fetchone()[0],
+                    "paused_for": round(max(0.0, state["paused_until"] - now), 1),
+                    "avg_tokens": round(state["avg_tokens"]),
+                }
+        return {**self.stats, "wait_seconds": round(self.stats["wait_seconds"], 3), "models": budgets}
+
+
+def _retry_after(error):
+    # google.rpc RetryInfo, when the error carries it
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(getattr(detail, "retry_delay", None), "seconds", None)
+        if delay:
+            return float(delay)
+    return None
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,403 @@
+import os
+import sys
+import json
+import time
+import errno
+import ctypes
+import ctypes.util
+import signal
+import struct
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import argparse
+import threading
+
+from uploads import PdfUpload
+
+logger = logging.getLogger(__name__)
+
+DONE = "done"
+FAILED = "failed"
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class IngestCheckpoint:
+    """
+    SQLite record of every PDF the ingester finished, keyed by SHA-256, so a restart (or
+    the same file dropped twice) never extracts a finished document again.
+    """
+
+    def __init__(self, db_path="data/ingest.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS ingested (
+                digest TEXT PRIMARY KEY,
+                filename TEXT,
+                status TEXT NOT NULL,
+                cache TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL
+            );
+        """)
+
+    def get(self, digest):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM ingested WHERE digest = ?", (digest,)).fetchone()
+        return dict(row) if row else None
+
+    def _record(self, digest, filename, status, attempts, cache=None, error=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO ingested (digest, filename, status, cache, error, attempts, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (digest) DO UPDATE SET filename = excluded.filename, status = excluded.status, "
+                "cache = excluded.cache, error = excluded.error, attempts = excluded.attempts, "
+                "updated_at = excluded.updated_at",
+                (digest, filename, status, cache, error, attempts, time.time()),
+            )
+
+    def done(self, digest, filename, attempts, cache_status):
+        self._record(digest, filename, DONE, attempts, cache=cache_status)
+
+    def failed(self, digest, filename, attempts, error):
+        self._record(digest, filename, FAILED, attempts, error=error)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM ingested GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class InotifyWatcher:
+    """
+    Reports files closed after writing or moved into a directory, via inotify through
+    ctypes (no extra dependency). Raises OSError where inotify is unavailable.
+    """
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def read(self):
+        """
+        Returns the names from the pending events, or None when the kernel queue
+        overflowed and the directory has to be rescanned.
+        """
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            if mask & IN_Q_OVERFLOW:
+                return None
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Ingester:
+    """
+    Feeds the PDFs dropped into watch_dir through `extract`, a coroutine taking
+    (PdfUpload, filename) and returning (entry, cache_status), with `workers` running
+    at a time. Finished files move to done_dir; files that still fail after
+    max_attempts move to failed_dir.
+    """
+
+    def __init__(self, extract, watch_dir, done_dir, failed_dir, checkpoint, workers=2,
+                 max_attempts=3, retry_delay=5.0, poll_interval=2.0, settle_seconds=2.0, use_inotify=True):
+        self.extract = extract
+        self.watch_dir = watch_dir
+        self.done_dir = done_dir
+        self.failed_dir = failed_dir
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.settle_seconds = settle_seconds
+        self.use_inotify = use_inotify
+        self.stats = {"done": 0, "skipped": 0, "retried": 0, "failed": 0}
+        # Bounded, so a burst of thousands of files is not all held in memory at once
+        self._queue = asyncio.Queue(maxsize=workers * 4)
+        # Names queued, being processed or waiting for a retry
+        self._pending = set()
+        self._attempts = {}
+        self._retries = set()
+        for directory in (watch_dir, done_dir, failed_dir):
+            os.makedirs(directory, exist_ok=True)
+
+    def _candidates(self):
+        """
+        PDFs in the watch directory, oldest first.
+        """
+        entries = []
+        with os.scandir(self.watch_dir) as it:
+            for entry in it:
+                if entry.name.lower().endswith(".pdf") and not entry.name.startswith(".") and entry.is_file():
+                    entries.append((entry.stat().st_mtime, entry.name))
+        return sorted(entries)
+
+    async def _enqueue(self, name):
+        if name in self._pending or not name.lower().endswith(".pdf") or name.startswith("."):
+            return
+        self._pending.add(name)
+        await self._queue.put(name)
+
+    async def scan(self, settled_only=False):
+        """
+        Queues every PDF in the watch directory. With settled_only, only files that have
+        not been modified for settle_seconds (a scanner may still be writing the rest).
+        """
+        now = time.time()
+        for mtime, name in await asyncio.to_thread(self._candidates):
+            if settled_only and now - mtime < self.settle_seconds:
+                continue
+            await self._enqueue(name)
+
+    async def _watch_inotify(self, watcher):
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        loop.add_reader(watcher.fd, ready.set)
+        try:
+            while True:
+                await ready.wait()
+                ready.clear()
+                names = watcher.read()
+                if names is None:
+                    logger.warning("inotify queue overflowed; rescanning", extra={"directory": self.watch_dir})
+                    await self.scan()
+                    continue
+                for name in names:
+                    await self._enqueue(name)
+        finally:
+            loop.remove_reader(watcher.fd)
+            watcher.close()
+
+    async def _watch_polling(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            await self.scan(settled_only=True)
+
+    async def watch(self):
+        """
+        Queues new files as they arrive: inotify when available, otherwise polling.
+        """
+        if self.use_inotify:
+            try:
+                watcher = InotifyWatcher(self.watch_dir)
+            except OSError as e:
+                logger.warning("inotify unavailable, polling instead", extra={"error": str(e)})
+            else:
+                logger.info("Watching with inotify", extra={"directory": self.watch_dir})
+                # Files that arrived before the watch was set up
+                await self.scan()
+                await self._watch_inotify(watcher)
+                return
+        logger.info("Watching by polling", extra={"directory": self.watch_dir, "interval": self.poll_interval})
+        await self.scan(settled_only=True)
+        await self._watch_polling()
+
+    def _move(self, name, directory, digest):
+        target = os.path.join(directory, name)
+        if os.path.exists(target):
+            # A different document with the same name was ingested before
+            stem, ext = os.path.splitext(name)
+            target = os.path.join(directory, f"{stem}.{digest[:12]}{ext}")
+        os.replace(os.path.join(self.watch_dir, name), target)
+        return target
+
+    def _open(self, name):
+        path = os.path.join(self.watch_dir, name)
+        f = open(path, "rb")
+        try:
+            digest = hashlib.file_digest(f, "sha256").hexdigest()
+            size = f.tell()
+        except Exception:
+            f.close()
+            raise
+        return PdfUpload(f, digest, size, name)
+
+    async def process(self, name):
+        """
+        Extracts one file and moves it to done_dir or failed_dir.
+        Returns True when the file stays in place for a retry.
+        """
+        try:
+            pdf = await asyncio.to_thread(self._open, name)
+        except FileNotFoundError:
+            # Moved away or deleted since it was queued
+            return False
+        digest = pdf.digest
+        error = None
+        try:
+            recorded = await asyncio.to_thread(self.checkpoint.get, digest)
+            if recorded and recorded["status"] == DONE:
+                await asyncio.to_thread(self._move, name, self.done_dir, digest)
+                self.stats["skipped"] += 1
+                logger.info("Already ingested", extra={"file": name, "digest": digest})
+                return False
+
+            attempts = self._attempts.get(digest, 0) + 1
+            self._attempts[digest] = attempts
+            started = time.perf_counter()
+            try:
+                entry, cache_status = await self.extract(pdf, name)
+                if "raw_text_output" in entry["response"]:
+                    error = "model response failed schema validation"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+        finally:
+            pdf.close()
+
+        if error is not None:
+            return await self._failed(name, digest, attempts, error)
+        await asyncio.to_thread(self.checkpoint.done, digest, name, attempts, cache_status)
+        await asyncio.to_thread(self._move, name, self.done_dir, digest)
+        self._attempts.pop(digest, None)
+        self.stats["done"] += 1
+        logger.info("Ingested", extra={
+            "file": name, "cache": cache_status, "attempts": attempts,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+        return False
+
+    async def _failed(self, name, digest, attempts, error):
+        if attempts < self.max_attempts:
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            self.stats["retried"] += 1
+            logger.warning("Ingest failed, retrying", extra={"file": name, "attempt": attempts, "retry_in": delay, "error": error})
+            self._retries.add(asyncio.create_task(self._retry(name, delay)))
+            return True
+        self.stats["failed"] += 1
+        logger.error("Ingest failed", extra={"file": name, "attempts": attempts, "error": error})
+        await asyncio.to_thread(self.checkpoint.failed, digest, name, attempts, error)
+        await asyncio.to_thread(self._move, name, self.failed_dir, digest)
+        self._attempts.pop(digest, None)
+        return False
+
+    async def _retry(self, name, delay):
+        await asyncio.sleep(delay)
+        self._retries.discard(asyncio.current_task())
+        # Still in _pending, so a new event for the file cannot queue it twice
+        await self._queue.put(name)
+
+    async def _worker(self):
+        while True:
+            name = await self._queue.get()
+            retrying = False
+            try:
+                retrying = await self.process(name)
+            except Exception:
+                logger.exception("Ingest worker error", extra={"file": name})
+            finally:
+                if not retrying:
+                    self._pending.discard(name)
+                self._queue.task_done()
+
+    async def run(self, once=False):
+        """
+        Processes the backlog, then keeps watching until cancelled.
+        With once=True, returns when the files already in the directory are done.
+        """
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        try:
+            if once:
+                await self.scan()
+                while True:
+                    await self._queue.join()
+                    if not self._retries:
+                        break
+                    await asyncio.gather(*self._retries)
+            else:
+                await self.watch()
+        finally:
+            for task in [*workers, *self._retries]:
+                task.cancel()
+            await asyncio.gather(*workers, *self._retries, return_exceptions=True)
+
+
+async def _run_standalone(args):
+    import main
+
+    async def extract(pdf, filename):
+        # Unattended work queues for a model slot instead of being rejected
+        return await main.extract_pdf(pdf, filename=filename, wait=True)
+
+    ingester = Ingester(
+        extract,
+        args.directory,
+        args.done_dir or os.path.join(args.directory, "done"),
+        args.failed_dir or os.path.join(args.directory, "failed"),
+        IngestCheckpoint(args.checkpoint),
+        workers=args.workers,
+        max_attempts=args.max_attempts,
+        poll_interval=args.poll_interval,
+        settle_seconds=args.settle_seconds,
+        use_inotify=not args.poll,
+    )
+    task = asyncio.create_task(ingester.run(once=args.once))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        # Files being extracted stay in the watch directory and are picked up on restart
+        loop.add_signal_handler(sig, task.cancel)
+    print(f"Ingesting {args.directory} with {args.workers} workers. Press Ctrl+C to stop.", file=sys.stderr)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    print(json.dumps({**ingester.stats, "checkpoint": ingester.checkpoint.counts()}))
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Watch a directory and extract every PDF dropped into it")
+    parser.add_argument("directory", nargs="?", default=os.getenv("INGEST_DIR", "inbox"), help="Directory to watch")
+    parser.add_argument("--done-dir", default=os.getenv("INGEST_DONE_DIR"), help="Where finished PDFs go (default: <directory>/done)")
+    parser.add_argument("--failed-dir", default=os.getenv("INGEST_FAILED_DIR"), help="Where failed PDFs go (default: <directory>/failed)")
+    parser.add_argument("--checkpoint", default=os.getenv("INGEST_CHECKPOINT", "data/ingest.db"), help="Checkpoint database")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("INGEST_WORKERS", "2")), help="PDFs extracted at the same time")
+    parser.add_argument("--max-attempts", type=int, default=int(os.getenv("INGEST_MAX_ATTEMPTS", "3")), help="Attempts before a PDF goes to the failed directory")
+    parser.add_argument("--poll", action="store_true", help="Poll the directory instead of using inotify")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between directory scans when polling")
+    parser.add_argument("--settle-seconds", type=float, default=2.0, help="When polling, only pick up files unchanged for this long")
+    parser.add_argument("--once", action="store_true", help="Process the PDFs already in the directory, then exit")
+    args = parser.parse_args()
+
+    asyncio.run(_run_standalone(args))
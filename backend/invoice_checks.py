@@ -0,0 +1,121 @@
+import re
+
+from normalize import parse_amount, parse_date
+
+# Fields an extraction needs before it can be pushed to Zoho Books
+REQUIRED_FIELDS = [
+    ("invoice_number",),
+    ("invoice_date",),
+    ("seller", "vat_number"),
+    ("totals", "grand_total"),
+]
+
+# Saudi VAT registration numbers: 15 digits, starting and ending with 3
+VAT_NUMBER_PATTERN = re.compile(r'^3\d{13}3$')
+
+MISSING_VALUES = (None, "", "N/A", "null")
+
+# A line item "described" as a tax or total row is a misread totals line ("ظريبه الشراء",
+# "VAT 15%"), not something that was sold
+TAX_OR_TOTAL_DESCRIPTION = re.compile(
+    r'^(?:vat|tax|total|sub\s*-?\s*total|grand\s*total|[ضظ]ريب[ةه]|المجموع|الإجمالي|اجمالي)(?:\W|\d|$)',
+    re.IGNORECASE,
+)
+
+
+def to_amount(value):
+    """
+    "1,098.25" / "SAR 1098.25" / "١٠٩٨٫٢٥" / 1098.25 -> 1098.25, or None if it is not a number.
+    """
+    if value in MISSING_VALUES:
+        return None
+    return parse_amount(value)
+
+
+def _get(data, path):
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _close(a, b, tolerance):
+    return abs(a - b) <= max(tolerance, abs(b) * 0.001)
+
+
+def check_invoice(data, tolerance=0.05):
+    """
+    Sanity checks for an extracted invoice in the Gemini schema:
+    required fields present, at least one line item and none that is a tax or total row,
+    a due date not before the invoice date, seller VAT number format, and totals that
+    reconcile (line items -> subtotal, subtotal + VAT -> grand total).
+
+    Returns {"confidence": 0..1, "issues": [...], "codes": [...], "reconciled": bool}, where
+    confidence is the share of checks that passed, reconciled is True when every check passed,
+    and codes are stable identifiers of the failed checks (for counting, unlike the messages).
+    """
+    issues = []
+    codes = []
+    checks = 0
+
+    for path in REQUIRED_FIELDS:
+        checks += 1
+        if _get(data, path) in MISSING_VALUES:
+            issues.append(f"missing {'.'.join(path)}")
+            codes.append(f"missing_{'.'.join(path)}")
+
+    line_items = data.get("line_items") or []
+    checks += 1
+    if not line_items:
+        issues.append("no line_items")
+        codes.append("no_line_items")
+
+    descriptions = [str(item.get("description") or "").strip() for item in line_items if isinstance(item, dict)]
+    if descriptions:
+        checks += 1
+        if any(TAX_OR_TOTAL_DESCRIPTION.match(description) for description in descriptions):
+            issues.append("line_items include a tax or total row")
+            codes.append("tax_line_item")
+
+    invoice_date = parse_date(data.get("invoice_date"))
+    due_date = parse_date(data.get("due_date"))
+    if invoice_date and due_date:
+        checks += 1
+        if due_date < invoice_date:
+            issues.append(f"due_date {due_date} before invoice_date {invoice_date}")
+            codes.append("due_before_invoice_date")
+
+    vat_number = _get(data, ("seller", "vat_number"))
+    if vat_number not in MISSING_VALUES:
+        checks += 1
+        if not VAT_NUMBER_PATTERN.match(re.sub(r'\s', '', str(vat_number))):
+            issues.append(f"invalid seller.vat_number {vat_number!r}")
+            codes.append("invalid_vat_number")
+
+    subtotal = to_amount(_get(data, ("totals", "subtotal")))
+    vat_amount = to_amount(_get(data, ("totals", "vat_amount")))
+    grand_total = to_amount(_get(data, ("totals", "grand_total")))
+
+    line_totals = [to_amount(item.get("total")) for item in line_items if isinstance(item, dict)]
+    if line_totals and subtotal is not None:
+        checks += 1
+        if None in line_totals:
+            issues.append("line_items without total")
+            codes.append("line_items_without_total")
+        elif not _close(sum(line_totals), subtotal, tolerance):
+            issues.append(f"line_items sum {sum(line_totals):.2f} != subtotal {subtotal:.2f}")
+            codes.append("line_items_mismatch")
+
+    if grand_total is not None and subtotal is not None:
+        checks += 1
+        if not _close(subtotal + (vat_amount or 0.0), grand_total, tolerance):
+            issues.append(f"subtotal + vat_amount {subtotal + (vat_amount or 0.0):.2f} != grand_total {grand_total:.2f}")
+            codes.append("totals_mismatch")
+
+    return {
+        "confidence": round(1 - len(issues) / checks, 3) if checks else 0.0,
+        "issues": issues,
+        "codes": codes,
+        "reconciled": not issues,
+    }
@@ -0,0 +1,267 @@
+import io
+import os
+import csv
+import sys
+import codecs
+import argparse
+import tempfile
+from datetime import datetime, timezone
+
+from invoice_checks import to_amount
+from invoice_store import InvoiceStore, _text
+from normalize import parse_date
+
+# Rows are pulled from the store and pushed to the writers in chunks of this size, so
+# memory use depends on the chunk size and not on how many invoices are exported
+CHUNK_ROWS = 1000
+READ_CHUNK_BYTES = 64 * 1024
+
+# (column, type) per table; the types drive the Parquet schema
+INVOICE_COLUMNS = [
+    ("id", "int"), ("filename", "str"), ("invoice_number", "str"), ("invoice_date", "str"),
+    ("due_date", "str"), ("seller_name", "str"), ("seller_vat", "str"), ("seller_cr", "str"),
+    ("buyer_name", "str"), ("buyer_vat", "str"), ("subtotal", "float"), ("vat_amount", "float"),
+    ("grand_total", "float"), ("line_item_count", "int"), ("source", "str"), ("uploaded_at", "str"),
+]
+LINE_ITEM_COLUMNS = [
+    ("invoice_id", "int"), ("invoice_number", "str"), ("invoice_date", "str"), ("seller_name", "str"),
+    ("seller_vat", "str"), ("line", "int"), ("description", "str"), ("quantity", "float"),
+    ("unit_price", "float"), ("total", "float"),
+]
+TABLES = {"invoices": INVOICE_COLUMNS, "line_items": LINE_ITEM_COLUMNS}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class ExportUnavailable(RuntimeError):
+    """
+    The optional dependency for the requested format is not installed.
+    """
+
+
+def load_writer_module(fmt):
+    """
+    Imports the optional dependency of an export format on first use (openpyxl for XLSX,
+    pyarrow for Parquet). Raises ExportUnavailable when it is not installed.
+    """
+    try:
+        if fmt == "xlsx":
+            import openpyxl
+            return openpyxl
+        if fmt == "parquet":
+            import pyarrow
+            import pyarrow.parquet
+            return pyarrow
+    except ImportError:
+        package = "openpyxl" if fmt == "xlsx" else "pyarrow"
+        raise ExportUnavailable(f"{fmt} export needs {package} (pip install {package})")
+    return None
+
+
+def _date(value):
+    value = _text(value)
+    return (parse_date(value) or value) if value else None
+
+
+def invoice_rows(records):
+    """
+    One flat row per stored invoice (records from InvoiceStore.iter_all).
+    """
+    for record in records:
+        data = record["data"]
+        seller = data.get("seller") or {}
+        buyer = data.get("buyer") or {}
+        totals = data.get("totals") or {}
+        yield (
+            record["id"], record["filename"], record["invoice_number"], _date(data.get("invoice_date")),
+            _date(data.get("due_date")), record["seller_name"], record["seller_vat"],
+            _text(seller.get("cr_number")), _text(buyer.get("name")), _text(buyer.get("vat_number")),
+            to_amount(totals.get("subtotal")), to_amount(totals.get("vat_amount")),
+            to_amount(totals.get("grand_total")), len(data.get("line_items") or []), record["source"],
+            datetime.fromtimestamp(record["uploaded_at"], timezone.utc).isoformat(timespec="seconds"),
+        )
+
+
+def line_item_rows(records):
+    """
+    One row per line item, with the invoice columns needed to group and reconcile them.
+    """
+    for record in records:
+        data = record["data"]
+        invoice_date = _date(data.get("invoice_date"))
+        for line, item in enumerate(data.get("line_items") or [], start=1):
+            if not isinstance(item, dict):
+                continue
+            yield (
+                record["id"], record["invoice_number"], invoice_date, record["seller_name"],
+                record["seller_vat"], line, _text(item.get("description")), to_amount(item.get("quantity")),
+                to_amount(item.get("unit_price")), to_amount(item.get("total")),
+            )
+
+
+def _chunks(rows, size=CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def write_csv(columns, rows):
+    """
+    Yields the CSV as UTF-8 bytes (with a BOM, so Excel shows Arabic text), one chunk of
+    rows at a time.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield codecs.BOM_UTF8 + buffer.getvalue().encode("utf-8")
+    for chunk in _chunks(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode("utf-8")
+
+
+def write_xlsx(columns, rows, title="invoices"):
+    """
+    Yields the XLSX file in READ_CHUNK_BYTES pieces. openpyxl's write-only mode streams
+    rows to a temporary file; an XLSX is a zip with its index at the end, so the file is
+    finished on disk before the first byte is sent.
+    """
+    openpyxl = load_writer_module("xlsx")
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title)
+    sheet.append([name for name, _ in columns])
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            data = f.read(READ_CHUNK_BYTES)
+            if not data:
+                break
+            yield data
+
+
+class _ChunkSink:
+    """
+    Write-only file object for pyarrow that hands out what was written since the last
+    drain() instead of keeping it; tell() still counts every byte, as Parquet offsets need.
+    """
+
+    def __init__(self):
+        self.position = 0
+        self.closed = False
+        self._pending = []
+
+    def write(self, data):
+        data = bytes(data)
+        self._pending.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._pending)
+        self._pending = []
+        return data
+
+
+def write_parquet(columns, rows):
+    """
+    Yields the Parquet file one row group (CHUNK_ROWS rows) at a time.
+    """
+    pa = load_writer_module("parquet")
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+
+    sink = _ChunkSink()
+    writer = pa.parquet.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for chunk in _chunks(rows):
+        # Column-major: one list per column for the row group
+        arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)]
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+WRITERS = {"csv": write_csv, "xlsx": write_xlsx, "parquet": write_parquet}
+
+
+def export(store, fmt="csv", table="invoices", **filters):
+    """
+    Streams the invoices (or their line items) matching the InvoiceStore.list filters as
+    CSV, XLSX or Parquet. Returns a generator of bytes chunks.
+    Raises ValueError for an unknown format or table, and ExportUnavailable when the
+    format's optional dependency is missing, before anything is read.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown export format {fmt!r} (use {', '.join(WRITERS)})")
+    if table not in TABLES:
+        raise ValueError(f"Unknown export table {table!r} (use {', '.join(TABLES)})")
+    load_writer_module(fmt)
+
+    records = store.iter_all(batch_size=CHUNK_ROWS, **filters)
+    rows = invoice_rows(records) if table == "invoices" else line_item_rows(records)
+    if fmt == "xlsx":
+        return write_xlsx(TABLES[table], rows, title=table)
+    return WRITERS[fmt](TABLES[table], rows)
+
+
+def export_filename(fmt, table="invoices"):
+    return f"{table}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Export stored invoices as CSV, XLSX or Parquet")
+    parser.add_argument("--format", choices=list(WRITERS), default="csv")
+    parser.add_argument("--table", choices=list(TABLES), default="invoices",
+                        help="One row per invoice, or one row per line item")
+    parser.add_argument("--date-from", help="Earliest invoice_date (YYYY-MM-DD)")
+    parser.add_argument("--date-to", help="Latest invoice_date (YYYY-MM-DD)")
+    parser.add_argument("--seller-vat", help="Only this seller VAT number")
+    parser.add_argument("--seller-name", help="Only sellers whose name contains this text")
+    parser.add_argument("-o", "--output", help="Output file (default: stdout for csv, a timestamped file otherwise)")
+    args = parser.parse_args()
+
+    store = InvoiceStore(os.getenv("INVOICES_DB", "data/invoices.db"))
+    try:
+        chunks = export(
+            store, args.format, args.table, date_from=args.date_from, date_to=args.date_to,
+            seller_vat=args.seller_vat, seller_name=args.seller_name,
+        )
+    except ExportUnavailable as e:
+        raise SystemExit(str(e))
+
+    output = args.output or (None if args.format == "csv" else export_filename(args.format, args.table))
+    out = open(output, "wb") if output else sys.stdout.buffer
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if output:
+            out.close()
+            print(f"Wrote {output}", file=sys.stderr)
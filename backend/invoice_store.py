@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+
+from invoice_checks import to_amount
+
+logger = logging.getLogger(__name__)
+
+# Columns copied out of the invoice JSON so they can be indexed and filtered on
+SUMMARY_COLUMNS = (
+    "id", "filename", "invoice_number", "invoice_date", "seller_name", "seller_vat",
+    "grand_total", "source", "pages", "uploaded_at",
+)
+
+
+class InvoiceStore:
+    """
+    SQLite store of extracted invoices, one row per invoice.
+    The full extraction is kept as a JSON column; invoice number, seller VAT, invoice date
+    and upload time are copied into indexed columns for lookups and filtering.
+    Rows are keyed by doc_key (the PDF's SHA-256, plus "#n" for the n-th invoice of a
+    multi-invoice PDF), so re-extracting a document updates its row instead of adding one.
+    """
+
+    def __init__(self, db_path="data/invoices.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS invoices (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc_key TEXT NOT NULL UNIQUE,
+                filename TEXT,
+                invoice_number TEXT,
+                invoice_date TEXT,
+                seller_name TEXT,
+                seller_vat TEXT,
+                grand_total REAL,
+                source TEXT,
+                pages TEXT,
+                uploaded_at REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (invoice_number);
+            CREATE INDEX IF NOT EXISTS idx_invoices_seller_vat ON invoices (seller_vat);
+            CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date);
+            CREATE INDEX IF NOT EXISTS idx_invoices_uploaded ON invoices (uploaded_at);
+        """)
+
+    def _row_values(self, doc_key, invoice, filename, source, uploaded_at):
+        seller = invoice.get("seller") or {}
+        totals = invoice.get("totals") or {}
+        pages = invoice.get("pages")
+        return (
+            doc_key,
+            filename,
+            _text(invoice.get("invoice_number")),
+            _text(invoice.get("invoice_date")),
+            _text(seller.get("name_english") or seller.get("name_arabic")),
+            _text(seller.get("vat_number")),
+            to_amount(totals.get("grand_total")),
+            source,
+            json.dumps(pages) if pages else None,
+            uploaded_at,
+            json.dumps(invoice, ensure_ascii=False),
+        )
+
+    def save(self, doc_key, invoice, filename=None, source=None, uploaded_at=None):
+        """
+        Inserts or updates the invoice stored under doc_key. Returns its id.
+        """
+        return self.save_many([(doc_key, invoice)], filename=filename, source=source, uploaded_at=uploaded_at)[0]
+
+    def save_many(self, items, filename=None, source=None, uploaded_at=None):
+        """
+        Saves [(doc_key, invoice), ...] in one transaction. Returns the ids in order.
+        An item may be (doc_key, invoice, source) to override source for that invoice.
+        """
+        uploaded_at = uploaded_at or time.time()
+        ids = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for doc_key, invoice, *item_source in items:
+                    row = self._conn.execute(
+                        "INSERT INTO invoices (doc_key, filename, invoice_number, invoice_date, seller_name, "
+                        "seller_vat, grand_total, source, pages, uploaded_at, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (doc_key) DO UPDATE SET filename = excluded.filename, "
+                        "invoice_number = excluded.invoice_number, invoice_date = excluded.invoice_date, "
+                        "seller_name = excluded.seller_name, seller_vat = excluded.seller_vat, "
+                        "grand_total = excluded.grand_total, source = excluded.source, pages = excluded.pages, "
+                        "uploaded_at = excluded.uploaded_at, data = excluded.data "
+                        "RETURNING id",
+                        self._row_values(doc_key, invoice, filename, item_source[0] if item_source else source, uploaded_at),
+                    ).fetchone()
+                    ids.append(row["id"])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def get(self, invoice_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+        if row is None:
+            return None
+        record = self._summary(row)
+        record["data"] = json.loads(row["data"])
+        return record
+
+    def _where(self, invoice_number=None, seller_vat=None, seller_name=None, date_from=None, date_to=None,
+               uploaded_after=None, uploaded_before=None, extra=()):
+        clauses = []
+        params = []
+        for column, op, value in (
+            ("invoice_number", "=", invoice_number),
+            ("seller_vat", "=", seller_vat),
+            ("seller_name", "LIKE", f"%{seller_name}%" if seller_name else None),
+            ("invoice_date", ">=", date_from),
+            ("invoice_date", "<=", date_to),
+            ("uploaded_at", ">=", uploaded_after),
+            ("uploaded_at", "<", uploaded_before),
+            *extra,
+        ):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def list(self, cursor=None, limit=50, **filters):
+        """
+        Returns (invoices, next_cursor), newest first.
+        Filters: invoice_number, seller_vat, seller_name (substring), date_from/date_to (ISO
+        dates, compared as text against invoice_date as extracted) and
+        uploaded_after/uploaded_before (Unix timestamps).
+        Pass the returned next_cursor to get the next page; it is None on the last page.
+        """
+        where, params = self._where(**filters, extra=[("id", "<", cursor)])
+        query = f"SELECT {', '.join(SUMMARY_COLUMNS)} FROM invoices {where} ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(query, (*params, limit + 1)).fetchall()
+
+        invoices = [self._summary(row) for row in rows[:limit]]
+        next_cursor = invoices[-1]["id"] if len(rows) > limit else None
+        return invoices, next_cursor
+
+    def iter_all(self, batch_size=500, **filters):
+        """
+        Yields every invoice matching the list() filters, with its data, oldest first.
+        Rows are read batch_size at a time, so memory does not grow with the store.
+        """
+        last_id = 0
+        while True:
+            where, params = self._where(**filters, extra=[("id", ">", last_id)])
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT * FROM invoices {where} ORDER BY id LIMIT ?", (*params, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                record = self._summary(row)
+                record["data"] = json.loads(row["data"])
+                yield record
+            last_id = rows[-1]["id"]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def _summary(self, row):
+        record = {column: row[column] for column in SUMMARY_COLUMNS}
+        record["pages"] = json.loads(record["pages"]) if record["pages"] else None
+        return record
+
+
+def _text(value):
+    if value in (None, "", "N/A", "null"):
+        return None
+    return str(value).strip()
+
+
+def import_directory(store, directory):
+    """
+    One-time import of the old responses/ directory (one invoice JSON per file) or of
+    extraction cache entries ({"key", "filename", "response", ...}).
+    Cache entries are keyed by PDF digest like live saves (older entries without one by
+    cache key), responses/ files by name, so running the import twice changes nothing.
+    Returns (imported, skipped).
+    """
+    imported = skipped = 0
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith(".json") or not os.path.isfile(path):
+            continue
+        try:
+            with open(path) as f:
+                document = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Skipping %s: %s", path, e)
+            skipped += 1
+            continue
+
+        if "response" in document and "key" in document:
+            invoice, filename = document["response"], document.get("filename")
+            doc_key = document.get("digest") or f"cache:{document['key']}"
+            source = document.get("source", document.get("model"))
+            uploaded_at = document.get("created_at")
+        else:
+            # responses/ files are named "<uploaded filename>.json"
+            invoice, filename = document, name[:-len(".json")]
+            doc_key, source, uploaded_at = f"responses:{name}", "import", os.path.getmtime(path)
+
+        # Chunk entries of multi-invoice PDFs ({"invoices": [...]}) are partial; skip them
+        if not isinstance(invoice, dict) or "raw_text_output" in invoice or "invoices" in invoice:
+            skipped += 1
+            continue
+        store.save(doc_key, invoice, filename=filename, source=source, uploaded_at=uploaded_at)
+        imported += 1
+    return imported, skipped
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Manage the extracted invoice store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_parser = sub.add_parser("import", help="Import invoice JSON files (e.g. the old responses/ directory)")
+    import_parser.add_argument("directories", nargs="+")
+    args = parser.parse_args()
+
+    store = InvoiceStore(os.getenv("INVOICES_DB", "data/invoices.db"))
+    for directory in args.directories:
+        imported, skipped = import_directory(store, directory)
+        print(f"{directory}: imported {imported}, skipped {skipped}")
+    print(f"Store now holds {store.count()} invoices ({store.db_path})")
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import argparse
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobStore:
+    """
+    SQLite-backed queue of extraction jobs.
+    The PDF bytes are stored with the job so queued work survives a restart,
+    and are dropped once the job finishes.
+    """
+
+    def __init__(self, db_path="data/jobs.db", lease_seconds=600, max_attempts=3):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                filename TEXT,
+                pdf BLOB,
+                refresh INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                cache TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_after REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+        """)
+
+    def submit(self, file_content, filename=None, refresh=False):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, pdf, refresh, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, file_content, int(refresh), now, now),
+            )
+        return job_id
+
+    def claim(self):
+        """
+        Atomically moves the oldest runnable job to RUNNING and returns it, or None.
+        Retried jobs wait until their run_after time.
+        RUNNING jobs whose lease expired (the worker died mid-call) are runnable again.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT id, filename, pdf, refresh, attempts FROM jobs "
+                    "WHERE (status = ? AND run_after <= ?) OR (status = ? AND updated_at < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now - self.lease_seconds),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                    (RUNNING, now, row["id"]),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(row)
+
+    def complete(self, job_id, result, cache_status=None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, cache = ?, pdf = NULL, error = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (SUCCEEDED, json.dumps(result, ensure_ascii=False), cache_status, time.time(), job_id),
+            )
+
+    def fail(self, job_id, error, attempts):
+        """
+        Records a failed attempt. The job goes back to the queue, with exponential backoff,
+        until max_attempts is reached.
+        """
+        final = attempts >= self.max_attempts
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, pdf = CASE WHEN ? THEN NULL ELSE pdf END, "
+                "run_after = ?, updated_at = ? WHERE id = ?",
+                (FAILED if final else QUEUED, error, int(final), now + 5 * 2 ** (attempts - 1), now, job_id),
+            )
+
+    def release(self, job_id):
+        """
+        Puts a RUNNING job back in the queue without counting the attempt (used on shutdown).
+        """
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), updated_at = ? "
+                "WHERE id = ? AND status = ?",
+                (QUEUED, time.time(), job_id, RUNNING),
+            )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, filename, result, cache, error, attempts, created_at, updated_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobWorkerPool:
+    """
+    Runs `workers` asyncio tasks that pull jobs from the store and pass them to `extract`,
+    a coroutine taking (file_content, filename, refresh) and returning (entry, cache_status).
+    """
+
+    def __init__(self, store, extract, workers=2, poll_interval=2.0):
+        self.store = store
+        self.extract = extract
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def notify(self):
+        """
+        Wakes idle workers after a submit instead of waiting for the next poll.
+        """
+        self._wakeup.set()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            job = await asyncio.to_thread(self.store.claim)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _process(self, job):
+        try:
+            entry, cache_status = await self.extract(job["pdf"], job["filename"], bool(job["refresh"]))
+        except asyncio.CancelledError:
+            # Shutdown: hand the job back so the next start picks it up straight away
+            self.store.release(job["id"])
+            raise
+        except Exception as e:
+            logger.warning("Job failed", extra={"job_id": job["id"], "attempt": job["attempts"] + 1, "error": str(e)})
+            await asyncio.to_thread(self.store.fail, job["id"], str(e), job["attempts"] + 1)
+            return
+        await asyncio.to_thread(self.store.complete, job["id"], entry["response"], cache_status)
+
+
+async def _run_standalone(workers):
+    from main import job_store, extract_for_job
+
+    pool = JobWorkerPool(job_store, extract_for_job, workers=workers)
+    pool.start()
+    print(f"Job workers running: {workers}. Press Ctrl+C to stop.")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run extraction job workers outside the API process")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("JOB_WORKERS", "2")), help="Number of concurrent jobs")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_run_standalone(args.workers))
+    except KeyboardInterrupt:
+        pass
@@ -1,13 +1,51 @@
 import os
 import json
-import google.generativeai as genai
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import asyncio
+import logging
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
+from extraction_cache import ExtractionCache, key_for_digest
+from admission import AdmissionGate, AdmissionRejected
+from gemini_limiter import GeminiRateLimiter, parse_limits
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, Hedger, is_upstream_failure
+from jobs import JobStore, JobWorkerPool
+from text_layer import extract_from_text_layer
+from pdf_split import split_pdf, merge_chunk_invoices
+from pdf_preprocess import preprocess_pdf
+from schemas import Invoice, InvoiceBundle, gemini_schema
+from pydantic import ValidationError
+from invoice_store import InvoiceStore
+from invoice_export import ExportUnavailable, export, export_filename, FORMATS as EXPORT_FORMATS
+from model_routing import RoutingStats, check_response, ACCEPTED, ESCALATED, EXHAUSTED
+from uploads import PdfUpload, UploadTooLarge, GeminiFileRegistry, spool_upload
+from metrics import TimingMiddleware, GEMINI_CALLS, PREPROCESS_BYTES_SAVED, PREPROCESS_TOKENS_SAVED, registry, stage, record_usage
+from logs import configure_logging
+from normalize import normalize_invoice
+from extract_stream import ExtractionEvents, current_events, relay_stream, emit as emit_event
+import gemini
 
 load_dotenv()
+configure_logging()
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app):
+    # JOB_WORKERS=0 leaves job processing to separate `python jobs.py` processes
+    if JOB_WORKERS > 0:
+        job_pool.start()
+    yield
+    await job_pool.stop()
+    if preprocess_pool is not None:
+        preprocess_pool.shutdown(cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -15,153 +53,832 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
+app.add_middleware(TimingMiddleware)
 
-# Configure Gemini
-GENAI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GENAI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
+# Gemini is imported and configured on first use (gemini.sdk); a missing GEMINI_API_KEY
+# shows up on /ready instead of stopping the process at import time.
 
-genai.configure(api_key=GENAI_API_KEY)
+# Models tried in order, cheapest first: a result that fails the invoice checks escalates
+# to the next tier. The last tier is the reference model.
+MODEL_TIERS = [m.strip() for m in os.getenv("GEMINI_MODEL_TIERS", "gemini-2.5-flash,gemini-2.5-pro").split(",") if m.strip()]
+MODEL_NAME = MODEL_TIERS[-1]
+# Share of invoice checks a cheaper tier must pass for its result to be kept
+ROUTING_MIN_CONFIDENCE = float(os.getenv("ROUTING_MIN_CONFIDENCE", "1.0"))
+routing_stats = RoutingStats(MODEL_TIERS)
 
-# Use Gemini 2.5 Pro
-MODEL_NAME = "gemini-2.5-pro"
+@app.get("/")
+def read_root():
+    return {"message": "Invoice Extraction API (Gemini) is running."}
 
-def upload_to_gemini(file_content, mime_type="application/pdf"):
+@app.get("/ready")
+async def readiness():
     """
-    Uploads the file content to Gemini. 
-    Note: For the python SDK, we usually upload files using the File API for large context.
-    However, for immediate turning, we can pass the bytes directly in some versions, 
-    but utilizing the parts structure is safer.
+    Readiness probe: configuration present, Gemini SDK importable, storage writable.
+    The first call imports the SDK, so traffic is only routed once that cost is paid.
     """
-    model = genai.GenerativeModel(MODEL_NAME)
-    return model
+    checks = {"gemini_api_key": "ok" if gemini.is_configured() else "GEMINI_API_KEY not set"}
+    if checks["gemini_api_key"] == "ok":
+        try:
+            await asyncio.to_thread(gemini.sdk)
+            checks["gemini_sdk"] = "ok"
+        except Exception as e:
+            checks["gemini_sdk"] = str(e)
+    checks["extraction_cache"] = "ok" if os.access(extraction_cache.cache_dir, os.W_OK) else "not writable"
 
-@app.get("/")
-def read_root():
-    return {"message": "Invoice Extraction API (Gemini) is running."}
+    ready = all(result == "ok" for result in checks.values())
+    return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "checks": checks})
+
+# The response structure comes from schemas.Invoice via response_schema; the prompt only
+# explains the fields. Bump PROMPT_VERSION whenever the prompt or schema changes so cached
+# extractions are not reused.
+PROMPT_VERSION = "2"
+EXTRACTION_PROMPT = """
+Extract the data from this invoice PDF.
+Dates (invoice_date, due_date) are YYYY-MM-DD. Amounts are copied as printed on the invoice.
+"seller" is the supplier issuing the invoice (with its VAT and CR numbers), "buyer" the customer.
+"totals" holds the subtotal before VAT, the VAT amount and the grand total.
+If a field is not found, return null.
+"""
+
+# Prompt for one chunk of a large or multi-invoice PDF (schema: schemas.InvoiceBundle)
+CHUNK_PROMPT_VERSION = "chunk-2"
+CHUNK_PROMPT = EXTRACTION_PROMPT.replace(
+    "Extract the data from this invoice PDF.",
+    "These pages are part of a larger PDF. They may hold several invoices, or the start, "
+    "middle or end of one invoice. Extract every invoice (or invoice part) on these pages, "
+    "in page order, into \"invoices\".",
+) + (
+    "For a page that continues an invoice from earlier pages, repeat its invoice_number if shown, "
+    "otherwise use null, and include only the line items and totals on these pages.\n"
+)
+
+# Extraction cache (replaces the old per-filename dump in responses/)
+extraction_cache = ExtractionCache(
+    cache_dir=os.getenv("EXTRACTION_CACHE_DIR", "cache/extractions"),
+    max_entries=int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "256")),
+    max_disk_bytes=int(os.getenv("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    max_age_seconds=int(os.getenv("EXTRACTION_CACHE_MAX_AGE_DAYS", "30")) * 24 * 3600,
+)
+
+# Every extracted invoice, indexed for lookups (replaces one JSON file per upload in responses/)
+invoice_store = InvoiceStore(os.getenv("INVOICES_DB", "data/invoices.db"))
+
+# Model calls in flight per worker, and how many more may wait before /extract answers 503
+extraction_gate = AdmissionGate(
+    max_concurrent=int(os.getenv("EXTRACTION_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("EXTRACTION_QUEUE_SIZE", "16")),
+)
+
+# Gemini RPM/TPM quotas, shared by every worker process through GEMINI_LIMITER_DB.
+# GEMINI_RPM / GEMINI_TPM take one number for every model or "model=limit,..." pairs.
+gemini_limiter = GeminiRateLimiter(
+    db_path=os.getenv("GEMINI_LIMITER_DB", "data/gemini_limiter.db"),
+    rpm=parse_limits(os.getenv("GEMINI_RPM", "gemini-2.5-flash=1000,gemini-2.5-pro=150")),
+    tpm=parse_limits(os.getenv("GEMINI_TPM", "gemini-2.5-flash=1000000,gemini-2.5-pro=2000000")),
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")),
+    token_estimate=int(os.getenv("GEMINI_TOKENS_ESTIMATE", "4000")),
+)
+# Quota errors retried (after the shared pause) before the request answers 503
+GEMINI_QUOTA_RETRIES = int(os.getenv("GEMINI_QUOTA_RETRIES", "5"))
+
+# Deadline per model call (including quota waits and any hedge), and hedged requests:
+# a call still running after the p95 of recent calls is sent a second time
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "120"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "true").lower() in ("1", "true", "yes")
+GEMINI_HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "95"))
+model_breakers = {}
+model_hedgers = {}
+
+def model_resilience(model_name):
+    """
+    The circuit breaker and hedger for model_name, created on first use.
+    """
+    if model_name not in model_breakers:
+        model_breakers[model_name] = CircuitBreaker(f"gemini:{model_name}")
+        model_hedgers[model_name] = Hedger(f"gemini:{model_name}", percentile=GEMINI_HEDGE_PERCENTILE)
+    return model_breakers[model_name], model_hedgers[model_name]
+
+# Uploads are spooled to disk past SPOOL_MEMORY_MB and rejected past MAX_UPLOAD_MB.
+# PDFs of GEMINI_FILE_API_THRESHOLD_MB or more go through the File API instead of inline bytes.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "50")) * 1024 * 1024
+SPOOL_MEMORY_BYTES = int(os.getenv("SPOOL_MEMORY_MB", "1")) * 1024 * 1024
+GEMINI_FILE_API_THRESHOLD = int(os.getenv("GEMINI_FILE_API_THRESHOLD_MB", "15")) * 1024 * 1024
+gemini_files = GeminiFileRegistry(gemini.sdk)
+
+def pdf_part(pdf):
+    """
+    The content part for a PDF: inline bytes, or a File API handle for large files.
+    Blocking (it may upload), so call it from a thread.
+    """
+    if isinstance(pdf, bytes):
+        return {"mime_type": "application/pdf", "data": pdf}
+    if pdf.size >= GEMINI_FILE_API_THRESHOLD:
+        return gemini_files.get_or_upload(pdf)
+    return {"mime_type": "application/pdf", "data": pdf.read()}
+
+# Structured output: Gemini is constrained to these schemas instead of free-form JSON
+RESPONSE_SCHEMAS = {Invoice: gemini_schema(Invoice), InvoiceBundle: gemini_schema(InvoiceBundle)}
+
+async def run_model_extraction(pdf, prompt=EXTRACTION_PROMPT, schema=Invoice, model_name=MODEL_NAME):
+    """
+    Sends the PDF (bytes or PdfUpload) to Gemini with schema as the response_schema, and
+    validates the reply against the same Pydantic model in one parse step.
+    Uses the SDK's async API so a slow extraction never blocks the event loop.
+    """
+    model = await asyncio.to_thread(gemini.get_model, model_name, RESPONSE_SCHEMAS[schema])
+    with stage("upload"):
+        part = await asyncio.to_thread(pdf_part, pdf)
+
+    # Under /extract/stream the reply is streamed and fields are reported as they complete
+    events = current_events.get() if schema is Invoice else None
+
+    async def stream_reply():
+        response = await model.generate_content_async([part, prompt], stream=True)
+        return response, await relay_stream(response, events)
+
+    async def send(lease):
+        # One request to the model; the deadline covers only the request, not limiter waits
+        with stage("model"):
+            try:
+                if events is None:
+                    response = await asyncio.wait_for(model.generate_content_async([part, prompt]), GEMINI_TIMEOUT)
+                    raw_text = response.text
+                else:
+                    response, raw_text = await asyncio.wait_for(stream_reply(), GEMINI_TIMEOUT)
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded(f"Gemini {model_name}", GEMINI_TIMEOUT) from None
+        lease.tokens = getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+        return response, raw_text
+
+    breaker, hedger = model_resilience(model_name)
+
+    async def call(lease):
+        # Raises CircuitOpen (503) while the model keeps failing; nothing is sent then
+        breaker.check()
+        try:
+            # A streamed reply is already being relayed, so it is never hedged
+            if GEMINI_HEDGE and events is None:
+                leases = iter([lease])
+
+                async def hedged_send():
+                    primary = next(leases, None)
+                    if primary is not None:
+                        return await send(primary)
+                    # The hedge is one more request, so it waits for a lease of its own
+                    return await gemini_limiter.call(model_name, send, 0)
+
+                result = await hedger.call(hedged_send)
+            else:
+                result = await send(lease)
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            # Quota and content errors still mean the model answered
+            breaker.record(not is_upstream_failure(e))
+            raise
+        breaker.record(True)
+        return result
+
+    try:
+        # Waits for RPM/TPM budget; quota errors are retried after the shared pause
+        response, raw_text = await gemini_limiter.call(model_name, call, GEMINI_QUOTA_RETRIES)
+    except CircuitOpen:
+        raise
+    except Exception:
+        GEMINI_CALLS.inc(model=model_name, outcome="error")
+        raise
+    record_usage(model_name, getattr(response, "usage_metadata", None))
+
+    with stage("parse"):
+        try:
+            data = schema.model_validate_json(raw_text).model_dump()
+        except ValidationError as e:
+            # Every failure here costs a full re-extraction, so count them
+            extraction_stats["schema_failures"] += 1
+            GEMINI_CALLS.inc(model=model_name, outcome="schema_failure")
+            logger.warning("Response failed schema validation", extra={"errors": e.error_count()})
+            return {"raw_text_output": raw_text}
+        # Dates to YYYY-MM-DD and amounts to plain numbers, whatever the invoice printed
+        for invoice in data.get("invoices", [data]):
+            normalize_invoice(invoice)
+    GEMINI_CALLS.inc(model=model_name, outcome="ok")
+    return data
+
+# Text-layer fast path: parse the PDF's embedded text locally and only call the model
+# when required fields are missing or the totals don't reconcile
+TEXT_FAST_PATH = os.getenv("TEXT_FAST_PATH", "false").lower() in ("1", "true", "yes")
+TEXT_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("TEXT_FAST_PATH_MIN_CONFIDENCE", "1.0"))
+# Folded into the extraction cache key like the prompt version, so turning the fast path
+# on or off (or changing its threshold) does not keep serving the other path's results
+TEXT_FAST_PATH_CACHE_TAG = f":text-layer:min_confidence={TEXT_FAST_PATH_MIN_CONFIDENCE}" if TEXT_FAST_PATH else ""
+extraction_stats = {"text_layer": 0, "text_layer_fallbacks": 0, "model": 0, "schema_failures": 0}
+
+# Optional pre-processing of PDFs that go to the model: downsampled grayscale page images,
+# no blank or boilerplate pages, no metadata. Runs in a process pool (it is CPU-bound).
+PDF_PREPROCESS = os.getenv("PDF_PREPROCESS", "false").lower() in ("1", "true", "yes")
+PDF_PREPROCESS_OPTIONS = {
+    "dpi": int(os.getenv("PDF_PREPROCESS_DPI", "150")),
+    "grayscale": os.getenv("PDF_PREPROCESS_GRAYSCALE", "true").lower() in ("1", "true", "yes"),
+    "jpeg_quality": int(os.getenv("PDF_PREPROCESS_JPEG_QUALITY", "60")),
+    "trim_pages": os.getenv("PDF_PREPROCESS_TRIM_PAGES", "true").lower() in ("1", "true", "yes"),
+}
+PDF_PREPROCESS_WORKERS = int(os.getenv("PDF_PREPROCESS_WORKERS", "2"))
+# Folded into the extraction cache key like the prompt version: the model reads the
+# pre-processed PDF, so other options mean another extraction
+PREPROCESS_CACHE_TAG = (
+    ":preprocess:" + ",".join(f"{name}={value}" for name, value in sorted(PDF_PREPROCESS_OPTIONS.items()))
+    if PDF_PREPROCESS else ""
+)
+preprocess_stats = {"documents": 0, "reduced": 0, "failures": 0, "bytes_saved": 0, "tokens_saved": 0, "pages_trimmed": 0}
+preprocess_pool = None
+
+def get_preprocess_pool():
+    global preprocess_pool
+    if preprocess_pool is None:
+        # forkserver: workers do not inherit the event loop's threads and locks. pdf_preprocess
+        # is preloaded in the fork server, but each worker still re-imports the launching
+        # script as __mp_main__: under `uvicorn main:app` that is the uvicorn launcher, while
+        # `python main.py` would run this module's setup again in every worker.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["pdf_preprocess"])
+        preprocess_pool = ProcessPoolExecutor(max_workers=PDF_PREPROCESS_WORKERS, mp_context=context)
+    return preprocess_pool
+
+async def preprocess_for_model(pdf, filename=None):
+    """
+    Returns (pdf, report): the PDF to send to the model, smaller when pre-processing
+    managed it, and what was saved. The original is returned if pre-processing fails.
+    """
+    with stage("preprocess"):
+        data = await asyncio.to_thread(pdf.read)
+        try:
+            output, report = await asyncio.get_running_loop().run_in_executor(
+                get_preprocess_pool(), partial(preprocess_pdf, data, **PDF_PREPROCESS_OPTIONS)
+            )
+        except Exception as e:
+            preprocess_stats["failures"] += 1
+            logger.warning("PDF pre-processing failed", extra={"upload": filename, "error": str(e)})
+            return pdf, None
+
+    preprocess_stats["documents"] += 1
+    if output is None:
+        return pdf, report
+    preprocess_stats["reduced"] += 1
+    preprocess_stats["bytes_saved"] += report["bytes_saved"]
+    preprocess_stats["tokens_saved"] += report["tokens_saved"]
+    preprocess_stats["pages_trimmed"] += report["pages_before"] - report["pages_after"]
+    PREPROCESS_BYTES_SAVED.inc(report["bytes_saved"])
+    PREPROCESS_TOKENS_SAVED.inc(report["tokens_saved"])
+    logger.info("PDF pre-processed", extra={"upload": filename, **report})
+    return PdfUpload.from_bytes(output, filename), report
+
+async def route_extraction(pdf, prompt, schema, wait=False, multi=False):
+    """
+    Runs the PDF through MODEL_TIERS in order and keeps the first result that passes
+    model_routing.check_response; the last tier's result is kept regardless.
+    Returns (response, model_name, decisions), one decision per tier tried.
+    """
+    decisions = []
+    for index, model_name in enumerate(MODEL_TIERS):
+        emit_event("model", {"model": model_name, "attempt": index + 1})
+        # Once admitted, an escalation queues for a slot rather than failing the request
+        async with extraction_gate.slot(wait=wait or index > 0):
+            response = await run_model_extraction(pdf, prompt, schema, model_name)
+        extraction_stats["model"] += 1
+
+        report = check_response(response, multi, ROUTING_MIN_CONFIDENCE)
+        last = index == len(MODEL_TIERS) - 1
+        decision = ACCEPTED if report["passed"] else (EXHAUSTED if last else ESCALATED)
+        routing_stats.record(model_name, decision, report["codes"])
+        decisions.append({"model": model_name, "decision": decision, "confidence": report["confidence"], "codes": report["codes"]})
+        if decision != ESCALATED:
+            return response, model_name, decisions
+
+async def extract_pdf(pdf, filename=None, refresh=False, wait=False, multi=False):
+    """
+    Returns (entry, cache_status) for the PDF (bytes or a spooled PdfUpload),
+    calling the model only on a cache miss.
+    refresh=True skips the lookup and overwrites any cached entry.
+    Model calls go through extraction_gate; with wait=False a full queue raises AdmissionRejected.
+    multi=True extracts a chunk of a larger PDF; the response is {"invoices": [...]}.
+    """
+    if isinstance(pdf, bytes):
+        pdf = PdfUpload.from_bytes(pdf, filename)
+    prompt, prompt_version, schema = (
+        (CHUNK_PROMPT, CHUNK_PROMPT_VERSION, InvoiceBundle) if multi else (EXTRACTION_PROMPT, PROMPT_VERSION, Invoice)
+    )
+    # The digest was computed while the upload streamed in; no second pass over the bytes.
+    # The whole tier list is part of the key: changing the routing re-extracts.
+    key = key_for_digest(pdf.digest, "+".join(MODEL_TIERS), prompt_version + TEXT_FAST_PATH_CACHE_TAG + PREPROCESS_CACHE_TAG)
+
+    if not refresh:
+        with stage("cache"):
+            entry = extraction_cache.get(key, disk=False)
+            if entry is None:
+                # The disk tier reads a JSON file; keep that off the event loop
+                entry = await asyncio.to_thread(extraction_cache.get, key)
+        if entry is not None:
+            if not multi:
+                await asyncio.to_thread(
+                    invoice_store.save, pdf.digest, entry["response"], filename=filename, source=entry.get("source")
+                )
+            return entry, "hit"
+
+    json_response = None
+    source = MODEL_NAME
+    routing = None
+    if TEXT_FAST_PATH:
+        # Digitally generated PDFs can often be read locally in milliseconds
+        with stage("text_layer"):
+            json_response, report = await asyncio.to_thread(
+                extract_from_text_layer, pdf.open(), TEXT_FAST_PATH_MIN_CONFIDENCE
+            )
+        if json_response is not None:
+            source = "text-layer"
+            json_response = Invoice.model_validate(json_response).model_dump()
+            if multi:
+                json_response = {"invoices": [json_response]}
+            extraction_stats["text_layer"] += 1
+        else:
+            extraction_stats["text_layer_fallbacks"] += 1
+
+    preprocess = None
+    if json_response is None:
+        model_pdf = pdf
+        if PDF_PREPROCESS:
+            model_pdf, preprocess = await preprocess_for_model(pdf, filename)
+        json_response, source, routing = await route_extraction(model_pdf, prompt, schema, wait=wait, multi=multi)
+
+    if "raw_text_output" in json_response:
+        # Don't pin unparseable output in the cache; the next upload should retry
+        await asyncio.to_thread(extraction_cache.invalidate, key)
+        return {
+            "key": key, "filename": filename, "source": source, "routing": routing,
+            "preprocess": preprocess, "response": json_response,
+        }, "bypass"
+
+    with stage("store"):
+        entry = await asyncio.to_thread(
+            extraction_cache.put,
+            key,
+            json_response,
+            filename=filename,
+            digest=pdf.digest,
+            model=source,
+            prompt_version=prompt_version,
+            source=source,
+            routing=routing,
+            preprocess=preprocess,
+        )
+        if not multi:
+            # Chunks are stored by /extract/multi once they are merged into invoices
+            await asyncio.to_thread(invoice_store.save, pdf.digest, json_response, filename=filename, source=source)
+    return entry, "refresh" if refresh else "miss"
+
+@app.get("/cache/stats")
+def cache_stats():
+    return extraction_cache.snapshot()
+
+@app.get("/extract/queue")
+def extraction_queue_stats():
+    return extraction_gate.snapshot()
+
+@app.get("/extract/quota")
+def extraction_quota_stats():
+    return gemini_limiter.snapshot()
+
+@app.get("/resilience")
+def resilience_stats():
+    """
+    Circuit breaker state, hedging and retry budgets per upstream.
+    """
+    zoho = get_zoho_client()
+    return {
+        "gemini": {
+            name: {"breaker": breaker.snapshot(), **model_hedgers[name].snapshot()}
+            for name, breaker in model_breakers.items()
+        },
+        "zoho": {"breaker": zoho.breaker.snapshot(), "retry_budget": zoho.retry_budget.snapshot()},
+    }
+
+@app.get("/extract/routing")
+def extraction_routing_stats():
+    return {"min_confidence": ROUTING_MIN_CONFIDENCE, **routing_stats.snapshot()}
+
+@app.get("/extract/stats")
+def extraction_source_stats():
+    model_calls = extraction_stats["model"]
+    return {
+        **extraction_stats,
+        "schema_failure_rate": round(extraction_stats["schema_failures"] / model_calls, 4) if model_calls else 0.0,
+        "file_api": gemini_files.stats,
+        "preprocess": {"enabled": PDF_PREPROCESS, **preprocess_stats},
+    }
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+async def spool_or_413(file):
+    try:
+        with stage("read"):
+            return await spool_upload(file, MAX_UPLOAD_BYTES, SPOOL_MEMORY_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+def extraction_result(entry, cache_status):
+    return {
+        "message": "Extraction successful",
+        "saved_file": extraction_cache.path_for(entry["key"]) if cache_status != "bypass" else None,
+        "cache": cache_status,
+        "source": entry.get("source", entry.get("model")),
+        "routing": entry.get("routing"),
+        "preprocess": entry.get("preprocess"),
+        "raw_response": entry["response"]
+    }
 
 @app.post("/extract")
-async def extract_invoice_data(file: UploadFile = File(...)):
+async def extract_invoice_data(file: UploadFile = File(...), refresh: bool = False):
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
+    pdf = await spool_or_413(file)
     try:
-        # Read file
-        file_content = await file.read()
-        
-        # Initialize Model
-        model = genai.GenerativeModel(MODEL_NAME)
+        entry, cache_status = await extract_pdf(pdf, filename=file.filename, refresh=refresh)
+        return extraction_result(entry, cache_status)
 
-        # Prompt for structured JSON
-        prompt = """
-        Extract the data from this invoice PDF into the following strict JSON format. 
-        If a field is not found, return null (or "N/A" for text fields).
-        
-        REQUIRED JSON SCHEMA:
-        {
-            "invoice_number": "string",
-            "invoice_date": "string (YYYY-MM-DD)",
-            "due_date": "string (YYYY-MM-DD)",
-            "seller": {
-                "name_english": "string",
-                "name_arabic": "string",
-                "address": "string",
-                "vat_number": "string",
-                "cr_number": "string"
-            },
-            "buyer": {
-                "name": "string",
-                "address": "string",
-                "vat_number": "string"
-            },
-            "line_items": [
-                {
-                    "description": "string",
-                    "quantity": "number/string",
-                    "unit_price": "number/string",
-                    "total": "number/string"
-                }
-            ],
-            "totals": {
-                "subtotal": "string",
-                "vat_amount": "string",
-                "grand_total": "string"
-            },
-            "bank_details": {
-                "bank_name": "string",
-                "account_number": "string",
-                "iban": "string"
-            }
-        }
-        
-        Ensure "totals" and "bank_details" keys exactly match the names above if data exists.
-        Return ONLY valid JSON.
-        """
-
-        # Generate content
-        # Pass part with mime_type
-        response = model.generate_content(
-            [
-                {"mime_type": "application/pdf", "data": file_content},
-                prompt
-            ]
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
         )
-        
-        # Parse JSON from response text
-        # Gemini might wrap in ```json ... ```
-        raw_text = response.text
-        cleaned_text = raw_text.replace("```json", "").replace("```", "").strip()
-        
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        logger.exception("Extraction failed")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        pdf.close()
+
+@app.post("/extract/stream")
+async def extract_invoice_stream(file: UploadFile = File(...), refresh: bool = False):
+    """
+    /extract as Server-Sent Events, so a reviewer sees fields seconds before the whole
+    invoice is done. Events: "model" when a model tier starts (a later attempt replaces
+    the earlier fields), "field" per top-level field and "line_item" per line item as the
+    streamed reply completes them, then "result" with the /extract body or "error".
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    pdf = await spool_or_413(file)
+    events = ExtractionEvents()
+
+    async def run():
+        current_events.set(events)
         try:
-            json_response = json.loads(cleaned_text)
-        except json.JSONDecodeError:
-            # Fallback if valid JSON wasn't returned, just return text wrapped
-            json_response = {"raw_text_output": raw_text}
-
-        # Save raw response
-        os.makedirs("responses", exist_ok=True)
-        filename = f"responses/{file.filename}.json"
-        with open(filename, "w") as f:
-            json.dump(json_response, f, indent=4, ensure_ascii=False)
-            
+            entry, cache_status = await extract_pdf(pdf, filename=file.filename, refresh=refresh)
+            events.emit("result", extraction_result(entry, cache_status))
+        except AdmissionRejected as e:
+            events.emit("error", {"status": 503, "detail": str(e), "retry_after": e.retry_after})
+        except DeadlineExceeded as e:
+            events.emit("error", {"status": 504, "detail": str(e)})
+        except Exception as e:
+            logger.exception("Extraction failed")
+            events.emit("error", {"status": 500, "detail": str(e)})
+        finally:
+            pdf.close()
+            events.close()
+
+    return StreamingResponse(
+        events.stream(run()),
+        media_type="text/event-stream",
+        # Stop proxies (nginx) from buffering the events
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Large and multi-invoice PDFs are split into page ranges that are extracted in parallel
+SPLIT_MAX_PAGES = int(os.getenv("SPLIT_MAX_PAGES", "4"))
+SPLIT_CONCURRENCY = int(os.getenv("SPLIT_CONCURRENCY", "4"))
+
+@app.post("/extract/multi")
+async def extract_multi_invoice(file: UploadFile = File(...), refresh: bool = False):
+    """
+    Extracts every invoice in a large or multi-invoice PDF.
+    The PDF is split at detected invoice boundaries (or fixed page ranges for scans),
+    the chunks are extracted in parallel, and invoices that continue across chunks are
+    merged. Returns {"invoices": [...]}, each with the pages it came from.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    pdf = await spool_or_413(file)
+    try:
+        # Splitting needs the whole document; the size cap above bounds it
+        with stage("split"):
+            chunks = await asyncio.to_thread(split_pdf, pdf.read(), SPLIT_MAX_PAGES)
+        semaphore = asyncio.Semaphore(SPLIT_CONCURRENCY)
+
+        async def extract_chunk(start, end, chunk_bytes):
+            async with semaphore:
+                entry, cache_status = await extract_pdf(
+                    chunk_bytes, filename=f"{file.filename}#pages={start + 1}-{end}",
+                    refresh=refresh, wait=True, multi=True,
+                )
+            response = entry["response"]
+            # Output that failed the schema is not an invoice; like /extract, it is not stored
+            invoices = response.get("invoices") if cache_status != "bypass" and isinstance(response, dict) else None
+            return (start, end, invoices), cache_status, entry.get("source")
+
+        results = await asyncio.gather(*(extract_chunk(*chunk) for chunk in chunks))
+        invoices = merge_chunk_invoices([result for result, _, _ in results if result[2] is not None])
+
+        def invoice_source(invoice):
+            # Chunks may have been answered by different model tiers
+            pages = set(invoice.get("pages") or ())
+            sources = [source for (start, end, _), _, source in results if pages & set(range(start + 1, end + 1))]
+            return "+".join(dict.fromkeys(filter(None, sources))) or None
+
+        with stage("store"):
+            await asyncio.to_thread(
+                invoice_store.save_many,
+                [(f"{pdf.digest}#{i}", invoice, invoice_source(invoice)) for i, invoice in enumerate(invoices)],
+                filename=file.filename,
+            )
+
+        chunk_reports = []
+        for (start, end, chunk_invoices), status, _ in results:
+            report = {"pages": [start + 1, end], "cache": status}
+            if chunk_invoices is None:
+                report["error"] = "Model response did not match the schema"
+            chunk_reports.append(report)
+        failed = any("error" in report for report in chunk_reports)
+
         return {
-            "message": "Extraction successful", 
-            "saved_file": filename,
-            "raw_response": json_response
+            "message": "Extraction incomplete: some chunks failed" if failed else "Extraction successful",
+            "chunks": chunk_reports,
+            "invoices": invoices,
         }
-        
+
+    except AdmissionRejected as e:
+        # Chunks queue rather than being rejected: the Gemini quota or an open circuit
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        print(f"Error: {e}")
+        logger.exception("Extraction failed")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        pdf.close()
+
+@app.get("/invoices")
+def list_invoices(
+    invoice_number: Optional[str] = None,
+    seller_vat: Optional[str] = None,
+    seller_name: Optional[str] = Query(None, description="Part of the seller name"),
+    date_from: Optional[str] = Query(None, description="Earliest invoice_date (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, description="Latest invoice_date (YYYY-MM-DD)"),
+    uploaded_after: Optional[float] = Query(None, description="Unix timestamp"),
+    uploaded_before: Optional[float] = Query(None, description="Unix timestamp"),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """
+    Lists stored invoices, newest first, with cursor pagination.
+    """
+    invoices, next_cursor = invoice_store.list(
+        invoice_number=invoice_number,
+        seller_vat=seller_vat,
+        seller_name=seller_name,
+        date_from=date_from,
+        date_to=date_to,
+        uploaded_after=uploaded_after,
+        uploaded_before=uploaded_before,
+        cursor=cursor,
+        limit=limit,
+    )
+    return {"invoices": invoices, "next_cursor": next_cursor}
+
+@app.get("/invoices/export")
+def export_invoices(
+    format: str = Query("csv", description="csv, xlsx or parquet"),
+    table: str = Query("invoices", description="invoices (one row per invoice) or line_items"),
+    seller_vat: Optional[str] = None,
+    seller_name: Optional[str] = Query(None, description="Part of the seller name"),
+    date_from: Optional[str] = Query(None, description="Earliest invoice_date (YYYY-MM-DD)"),
+    date_to: Optional[str] = Query(None, description="Latest invoice_date (YYYY-MM-DD)"),
+):
+    """
+    Streams the stored invoices, or their line items, as a CSV, XLSX or Parquet download.
+    """
+    try:
+        chunks = export(
+            invoice_store, format, table,
+            seller_vat=seller_vat, seller_name=seller_name, date_from=date_from, date_to=date_to,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    # A sync generator: Starlette iterates it in the threadpool, off the event loop
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{export_filename(format, table)}"'},
+    )
+
+@app.get("/invoices/{invoice_id}")
+def get_invoice(invoice_id: int):
+    invoice = invoice_store.get(invoice_id)
+    if invoice is None:
+        raise HTTPException(status_code=404, detail=f"Invoice {invoice_id} not found")
+    return invoice
+
+# Max number of PDFs from one batch that are sent to the model at the same time
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+async def _extract_batch_item(index, filename, content_type, pdf, refresh, semaphore):
+    result = {"index": index, "filename": filename}
+
+    if content_type != "application/pdf":
+        result.update({"status": "error", "error": "Only PDF files are supported"})
+        return result
+    if isinstance(pdf, UploadTooLarge):
+        result.update({"status": "error", "error": str(pdf)})
+        return result
+
+    async with semaphore:
+        try:
+            # The batch already bounds its own fan-out, so queue rather than reject
+            entry, cache_status = await extract_pdf(
+                pdf, filename=filename, refresh=refresh, wait=True
+            )
+        except AdmissionRejected as e:
+            logger.warning("Batch item failed", extra={"upload": filename, "error": str(e)})
+            result.update({"status": "error", "error": str(e), "retry_after": e.retry_after})
+            return result
+        except Exception as e:
+            logger.warning("Batch item failed", extra={"upload": filename, "error": str(e)})
+            result.update({"status": "error", "error": str(e)})
+            return result
+
+    result.update({
+        "status": "ok",
+        "cache": cache_status,
+        "raw_response": entry["response"],
+    })
+    return result
+
+@app.post("/extract/batch")
+async def extract_invoice_batch(files: List[UploadFile] = File(...), refresh: bool = False):
+    """
+    Extracts many PDFs in one request.
+    Streams one JSON line per file (application/x-ndjson) in completion order;
+    each line carries the upload index so the client can match results to files.
+    """
+    # Spool the uploads before streaming starts; the request body is not available afterwards.
+    # An oversized file fails on its own line instead of failing the whole batch.
+    uploads = []
+    for file in files:
+        try:
+            pdf = await spool_upload(file, MAX_UPLOAD_BYTES, SPOOL_MEMORY_BYTES)
+        except UploadTooLarge as e:
+            pdf = e
+        uploads.append((file.filename, file.content_type, pdf))
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def stream_results():
+        tasks = [
+            asyncio.create_task(_extract_batch_item(i, name, ctype, content, refresh, semaphore))
+            for i, (name, ctype, content) in enumerate(uploads)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            # Client went away: don't keep calling the model for nobody
+            for task in tasks:
+                task.cancel()
+            for _, _, pdf in uploads:
+                if isinstance(pdf, PdfUpload):
+                    pdf.close()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+# Asynchronous jobs: POST /jobs returns at once, workers run the extraction in the background
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+job_store = JobStore(
+    db_path=os.getenv("JOBS_DB", "data/jobs.db"),
+    max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "3")),
+)
 
-from zoho_client import ZohoClient
+async def extract_for_job(file_content, filename, refresh):
+    # Background work queues for a model slot instead of being rejected
+    return await extract_pdf(file_content, filename=filename, refresh=refresh, wait=True)
+
+job_pool = JobWorkerPool(job_store, extract_for_job, workers=JOB_WORKERS)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...), refresh: bool = False):
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
+    pdf = await spool_or_413(file)
+    try:
+        job_id = await asyncio.to_thread(job_store.submit, pdf.read(), file.filename, refresh)
+    finally:
+        pdf.close()
+    job_pool.notify()
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued"},
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
+
+from zoho_client import get_zoho_client
+from zoho_bulk import push_invoices
 from pydantic import BaseModel
 
 class ZohoInvoiceRequest(BaseModel):
     customer_name: str
     invoice_data: dict
 
+class ZohoBulkInvoiceRequest(BaseModel):
+    invoices: List[ZohoInvoiceRequest]
+
+# Plain def: the Zoho client uses blocking requests, so FastAPI runs this in its threadpool
 @app.post("/zoho/create-invoice")
-async def create_zoho_invoice(request: ZohoInvoiceRequest):
+def create_zoho_invoice(request: ZohoInvoiceRequest):
     try:
-        zoho = ZohoClient()
-        customer_id = zoho.search_customer(request.customer_name)
+        zoho = get_zoho_client()
+
+        # Already pushed: answer from the ledger without touching the Zoho API
+        with stage("ledger"):
+            pushed = zoho.find_pushed_invoice(request.invoice_data)
+        if pushed:
+            return pushed
+
+        seller = request.invoice_data.get("seller") or {}
+        with stage("customer_search"):
+            customer_id = zoho.search_customer(request.customer_name, vat_number=seller.get("vat_number"))
         
         if not customer_id:
             raise HTTPException(status_code=404, detail=f"Customer '{request.customer_name}' not found in Zoho Books.")
             
-        result = zoho.create_invoice(request.invoice_data, customer_id)
+        with stage("create_invoice"):
+            result = zoho.create_invoice(request.invoice_data, customer_id)
         
         if "error" in result:
-             raise HTTPException(status_code=400, detail=result["error"])
+             status_code = 409 if result.get("status_code") == 409 else 400
+             raise HTTPException(status_code=status_code, detail=result["error"])
              
         return result
-        
+
+    except HTTPException:
+        raise
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
-        print(f"Zoho Error: {e}")
+        logger.exception("Zoho request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/zoho/create-invoices")
+def create_zoho_invoices(request: ZohoBulkInvoiceRequest):
+    """
+    Pushes many invoices at once and returns a per-invoice report.
+    Individual failures are reported in the results instead of failing the request.
+    """
+    zoho = get_zoho_client()
+    return push_invoices(zoho, [(item.customer_name, item.invoice_data) for item in request.invoices])
+
+@app.post("/zoho/contacts/sync")
+def sync_zoho_contacts(full: bool = False):
+    zoho = get_zoho_client()
+    try:
+        count = zoho.contact_index.sync(zoho, full=full)
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.exception("Zoho request failed")
+        raise HTTPException(status_code=502, detail=str(e))
+    return {"synced": count, "indexed": len(zoho.contact_index)}
+
 
 if __name__ == "__main__":
     import uvicorn
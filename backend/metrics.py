@@ -0,0 +1,264 @@
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Model calls take seconds to minutes, so the buckets reach further than the usual web defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts (non-cumulative, last is +Inf), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', le))} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total!r}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route", "status")
+)
+STAGE_SECONDS = registry.histogram(
+    "stage_duration_seconds", "Time spent in each processing stage", ("stage",)
+)
+GEMINI_TOKENS = registry.counter(
+    "gemini_tokens_total", "Gemini tokens reported in usage_metadata", ("model", "kind")
+)
+GEMINI_CALLS = registry.counter(
+    "gemini_calls_total", "Gemini generate_content calls", ("model", "outcome")
+)
+MODEL_ROUTING = registry.counter(
+    "model_routing_total", "Routing decisions per model tier (accepted, escalated, exhausted)", ("model", "decision")
+)
+ROUTING_ESCALATION_REASONS = registry.counter(
+    "model_routing_escalation_reasons_total", "Failed checks that caused an escalation", ("model", "reason")
+)
+FIRST_FIELD_SECONDS = registry.histogram(
+    "extraction_time_to_first_field_seconds",
+    "Time from a streamed extraction request to its first field event", ("source",)
+)
+PREPROCESS_BYTES_SAVED = registry.counter(
+    "pdf_preprocess_bytes_saved_total", "Bytes removed from PDFs before they were sent to the model"
+)
+PREPROCESS_TOKENS_SAVED = registry.counter(
+    "pdf_preprocess_tokens_saved_total", "Estimated input tokens saved by trimming pages before the model call"
+)
+CIRCUIT_TRANSITIONS = registry.counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes per upstream", ("upstream", "state")
+)
+HEDGED_CALLS = registry.counter(
+    "hedged_calls_total", "Hedged duplicate calls fired, and how many finished first", ("upstream", "outcome")
+)
+GEMINI_QUOTA_ERRORS = registry.counter(
+    "gemini_quota_errors_total", "Gemini calls rejected for quota (429 / RESOURCE_EXHAUSTED)", ("model",)
+)
+
+
+class RequestTimings:
+    """
+    Stage durations and token counts collected while one request is handled.
+    A stage entered more than once (e.g. one model call per chunk) accumulates.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.tokens = {}
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_tokens(self, **counts):
+        for kind, count in counts.items():
+            self.tokens[kind] = self.tokens.get(kind, 0) + (count or 0)
+
+    def server_timing(self):
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items())
+
+
+# Set per request by the middleware; sync endpoints run in a thread that copies the context,
+# so they add to the same RequestTimings object
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a block into stage_duration_seconds and the current request's Server-Timing.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=name)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add_stage(name, elapsed)
+
+
+def record_usage(model_name, usage_metadata):
+    """
+    Counts the prompt/output/total tokens from a Gemini response's usage_metadata.
+    """
+    if usage_metadata is None:
+        return
+    counts = {
+        "prompt": getattr(usage_metadata, "prompt_token_count", 0) or 0,
+        "output": getattr(usage_metadata, "candidates_token_count", 0) or 0,
+        "total": getattr(usage_metadata, "total_token_count", 0) or 0,
+    }
+    for kind, count in counts.items():
+        GEMINI_TOKENS.inc(count, model=model_name, kind=kind)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add_tokens(**counts)
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware: gives each request a RequestTimings, records its latency in
+    http_request_duration_seconds, adds Server-Timing and X-Request-ID headers, and writes
+    one structured log line per request with its stages and token counts.
+    Streaming responses send headers first, so their Server-Timing only covers the work
+    done before the first byte.
+    """
+
+    def __init__(self, app, logger_name="http"):
+        self.app = app
+        self.logger = logging.getLogger(logger_name)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        request_id = uuid.uuid4().hex[:16]
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_headers(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                total = f"total;dur={(time.perf_counter() - start) * 1000:.1f}"
+                server_timing = ", ".join(filter(None, [timings.server_timing(), total]))
+                headers.append((b"server-timing", server_timing.encode("latin-1")))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route_path, status=status)
+            self.logger.info(
+                "request",
+                extra={
+                    "request_id": request_id,
+                    "method": scope["method"],
+                    "path": scope["path"],
+                    "route": route_path,
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in timings.stages.items()},
+                    "tokens": timings.tokens,
+                },
+            )
+            current_timings.reset(token)
@@ -0,0 +1,68 @@
+import threading
+from collections import Counter
+
+from invoice_checks import check_invoice
+from metrics import MODEL_ROUTING, ROUTING_ESCALATION_REASONS
+
+ACCEPTED = "accepted"
+ESCALATED = "escalated"
+# The last tier failed the checks too; its result is used anyway
+EXHAUSTED = "exhausted"
+
+
+def check_response(response, multi=False, min_confidence=1.0):
+    """
+    Decides whether a tier's extraction is good enough to keep.
+    Single invoices must reach min_confidence in invoice_checks.check_invoice (required fields,
+    line items reconciling with the totals, seller VAT number format). Chunks of multi-invoice
+    PDFs routinely hold partial invoices, so for them only a schema failure escalates.
+    Returns {"passed": bool, "confidence": float or None, "codes": [...]}.
+    """
+    if "raw_text_output" in response:
+        return {"passed": False, "confidence": 0.0, "codes": ["schema_failure"]}
+    if multi:
+        return {"passed": True, "confidence": None, "codes": []}
+    report = check_invoice(response)
+    return {
+        "passed": report["confidence"] >= min_confidence,
+        "confidence": report["confidence"],
+        "codes": report["codes"],
+    }
+
+
+class RoutingStats:
+    """
+    Per-tier attempt/accept/escalate counts and the checks that caused escalations,
+    for tuning the tiers and ROUTING_MIN_CONFIDENCE.
+    """
+
+    def __init__(self, tiers):
+        self.tiers = list(tiers)
+        self._lock = threading.Lock()
+        self._decisions = {tier: Counter() for tier in self.tiers}
+        self._reasons = {tier: Counter() for tier in self.tiers}
+
+    def record(self, tier, decision, codes):
+        with self._lock:
+            self._decisions.setdefault(tier, Counter())[decision] += 1
+            if decision == ESCALATED:
+                self._reasons.setdefault(tier, Counter()).update(codes)
+        MODEL_ROUTING.inc(model=tier, decision=decision)
+        if decision == ESCALATED:
+            for code in codes:
+                ROUTING_ESCALATION_REASONS.inc(model=tier, reason=code)
+
+    def snapshot(self):
+        with self._lock:
+            tiers = {}
+            for tier, decisions in self._decisions.items():
+                attempts = sum(decisions.values())
+                tiers[tier] = {
+                    "attempts": attempts,
+                    ACCEPTED: decisions[ACCEPTED],
+                    ESCALATED: decisions[ESCALATED],
+                    EXHAUSTED: decisions[EXHAUSTED],
+                    "hit_rate": round(decisions[ACCEPTED] / attempts, 4) if attempts else None,
+                    "escalation_reasons": dict(self._reasons.get(tier, {})),
+                }
+        return {"tiers": tiers}
@@ -0,0 +1,256 @@
+import re
+from datetime import date
+
+# Arabic-Indic and Extended Arabic-Indic (Persian/Urdu) digits, plus the Arabic decimal and
+# thousands separators, mapped to ASCII
+DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹٫٬", "01234567890123456789.,")
+# Bidi/format marks around Arabic/English runs, and tatweel
+NOISE_PATTERN = re.compile(r'[\u200e\u200f\u202a-\u202e\u2066-\u2069\u0640]')
+# Era suffix after a Hijri date: "هـ", "AH", "A.H."
+ERA_SUFFIX_PATTERN = re.compile(r'\s*(?:هـ?|A\.?H\.?)$', re.IGNORECASE)
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "sept": 9, "oct": 10, "nov": 11, "dec": 12,
+    "january": 1, "february": 2, "march": 3, "april": 4, "june": 6, "july": 7,
+    "august": 8, "september": 9, "october": 10, "november": 11, "december": 12,
+}
+
+# One regex per layout. They are combined into a single alternation, so a value is matched
+# once and the name of the alternative that matched says how to read its fields.
+DATE_FORMATS = {
+    "mon_d_y": r'([A-Za-z]{3,9})\.?\s+(\d{1,2}),?\s+(\d{4})',        # Aug 14, 2025 / August 14 2025
+    "d_mon_y": r'(\d{1,2})[\s-]+([A-Za-z]{3,9})\.?,?[\s-]+(\d{4})',  # 14 Aug 2025 / 14-August-2025
+    "y_m_d": r'(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})',                 # 2025-08-14 / 2025/08/14
+    "d_m_y": r'(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})',                 # 14/08/2025, or 08/14/2025 (m_d_y)
+}
+FORMAT_PATTERNS = {name: re.compile(pattern, re.ASCII) for name, pattern in DATE_FORMATS.items()}
+FORMAT_PATTERNS["m_d_y"] = FORMAT_PATTERNS["d_m_y"]
+DATE_PATTERN = re.compile("|".join(f"(?P<{name}>{p})" for name, p in DATE_FORMATS.items()), re.ASCII)
+DATE_SEARCH_PATTERN = re.compile(rf'\b(?:{DATE_PATTERN.pattern})\b', re.ASCII)
+
+# Years in this range are Hijri (1446 AH is 2024/25); Gregorian invoice dates never fall in it
+HIJRI_YEARS = (1300, 1600)
+
+AMOUNT_PATTERN = re.compile(r'-?\d+(?:,\d{3})*(?:\.\d+)?|-?\.\d+', re.ASCII)
+# Other digits or a percent sign inside the parentheses mean they are not a minus sign
+PARENTHESIZED_NOISE_PATTERN = re.compile(r'[\d%]')
+
+AMOUNT_FIELDS = ("quantity", "unit_price", "total")
+TOTAL_FIELDS = ("subtotal", "vat_amount", "grand_total")
+DATE_FIELDS = ("invoice_date", "due_date")
+
+# Date layout last seen per seller, tried first on that seller's next invoice. It also
+# settles day/month order for dates like 05/06/2025 that fit both readings.
+SELLER_CACHE_SIZE = 10000
+_seller_formats = {}
+
+
+def _prepare(value):
+    text = str(value)
+    if not text.isascii():
+        text = NOISE_PATTERN.sub('', text.translate(DIGITS))
+    return text.strip()
+
+
+def load_hijri():
+    """
+    Imports the Umm al-Qura converter on first use (hijridate, or the older hijri-converter),
+    or returns None when neither is installed.
+    """
+    try:
+        from hijridate import Hijri
+    except ImportError:
+        try:
+            from hijri_converter import Hijri
+        except ImportError:
+            return None
+    return Hijri
+
+
+def hijri_to_gregorian(year, month, day):
+    """
+    Converts an Umm al-Qura (Saudi civil calendar) date to a Gregorian date.
+    Raises ValueError for an invalid date, a year outside the converter's table
+    (1343-1500 AH), or when no converter is installed: an arithmetic approximation can be
+    a day off, so the date is left unparsed instead.
+    """
+    Hijri = load_hijri()
+    if Hijri is None:
+        raise ValueError("Hijri dates need the hijridate package")
+    try:
+        converted = Hijri(year, month, day).to_gregorian()
+    except OverflowError as e:
+        raise ValueError(str(e)) from None
+    return date(converted.year, converted.month, converted.day)
+
+
+def _to_date(year, month, day):
+    year, day = int(year), int(day)
+    if HIJRI_YEARS[0] <= year <= HIJRI_YEARS[1]:
+        return hijri_to_gregorian(year, month, day)
+    return date(year, month, day)
+
+
+def _read(name, fields, hint=None):
+    """
+    Builds the date for a match of DATE_FORMATS[name].
+    Returns (date or None, layout); layout is None when day/month order was a guess.
+    """
+    try:
+        if name == "mon_d_y":
+            month = MONTHS.get(fields[0].lower())
+            return (_to_date(fields[2], month, fields[1]) if month else None), name
+        if name == "d_mon_y":
+            month = MONTHS.get(fields[1].lower())
+            return (_to_date(fields[2], month, fields[0]) if month else None), name
+        if name == "y_m_d":
+            return _to_date(fields[0], int(fields[1]), fields[2]), name
+
+        first, second = int(fields[0]), int(fields[1])
+        if first > 12:
+            layout = "d_m_y"
+        elif second > 12:
+            layout = "m_d_y"
+        else:
+            # Both readings are valid: trust what this seller used before, else day first
+            layout = None
+            name = hint if hint in ("d_m_y", "m_d_y") else "d_m_y"
+        if (layout or name) == "m_d_y":
+            return _to_date(fields[2], first, second), layout
+        return _to_date(fields[2], second, first), layout
+    except ValueError:
+        return None, None
+
+
+def _remember(seller, layout):
+    if seller and layout and _seller_formats.get(seller) != layout:
+        if len(_seller_formats) >= SELLER_CACHE_SIZE:
+            _seller_formats.clear()
+        _seller_formats[seller] = layout
+
+
+def parse_date(value, seller=None):
+    """
+    Reads a whole date value ("Aug 14, 2025", "14/08/2025", "١٤٤٧/٠٢/٢٠ هـ", ...) and returns
+    it as YYYY-MM-DD, or None if it is not a date. Hijri dates are converted to Gregorian.
+    seller (VAT number or name) keys the per-seller layout cache.
+    """
+    if not value:
+        return None
+    text = ERA_SUFFIX_PATTERN.sub('', _prepare(value))
+    hint = _seller_formats.get(seller) if seller else None
+
+    if hint:
+        match = FORMAT_PATTERNS[hint].fullmatch(text)
+        if match:
+            parsed, layout = _read(hint, match.groups(), hint)
+            if parsed:
+                return parsed.isoformat()
+
+    match = DATE_PATTERN.fullmatch(text)
+    if not match:
+        return None
+    name = match.lastgroup
+    parsed, layout = _read(name, FORMAT_PATTERNS[name].fullmatch(text).groups(), hint)
+    if parsed is None:
+        return None
+    _remember(seller, layout)
+    return parsed.isoformat()
+
+
+def find_date(text):
+    """
+    Returns the first date in a line of free text as YYYY-MM-DD, or None.
+    """
+    text = _prepare(text)
+    for match in DATE_SEARCH_PATTERN.finditer(text):
+        name = match.lastgroup
+        parsed, _ = _read(name, FORMAT_PATTERNS[name].fullmatch(match.group()).groups())
+        if parsed:
+            return parsed.isoformat()
+    return None
+
+
+def _in_parentheses(text, match):
+    # Accounting notation for a negative amount: "(100.00)", "(SAR 1,200.00)"; not "(15%)"
+    before = text[:match.start()]
+    opened = before.rfind("(")
+    closed = text.find(")", match.end())
+    if opened <= before.rfind(")") or closed < 0:
+        return False
+    return not PARENTHESIZED_NOISE_PATTERN.search(text[opened + 1:match.start()] + text[match.end():closed])
+
+
+def clean_amount(value):
+    """
+    "1,098.25" / "SAR 1098.25" / "١٬٠٩٨٫٢٥ ر.س" / 1098.25 -> "1098.25" (the first number
+    in the value, without thousands separators), or None if it holds no number.
+    A number in parentheses is negative: "(100.00)" -> "-100.00".
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return str(value)
+    text = _prepare(value)
+    match = AMOUNT_PATTERN.search(text)
+    if not match:
+        return None
+    amount = match.group().replace(",", "")
+    if "(" in text and amount[0] != "-" and _in_parentheses(text, match):
+        return "-" + amount
+    return amount
+
+
+def parse_amount(value):
+    """
+    Like clean_amount, but returns a float.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    cleaned = clean_amount(value)
+    return float(cleaned) if cleaned is not None else None
+
+
+def normalize_line_items(items):
+    """
+    Cleans quantity, unit_price and total of every line item in place with clean_amount.
+    Values that hold no number are left as they are. Returns items.
+    """
+    clean = clean_amount
+    for item in items:
+        for field in AMOUNT_FIELDS:
+            value = item.get(field)
+            if value is not None:
+                cleaned = clean(value)
+                if cleaned is not None:
+                    item[field] = cleaned
+    return items
+
+
+def seller_key(invoice):
+    seller = invoice.get("seller") or {}
+    return seller.get("vat_number") or seller.get("name_english") or seller.get("name_arabic")
+
+
+def normalize_invoice(invoice):
+    """
+    Normalizes an extracted invoice in place: dates to YYYY-MM-DD and amounts to plain
+    numbers. Values that cannot be read are kept as extracted. Returns invoice.
+    """
+    seller = seller_key(invoice)
+    for field in DATE_FIELDS:
+        value = invoice.get(field)
+        if value:
+            invoice[field] = parse_date(value, seller) or value
+
+    totals = invoice.get("totals")
+    if totals:
+        for field in TOTAL_FIELDS:
+            cleaned = clean_amount(totals.get(field))
+            if cleaned is not None:
+                totals[field] = cleaned
+
+    if invoice.get("line_items"):
+        normalize_line_items(invoice["line_items"])
+    return invoice
@@ -1,8 +1,58 @@
+import os
 import re
 import json
 import sys
 
+from normalize import find_date, clean_amount
+
+ARABIC_CHARS_PATTERN = re.compile(r'[\u0600-\u06FF]+')
+
+# --- Single-pass engine for parse_invoice_text ---
+# All patterns are compiled once at import. Each line is visited once; cheap str checks
+# decide which patterns can match at all (amounts need a ".", dates a ",", VAT numbers
+# 15 characters) before any regex runs. A single combined alternation was measured
+# slower than these gated per-kind patterns under CPython's re.
+# Date: "Aug 14, 2025"
+DATE_SCAN_PATTERN = re.compile(r'\b[A-Za-z]{3}\s+\d{1,2},\s+\d{4}')
+# Amount: "832.60", "724.00" or "1,098.25" - numbers with 2 decimals
+AMOUNT_SCAN_PATTERN = re.compile(r'\b\d{1,3}(?:,\d{3})+\.\d{2}\b|\b\d+\.\d{2}\b')
+# VAT: 15 digits starting with 3
+VAT_SCAN_PATTERN = re.compile(r'\b3\d{14}\b')
+NON_WORD_PATTERN = re.compile(r'[^\w\s]')
+INVOICE_LABEL = "Invoice No"
+INVOICE_LABEL_VALUE_PATTERN = re.compile(r'Invoice No\.?\s*[:#]?\s*(\d+)\b')
+# LTR/RTL marks that text layers put around numbers
+DIRECTION_MARKS = "\u200e\u200f"
+# Invoice numbers are short; longer standalone numbers are account/CR/VAT numbers
+INVOICE_NUMBER_MAX_DIGITS = 10
+# English company name is usually near the top, all caps
+COMPANY_NAME_WORDS = ("EST", "TRADING", "COMPANY", "LTD")
+COMPANY_NAME_MAX_LINE = 10
+PAGE_MARKER_PATTERN = re.compile(r'^--- Page \d+ ---$')
+
+
+def iter_lines(source):
+    """
+    Yields stripped, non-empty lines from a string or any iterable of lines
+    (an open file, a generator), without building an intermediate list.
+    """
+    if isinstance(source, str):
+        source = source.splitlines()
+    for line in source:
+        line = line.strip()
+        if line:
+            yield line
+
+
+def _looks_like_year(digits):
+    return len(digits) == 4 and digits[:2] in ("19", "20")
+
+
 def parse_invoice_text(text):
+    """
+    Heuristic extraction from a raw text dump in a single pass over the lines.
+    text may be a string or an iterable of lines.
+    """
     data = {
         "invoice_number": None,
         "citation_date": None, # Invoice Date
@@ -15,110 +65,270 @@ def parse_invoice_text(text):
         "arabic_lines": [],
         "all_lines": []
     }
+    all_lines = data["all_lines"]
+    arabic_lines = data["arabic_lines"]
+    line_items = data["potential_line_items"]
 
-    lines = [line.strip() for line in text.split('\n') if line.strip()]
-    data["all_lines"] = lines
-
-    # Regex patterns
-    # Invoice Number: Look for "Invoice No" or just a number like 6051 if labeled
-    # Date: "Aug 14, 2025"
-    date_pattern = re.compile(r'([A-Za-z]{3}\s+\d{1,2},\s+\d{4})')
-    # Amount: "832.60" or "724.00" - looking for numbers with 2 decimals
-    amount_pattern = re.compile(r'\b\d+\.\d{2}\b')
-    # VAT: 15 digits starting with 3
-    vat_pattern = re.compile(r'\b3\d{14}\b')
-    # Arabic: Range \u0600-\u06FF
-    arabic_pattern = re.compile(r'[\u0600-\u06FF]+')
-
-    dates_found = []
-    amounts_found = []
-
-    for line in lines:
-        # Arabic extraction
-        if arabic_pattern.search(line):
-            data["arabic_lines"].append(line)
+    first_date = last_date = None
+    date_count = 0
+    max_amount = None
+    # Fallback invoice number: first standalone number of 4-10 digits that is not a year
+    fallback_invoice_number = None
+
+    for index, line in enumerate(iter_lines(text)):
+        all_lines.append(line)
+
+        amounts = AMOUNT_SCAN_PATTERN.findall(line) if "." in line else ()
+
+        if "," in line:
+            dates = DATE_SCAN_PATTERN.findall(line)
+            if dates:
+                if first_date is None:
+                    first_date = dates[0]
+                last_date = dates[-1]
+                date_count += len(dates)
+
+        if not data["vat_number"] and len(line) >= 15:
+            vat = VAT_SCAN_PATTERN.search(line)
+            if vat:
+                data["vat_number"] = vat.group(0)
+
+        has_arabic = ARABIC_CHARS_PATTERN.search(line) is not None
+
+        if has_arabic:
+            arabic_lines.append(line)
             # Simple heuristic for Arabic company name (usually at top)
             if not data["company_name_ar"] and len(line) > 10:
-                 data["company_name_ar"] = line
-
-        # Date extraction
-        dates = date_pattern.findall(line)
-        if dates:
-            dates_found.extend(dates)
-        
-        # Amount extraction
-        amounts = amount_pattern.findall(line)
-        if amounts:
-            amounts_found.extend([float(x) for x in amounts])
-
-        # VAT extraction
-        vat = vat_pattern.search(line)
-        if vat and not data["vat_number"]:
-            data["vat_number"] = vat.group(0)
-
-        # Invoice Number Heuristic
-        # Looking for standalone numbers or labels
-        if "Invoice No" in line or "6051" in line:
-             # Try to find the number in this line or storing context?
-             # Based on previous file, "6051" was on its own line.
-             # Remove LTR/RTL marks if any
-             clean_line = re.sub(r'[^\w\s]', '', line)
-             if clean_line.strip().isdigit():
-                 data["invoice_number"] = clean_line.strip()
-    
-    # Fallback for Invoice Number: Look for 4 digit number on its own line if not found
+                data["company_name_ar"] = line
+
+        for amount in amounts:
+            value = float(amount.replace(",", ""))
+            if max_amount is None or value > max_amount:
+                max_amount = value
+
+        # Table rows like "1.00 724.00 108.60" (Qty/Price/Tax)
+        if len(amounts) >= 2:
+            line_items.append({"raw_line": line, "values": amounts})
+
+        if not data["company_name_en"] and index < COMPANY_NAME_MAX_LINE:
+            if any(word in line for word in COMPANY_NAME_WORDS):
+                data["company_name_en"] = line
+
+        bare = line.strip(DIRECTION_MARKS)
+        if bare.isdigit():
+            if (fallback_invoice_number is None and 4 <= len(bare) <= INVOICE_NUMBER_MAX_DIGITS
+                    and not _looks_like_year(bare)):
+                fallback_invoice_number = bare
+        elif INVOICE_LABEL in line:
+            # "Invoice No: 1867" on one line, or the number alone after removing LTR/RTL marks
+            match = INVOICE_LABEL_VALUE_PATTERN.search(line)
+            clean_line = NON_WORD_PATTERN.sub('', line).strip()
+            if match:
+                data["invoice_number"] = match.group(1)
+            elif clean_line.isdigit():
+                data["invoice_number"] = clean_line
+
     if not data["invoice_number"]:
-        for line in lines:
-            clean_line = line.strip()
-            # 6051 is 4 digits. Avoid 2025 (year).
-            if clean_line.isdigit() and len(clean_line) >= 4 and clean_line != "2025":
-                 # Check if it's already used as date year?
-                 if "202" not in clean_line: # Simple heuristic to avoid years
-                     data["invoice_number"] = clean_line
-                     break
-    
-    # Post-processing heuristics
-    if dates_found:
-        data["citation_date"] = dates_found[0] # Assume first date is invoice date
-        if len(dates_found) > 1:
-            data["due_date"] = dates_found[-1] # Assume last date is due date
-
-    if amounts_found:
-        # Total is usually the collected max amount, or specific repeating amount
-        # In this invoice: 832.60 is the total. 724.00 is subtotal.
-        data["total_amount"] = max(amounts_found)
-
-    # Companies
-    # Heuristic: English company name is usually near the top, all caps
-    for line in lines[:10]:
-        if "EST" in line or "TRADING" in line or "COMPANY" in line or "LTD" in line:
-            data["company_name_en"] = line
+        data["invoice_number"] = fallback_invoice_number
+
+    # Assume first date is invoice date, last date is due date
+    data["citation_date"] = first_date
+    if date_count > 1:
+        data["due_date"] = last_date
+
+    # Total is usually the largest amount on the invoice
+    data["total_amount"] = max_amount
+
+    return data
+
+
+def count_pages(lines):
+    """
+    Number of "--- Page N ---" markers in a text dump (at least 1).
+    """
+    return max(1, sum(1 for line in lines if PAGE_MARKER_PATTERN.match(line)))
+
+
+# --- Gemini-schema extractor used by the text-layer fast path ---
+
+# Bidi/format marks that PDF text layers put around Arabic/English runs
+BIDI_MARKS_PATTERN = re.compile(r'[\u200e\u200f\u202a-\u202e\u2066-\u2069]')
+# Amount with optional thousands separators: "1,098.25", "724.00"
+MONEY_PATTERN = re.compile(r'(?<![\d.])\d{1,3}(?:,\d{3})+\.\d{2}(?![\d.])|(?<![\d.,])\d+\.\d{2}(?![\d.])')
+VAT_NUMBER_PATTERN = re.compile(r'\b3\d{13}3\b')
+CR_NUMBER_PATTERN = re.compile(r'\b\d{10}\b')
+IBAN_PATTERN = re.compile(r'\b[A-Z]{2}\d{2}[A-Z0-9]{11,30}\b')
+STANDALONE_NUMBER_PATTERN = re.compile(r'^[A-Z]{0,4}[-/]?\d{3,10}$')
+INVOICE_NUMBER_VALUE_PATTERN = re.compile(r'\b([A-Z]{0,5}[-/]?\d[\w/-]{0,19})\b')
+
+INVOICE_NUMBER_LABEL = re.compile(r'invoice\s*(?:no\.?|number|#)|رقم الفاتورة', re.IGNORECASE)
+INVOICE_DATE_LABEL = re.compile(r'invoice\s*date|تاريخ الفاتورة', re.IGNORECASE)
+DUE_DATE_LABEL = re.compile(r'due\s*date|تاريخ الاستحقاق', re.IGNORECASE)
+SUBTOTAL_LABEL = re.compile(r'sub\s*-?\s*total|المجموع الفرعي', re.IGNORECASE)
+VAT_AMOUNT_LABEL = re.compile(r'tax\s*total|total\s*(?:vat|tax)|vat\s*amount|إجمالي الضرائب', re.IGNORECASE)
+GRAND_TOTAL_LABEL = re.compile(r'grand\s*total|total\s*amount|(?<!sub)(?<!sub )\btotal\b(?!\s*\()', re.IGNORECASE)
+BUYER_LABEL = re.compile(r'customer|buyer|bill\s*to|للعميل', re.IGNORECASE)
+BUYER_NAME_LABEL = re.compile(r'(?:company|customer)\s*name\s*:?\s*(.+)', re.IGNORECASE)
+CR_LABEL = re.compile(r'\bC\.?R\b|السجل التجاري')
+COMPANY_WORDS = re.compile(r'\b(?:EST|TRADING|COMPANY|CO\.?|LTD|LLC)\b', re.IGNORECASE)
+TABLE_HEADER_PATTERN = re.compile(r'\bqty\b|unit\s*price|description|الكمية', re.IGNORECASE)
+
+
+def _clean(line):
+    return BIDI_MARKS_PATTERN.sub('', line).strip()
+
+
+def _value_after_label(lines, index, finder, lookahead=2):
+    """
+    Text layers put a label's value on the same line or on one of the next lines.
+    Returns the first value finder() gets from the label line (after the label) or the lookahead lines.
+    """
+    for offset in range(0, lookahead + 1):
+        if index + offset >= len(lines):
             break
-            
-    # Table Content Heuristic
-    # We saw "1.00 724.00 108.60" as a pattern for Qty/Price/Tax
-    # We saw product descriptions roughly around the same area or in a block.
-    # Since text is destructured, we collect "Potential Line Items" by looking for the Line Item Price properties
-    
-    for line in lines:
-        # Check if line looks like "1.00 724.00 108.60"
-        nums = amount_pattern.findall(line)
-        if len(nums) >= 2:
-            data["potential_line_items"].append({
-                "raw_line": line,
-                "values": nums
+        value = finder(lines[index + offset])
+        if value:
+            return value
+    return None
+
+
+def parse_invoice_fields(text):
+    """
+    Extracts an invoice from a PDF text layer into the same schema the Gemini prompt uses.
+    Label/value pairs are matched on the same or following lines; anything the layout
+    does not reveal is left as None. Pair with invoice_checks.check_invoice to decide
+    whether the result is trustworthy.
+    """
+    lines = [_clean(line) for line in text.split('\n')]
+    lines = [line for line in lines if line]
+
+    data = {
+        "invoice_number": None,
+        "invoice_date": None,
+        "due_date": None,
+        "seller": {"name_english": None, "name_arabic": None, "address": None, "vat_number": None, "cr_number": None},
+        "buyer": {"name": None, "address": None, "vat_number": None},
+        "line_items": [],
+        "totals": {"subtotal": None, "vat_amount": None, "grand_total": None},
+        "bank_details": {"bank_name": None, "account_number": None, "iban": None},
+    }
+    seller, buyer, totals, bank = data["seller"], data["buyer"], data["totals"], data["bank_details"]
+
+    def first_money(line):
+        found = MONEY_PATTERN.findall(line)
+        return clean_amount(found[0]) if found else None
+
+    def invoice_number_value(line):
+        stripped = INVOICE_NUMBER_LABEL.sub('', line)
+        match = INVOICE_NUMBER_VALUE_PATTERN.search(stripped)
+        return match.group(1) if match and not find_date(stripped) else None
+
+    dates = []
+    standalone_numbers = []
+    previous_text_line = None
+
+    for i, line in enumerate(lines):
+        iso_date = find_date(line)
+        if iso_date:
+            dates.append(iso_date)
+
+        if STANDALONE_NUMBER_PATTERN.match(line) and not line.startswith("20"):
+            standalone_numbers.append(line)
+
+        for vat in VAT_NUMBER_PATTERN.findall(line):
+            if BUYER_LABEL.search(line):
+                buyer["vat_number"] = buyer["vat_number"] or vat
+            elif not seller["vat_number"] and vat != buyer["vat_number"]:
+                seller["vat_number"] = vat
+
+        if not seller["cr_number"] and CR_LABEL.search(line):
+            match = CR_NUMBER_PATTERN.search(line)
+            if match:
+                seller["cr_number"] = match.group(0)
+
+        if not seller["name_arabic"] and ARABIC_CHARS_PATTERN.search(line) and len(line) > 10 and i < 10:
+            seller["name_arabic"] = line
+        if not seller["name_english"] and i < 10 and COMPANY_WORDS.search(line) and not ARABIC_CHARS_PATTERN.search(line):
+            seller["name_english"] = line
+
+        if not buyer["name"]:
+            match = BUYER_NAME_LABEL.search(line)
+            if match:
+                buyer["name"] = ARABIC_CHARS_PATTERN.sub('', match.group(1)).strip() or None
+
+        if not data["invoice_number"] and INVOICE_NUMBER_LABEL.search(line):
+            data["invoice_number"] = _value_after_label(lines, i, invoice_number_value)
+        if not data["invoice_date"] and INVOICE_DATE_LABEL.search(line):
+            data["invoice_date"] = _value_after_label(lines, i, find_date)
+        # Only a labelled due date: an unlabelled date is as likely part of a serial number
+        if not data["due_date"] and DUE_DATE_LABEL.search(line):
+            data["due_date"] = _value_after_label(lines, i, find_date)
+
+        if not totals["subtotal"] and SUBTOTAL_LABEL.search(line):
+            totals["subtotal"] = _value_after_label(lines, i, first_money, lookahead=1)
+        elif not totals["vat_amount"] and VAT_AMOUNT_LABEL.search(line):
+            totals["vat_amount"] = _value_after_label(lines, i, first_money, lookahead=1)
+        elif not totals["grand_total"] and GRAND_TOTAL_LABEL.search(line):
+            totals["grand_total"] = _value_after_label(lines, i, first_money, lookahead=1)
+
+        if not bank["iban"]:
+            match = IBAN_PATTERN.search(line.replace(' ', ''))
+            if match:
+                bank["iban"] = match.group(0)
+        if not bank["bank_name"] and len(line) > 8 and re.search(r'\bbank\b', line, re.IGNORECASE) and 'name' not in line.lower():
+            bank["bank_name"] = line
+
+        # Line item rows: qty, unit price, then tax and/or total
+        amounts = [clean_amount(x) for x in MONEY_PATTERN.findall(line)]
+        if len(amounts) >= 3 and not (SUBTOTAL_LABEL.search(line) or GRAND_TOTAL_LABEL.search(line)):
+            quantity, unit_price = float(amounts[0]), float(amounts[1])
+            line_total = quantity * unit_price
+            total = next((a for a in amounts[2:] if abs(float(a) - line_total) < 0.01), f"{line_total:.2f}")
+            data["line_items"].append({
+                "description": previous_text_line,
+                "quantity": amounts[0],
+                "unit_price": amounts[1],
+                "total": total,
             })
+        elif not MONEY_PATTERN.search(line) and not line.isdigit() and not TABLE_HEADER_PATTERN.search(line):
+            previous_text_line = line
+
+    if not data["invoice_number"]:
+        # Columnar layouts list the labels first and the values later; take a standalone
+        # number that is not a VAT/CR/account number
+        data["invoice_number"] = next((n for n in standalone_numbers if len(n) <= 10), None)
+    if not data["invoice_date"] and dates:
+        data["invoice_date"] = dates[0]
 
     return data
 
+
+def iter_corpus(paths):
+    """
+    Yields (path, text) for every .txt file under the given files/directories.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith(".txt"):
+                    yield from iter_corpus([os.path.join(path, name)])
+        else:
+            with open(path, 'r') as f:
+                yield path, f.read()
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python3 parser.py <filename>")
+        print("Usage: python3 parser.py <filename> [<filename or directory> ...]")
         sys.exit(1)
-    
-    filename = sys.argv[1]
-    with open(filename, 'r') as f:
-        text = f.read()
-    
-    parsed = parse_invoice_text(text)
-    print(json.dumps(parsed, indent=4, ensure_ascii=False))
+
+    if len(sys.argv) == 2 and not os.path.isdir(sys.argv[1]):
+        filename = sys.argv[1]
+        with open(filename, 'r') as f:
+            parsed = parse_invoice_text(f)
+        print(json.dumps(parsed, indent=4, ensure_ascii=False))
+    else:
+        # Corpus mode: one JSON line per text dump
+        for path, text in iter_corpus(sys.argv[1:]):
+            parsed = parse_invoice_text(text)
+            print(json.dumps({"file": path, **parsed}, ensure_ascii=False))
@@ -0,0 +1,179 @@
+import io
+import re
+import logging
+
+from text_layer import load_pypdf
+from pdf_split import INVOICE_HEADER_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# Gemini bills every PDF page as one image of this many tokens, whatever its resolution
+TOKENS_PER_PAGE = 258
+
+# Pages that are only terms and conditions, remittance slips and the like
+BOILERPLATE_PATTERN = re.compile(
+    r'terms\s+(?:and|&)\s+conditions|general\s+conditions|conditions\s+of\s+sale|الشروط\s+والأحكام',
+    re.IGNORECASE,
+)
+# ...unless they also carry invoice data
+INVOICE_DATA_PATTERN = re.compile(r'\btotal\b|\bvat\b|\bqty\b|الإجمالي|المجموع|ضريبة', re.IGNORECASE)
+
+# A page with less text than this and no drawing is blank
+BLANK_TEXT_CHARS = 20
+BLANK_CONTENT_BYTES = 200
+# A scanned page is blank when fewer than this share of its pixels are darker than light grey
+BLANK_INK_RATIO = 0.002
+
+# Images smaller than this (logos, stamps) are left alone
+MIN_IMAGE_PIXELS = 200 * 200
+
+# Document-level entries the model never looks at
+DROPPED_ROOT_KEYS = ("/Metadata", "/Outlines", "/OpenAction", "/AA", "/Threads", "/PieceInfo")
+DROPPED_PAGE_KEYS = ("/Thumb", "/PieceInfo", "/Metadata", "/AA")
+
+
+def load_pillow():
+    """
+    Imports Pillow on first use, or returns None when it is not installed.
+    Without it, page images are left as they are.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+def _page_dpi(image, page):
+    # Scans fill the page, so the image size over the page size is its resolution.
+    # A smaller image (a logo) comes out lower than its real DPI and is left alone.
+    width_in = float(page.mediabox.width) / 72
+    height_in = float(page.mediabox.height) / 72
+    if width_in <= 0 or height_in <= 0:
+        return 0
+    return max(image.width / width_in, image.height / height_in)
+
+
+def _is_blank_image(image):
+    gray = image.convert("L")
+    gray.thumbnail((256, 256))
+    histogram = gray.histogram()
+    return sum(histogram[:200]) / max(1, sum(histogram)) < BLANK_INK_RATIO
+
+
+def _page_text(page):
+    try:
+        return page.extract_text() or ""
+    except Exception:
+        return ""
+
+
+def _content_size(page):
+    try:
+        return len(page.get_contents().get_data()) if page.get_contents() is not None else 0
+    except Exception:
+        return BLANK_CONTENT_BYTES
+
+
+def _trim_reason(page, text, images):
+    """
+    "blank" or "boilerplate" when the page can be left out, else None.
+    """
+    if len(text.strip()) < BLANK_TEXT_CHARS:
+        if images:
+            if all(_is_blank_image(image) for image in images):
+                return "blank"
+        elif _content_size(page) < BLANK_CONTENT_BYTES:
+            return "blank"
+        return None
+    if (BOILERPLATE_PATTERN.search(text) and not INVOICE_HEADER_PATTERN.search(text)
+            and not INVOICE_DATA_PATTERN.search(text)):
+        return "boilerplate"
+    return None
+
+
+def _page_images(page):
+    try:
+        return list(page.images)
+    except Exception as e:
+        logger.warning("Could not read page images: %s", e)
+        return []
+
+
+def preprocess_pdf(data, dpi=150, grayscale=True, jpeg_quality=60, trim_pages=True):
+    """
+    Shrinks a PDF before it is sent to the model: page images above dpi are downsampled
+    (and made grayscale) and re-encoded as JPEG, blank and boilerplate pages are dropped
+    (never the first page), and metadata, thumbnails, bookmarks, links and duplicate
+    objects are removed.
+    Returns (data, report). data is None when nothing got smaller, so a process pool
+    does not have to send the original back. CPU-bound; main runs it in a process pool.
+    """
+    report = {
+        "bytes_before": len(data), "bytes_after": len(data), "bytes_saved": 0,
+        "pages_before": 0, "pages_after": 0, "trimmed": {}, "images_resampled": 0, "tokens_saved": 0,
+    }
+    pypdf = load_pypdf()
+    if pypdf is None:
+        return None, report
+    Image = load_pillow()
+
+    try:
+        writer = pypdf.PdfWriter(clone_from=pypdf.PdfReader(io.BytesIO(data)))
+    except Exception as e:
+        logger.warning("PDF pre-processing skipped: %s", e)
+        return None, report
+    report["pages_before"] = len(writer.pages)
+
+    drop = []
+    for index, page in enumerate(writer.pages):
+        images = _page_images(page) if Image is not None else []
+        pil_images = []
+        for image_file in images:
+            try:
+                image = image_file.image
+            except Exception:
+                continue
+            pil_images.append(image)
+            if image.width * image.height < MIN_IMAGE_PIXELS:
+                continue
+            image_dpi = _page_dpi(image, page)
+            scale = dpi / image_dpi if image_dpi else 1
+            if scale >= 0.9 and not (grayscale and image.mode not in ("L", "1")):
+                continue
+            if scale < 0.9:
+                image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+            image = image.convert("L" if grayscale else "RGB")
+            try:
+                image_file.replace(image, quality=jpeg_quality)
+                report["images_resampled"] += 1
+            except Exception as e:
+                logger.warning("Could not replace page image: %s", e)
+
+        if trim_pages and index > 0:
+            reason = _trim_reason(page, _page_text(page), pil_images)
+            if reason is not None:
+                drop.append(index)
+                report["trimmed"][reason] = report["trimmed"].get(reason, 0) + 1
+
+        for key in DROPPED_PAGE_KEYS:
+            page.pop(key, None)
+        page.compress_content_streams()
+
+    for index in reversed(drop):
+        writer.remove_page(index)
+    for key in DROPPED_ROOT_KEYS:
+        writer.root_object.pop(key, None)
+    writer.remove_links()
+    writer.compress_identical_objects(remove_identicals=True, remove_orphans=True)
+
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    output = buffer.getvalue()
+    report["pages_after"] = len(writer.pages)
+    report["tokens_saved"] = len(drop) * TOKENS_PER_PAGE
+    if len(output) >= len(data) and not drop:
+        return None, {**report, "pages_after": report["pages_before"], "images_resampled": 0}
+    report["bytes_after"] = len(output)
+    report["bytes_saved"] = len(data) - len(output)
+    return output, report
@@ -0,0 +1,132 @@
+import io
+import re
+import copy
+
+from parser import INVOICE_LABEL_VALUE_PATTERN
+from invoice_checks import MISSING_VALUES
+from text_layer import load_pypdf
+
+# A page that carries an invoice header starts a new invoice (unless it repeats the same number)
+INVOICE_HEADER_PATTERN = re.compile(r'tax\s+invoice|\binvoice\s*(?:no|number|#)|فاتورة ضريبية|رقم الفاتورة', re.IGNORECASE)
+
+
+def _page_invoice_number(text):
+    match = INVOICE_LABEL_VALUE_PATTERN.search(text)
+    return match.group(1) if match else None
+
+
+def plan_chunks(file_content, max_pages_per_chunk=4):
+    """
+    Splits the document into page ranges [(start, end), ...] (0-based, end exclusive).
+
+    With a text layer, a page that has an invoice header with a new invoice number starts a
+    new range, so each range holds one invoice. Scanned pages have no text to look at and are
+    cut into fixed ranges. Either way no range is longer than max_pages_per_chunk; an invoice
+    spanning more pages is continued in the next range and merged back afterwards.
+    """
+    reader = load_pypdf().PdfReader(io.BytesIO(file_content))
+    total = len(reader.pages)
+
+    starts = [0]
+    current_number = None
+    for index, page in enumerate(reader.pages):
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        if index > 0 and INVOICE_HEADER_PATTERN.search(text):
+            number = _page_invoice_number(text)
+            if number is None or number != current_number:
+                starts.append(index)
+        if INVOICE_HEADER_PATTERN.search(text):
+            current_number = _page_invoice_number(text) or current_number
+
+    ranges = []
+    for start, end in zip(starts, starts[1:] + [total]):
+        for chunk_start in range(start, end, max_pages_per_chunk):
+            ranges.append((chunk_start, min(chunk_start + max_pages_per_chunk, end)))
+    return ranges
+
+
+def split_pdf(file_content, max_pages_per_chunk=4):
+    """
+    Returns [(start, end, chunk_bytes), ...] for the ranges from plan_chunks.
+    A document that fits in one range is returned as is, without re-encoding.
+    """
+    pypdf = load_pypdf()
+    if pypdf is None:  # Without pypdf documents are sent whole
+        return [(0, 1, file_content)]
+
+    ranges = plan_chunks(file_content, max_pages_per_chunk)
+    if len(ranges) <= 1:
+        return [(0, ranges[0][1] if ranges else 1, file_content)]
+
+    reader = pypdf.PdfReader(io.BytesIO(file_content))
+    chunks = []
+    for start, end in ranges:
+        writer = pypdf.PdfWriter()
+        for page in reader.pages[start:end]:
+            writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        chunks.append((start, end, buffer.getvalue()))
+    return chunks
+
+
+def _is_missing(value):
+    if isinstance(value, dict):
+        return all(_is_missing(v) for v in value.values())
+    return value in MISSING_VALUES
+
+
+def _fill_missing(target, source):
+    for key, value in source.items():
+        if key == "line_items":
+            continue
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _fill_missing(target[key], value)
+        elif _is_missing(target.get(key)) and not _is_missing(value):
+            target[key] = value
+
+
+def merge_chunk_invoices(chunk_results):
+    """
+    Merges per-chunk extractions back into a list of invoices.
+    chunk_results is [(start, end, [invoice, ...]), ...] with 0-based page ranges.
+    An invoice whose invoice_number is missing or equal to the previous one continues it:
+    its line items are appended, later totals win, and header fields only fill gaps.
+    A first row equal to the previous chunk's last row is dropped only when the two chunks
+    overlap (the row was read twice from the same page); otherwise it may be a real repeated
+    purchase, so it is kept and its index listed in "possible_duplicate_line_items".
+    The inputs are not modified.
+    """
+    invoices = []
+    for start, end, chunk_invoices in sorted(chunk_results, key=lambda item: item[0]):
+        pages = list(range(start + 1, end + 1))
+        for invoice in chunk_invoices:
+            if not isinstance(invoice, dict):
+                continue
+            invoice = copy.deepcopy(invoice)
+            number = invoice.get("invoice_number")
+            previous = invoices[-1] if invoices else None
+            continues = previous is not None and (
+                _is_missing(number) or number == previous.get("invoice_number")
+            )
+            if not continues:
+                invoice["line_items"] = list(invoice.get("line_items") or [])
+                invoice["pages"] = pages
+                invoices.append(invoice)
+                continue
+
+            items = invoice.get("line_items") or []
+            if items and previous["line_items"] and items[0] == previous["line_items"][-1]:
+                if pages[0] <= previous["pages"][-1]:
+                    items = items[1:]
+                else:
+                    previous.setdefault("possible_duplicate_line_items", []).append(len(previous["line_items"]))
+            previous["line_items"].extend(items)
+            if not _is_missing(invoice.get("totals")):
+                previous["totals"] = invoice["totals"]
+            _fill_missing(previous, invoice)
+            previous["pages"] = sorted(set(previous["pages"]) | set(pages))
+    return invoices
@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from decimal import Decimal, InvalidOperation
+
+from normalize import clean_amount
+
+PUSHED = "pushed"
+PENDING = "pending"
+
+# A pending reservation older than this belongs to a push that crashed; it may be retried
+PENDING_TIMEOUT = 300
+
+VAT_CLEAN_PATTERN = re.compile(r'\D')
+
+# Written into the notes of every invoice create_invoice pushes, so reconcile can read back
+# the key computed from the extracted data (Zoho's own total and contact VAT can differ)
+LEDGER_NOTE_PREFIX = "Ledger key: "
+LEDGER_NOTE_PATTERN = re.compile(r'^' + re.escape(LEDGER_NOTE_PREFIX) + r'(\S+)\s*$', re.MULTILINE)
+
+
+def _normalize_total(value):
+    cleaned = clean_amount(value)
+    if cleaned is None:
+        return None
+    try:
+        return str(Decimal(cleaned).quantize(Decimal("0.01")))
+    except InvalidOperation:
+        return None
+
+
+def ledger_key(seller_vat, invoice_number, grand_total):
+    """
+    Identity of a supplier invoice: seller VAT + invoice number + grand total.
+    Returns None when the invoice number is missing, since nothing can be deduplicated then.
+    """
+    invoice_number = str(invoice_number or "").strip()
+    if not invoice_number:
+        return None
+    vat = VAT_CLEAN_PATTERN.sub("", str(seller_vat or ""))
+    total = _normalize_total(grand_total) or ""
+    return f"{vat}|{invoice_number}|{total}"
+
+
+def ledger_key_for(invoice_data):
+    seller = invoice_data.get("seller") or {}
+    totals = invoice_data.get("totals") or {}
+    return ledger_key(seller.get("vat_number"), invoice_data.get("invoice_number"), totals.get("grand_total"))
+
+
+def ledger_note(key):
+    return f"{LEDGER_NOTE_PREFIX}{key}"
+
+
+def ledger_key_from_notes(notes):
+    match = LEDGER_NOTE_PATTERN.search(notes or "")
+    return match.group(1) if match else None
+
+
+class PushLedger:
+    """
+    SQLite record of invoices already created in Zoho Books, so a repeat push of the
+    same supplier invoice returns the recorded Zoho invoice instead of creating a duplicate.
+    """
+
+    def __init__(self, db_path="data/push_ledger.db"):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pushes (
+                key TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                zoho_invoice_id TEXT,
+                invoice TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def get(self, key):
+        """
+        Returns the recorded Zoho invoice dict for key, or None.
+        """
+        if key is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT invoice FROM pushes WHERE key = ? AND status = ?", (key, PUSHED)
+            ).fetchone()
+        return json.loads(row["invoice"]) if row else None
+
+    def reserve(self, key):
+        """
+        Claims key before pushing so two concurrent pushes of the same invoice cannot both
+        create it. Returns (True, None, stale) when the caller may push, where stale is True
+        if it took over a pending reservation older than PENDING_TIMEOUT (that push may have
+        created the invoice), or (False, invoice, False) where invoice is the recorded result
+        (None if another push is still in progress).
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT status, invoice, updated_at FROM pushes WHERE key = ?", (key,)
+                ).fetchone()
+                if row and (row["status"] == PUSHED or now - row["updated_at"] < PENDING_TIMEOUT):
+                    self._conn.execute("COMMIT")
+                    return False, json.loads(row["invoice"]) if row["invoice"] else None, False
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO pushes (key, status, updated_at) VALUES (?, ?, ?)",
+                    (key, PENDING, now),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True, None, row is not None
+
+    def record(self, key, invoice):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pushes (key, status, zoho_invoice_id, invoice, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, PUSHED, invoice.get("invoice_id"), json.dumps(invoice, ensure_ascii=False), time.time()),
+            )
+
+    def release(self, key):
+        """
+        Drops a reservation after a failed push so it can be retried.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM pushes WHERE key = ? AND status = ?", (key, PENDING))
+
+    def reconcile(self, client, reference_numbers=None):
+        """
+        Rebuilds the ledger from the invoices in Zoho Books.
+        The key of each invoice is read back from the ledger note create_invoice writes
+        into its notes; the invoice list does not carry notes, so each invoice is fetched.
+        Invoices without the note (created by hand, or pushed before the note existed)
+        are skipped.
+        With reference_numbers, only those invoices are looked up and re-recorded;
+        otherwise every pushed entry is replaced by what Zoho currently holds.
+        Returns the number of entries recorded.
+        """
+        if reference_numbers:
+            invoices = []
+            for reference_number in reference_numbers:
+                invoices.extend(client.iter_invoices(reference_number=reference_number))
+        else:
+            invoices = list(client.iter_invoices())
+
+        entries = []
+        for invoice in invoices:
+            notes = invoice.get("notes")
+            if notes is None:
+                notes = (client.get_invoice(invoice["invoice_id"]) or {}).get("notes")
+            key = ledger_key_from_notes(notes)
+            if key:
+                entries.append((key, slim_invoice(invoice)))
+
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not reference_numbers:
+                    self._conn.execute("DELETE FROM pushes WHERE status = ?", (PUSHED,))
+                now = time.time()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO pushes (key, status, zoho_invoice_id, invoice, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(key, PUSHED, inv.get("invoice_id"), json.dumps(inv, ensure_ascii=False), now) for key, inv in entries],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(entries)
+
+
+def slim_invoice(invoice):
+    fields = ("invoice_id", "invoice_number", "reference_number", "customer_id", "customer_name", "date", "total", "status")
+    return {field: invoice.get(field) for field in fields if field in invoice}
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from zoho_client import get_zoho_client
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Maintain the ledger of invoices pushed to Zoho Books")
+    sub = parser.add_subparsers(dest="command", required=True)
+    reconcile_parser = sub.add_parser("reconcile", help="Rebuild the ledger from Zoho Books invoices")
+    reconcile_parser.add_argument("--reference", action="append", default=None, help="Only reconcile this reference number (repeatable)")
+    args = parser.parse_args()
+
+    zoho = get_zoho_client()
+    count = zoho.push_ledger.reconcile(zoho, reference_numbers=args.reference)
+    print(f"Recorded {count} pushed invoices in {zoho.push_ledger.db_path}")
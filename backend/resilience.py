@@ -0,0 +1,303 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from admission import AdmissionRejected
+from metrics import CIRCUIT_TRANSITIONS, HEDGED_CALLS
+
+logger = logging.getLogger(__name__)
+
+# Shared by the Gemini and Zoho breakers
+CIRCUIT_FAILURE_RATIO = float(os.getenv("CIRCUIT_FAILURE_RATIO", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+# Retries (and hedges) allowed as a share of requests, on top of one per second
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(AdmissionRejected):
+    """
+    Raised instead of calling an upstream while its circuit breaker is open.
+    An AdmissionRejected, so callers answer it with 503 and Retry-After the same way.
+    """
+
+    def __init__(self, upstream, retry_after):
+        super().__init__(retry_after)
+        self.args = (f"{upstream} is unavailable (circuit open), retry after {retry_after}s",)
+        self.upstream = upstream
+
+
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, upstream, seconds):
+        super().__init__(f"{upstream} did not answer within {seconds:g}s")
+        self.upstream = upstream
+        self.seconds = seconds
+
+
+class CircuitBreaker:
+    """
+    Fails calls to an upstream fast once too many recent calls to it failed.
+
+    Closed: calls go through; outcomes from the last `window` seconds are kept. When at
+    least min_calls were made and failure_ratio of them failed, the breaker opens.
+    Open: check() raises CircuitOpen for open_seconds.
+    Half-open: one probe call is let through; success closes the breaker, failure
+    opens it again.
+    """
+
+    def __init__(self, name, failure_ratio=CIRCUIT_FAILURE_RATIO, min_calls=CIRCUIT_MIN_CALLS, window=30.0,
+                 open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.name = name
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._outcomes = deque()
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "rejected": 0, "opened": 0}
+
+    def _transition(self, state):
+        if state != self.state:
+            logger.warning("Circuit breaker %s", state, extra={"upstream": self.name, "from": self.state})
+            CIRCUIT_TRANSITIONS.inc(upstream=self.name, state=state)
+            self.state = state
+
+    def retry_after(self):
+        return max(1, math.ceil(self.opened_at + self.open_seconds - time.monotonic()))
+
+    def check(self):
+        """
+        Call before each request; raises CircuitOpen when the request must not be sent.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpen(self.name, self.retry_after())
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpen(self.name, 1)
+                self._probing = True
+
+    def record(self, success):
+        """
+        Records the outcome of a request that check() let through.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.stats["calls"] += 1
+            if not success:
+                self.stats["failures"] += 1
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if success:
+                    self._outcomes.clear()
+                    self._transition(CLOSED)
+                else:
+                    self._open(now)
+                return
+
+            self._outcomes.append((now, success))
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, ok in self._outcomes if not ok)
+            if (self.state == CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures >= self.failure_ratio * len(self._outcomes)):
+                self._open(now)
+
+    def release(self):
+        """
+        Gives up a half-open probe without an outcome (the call was cancelled).
+        """
+        with self._lock:
+            self._probing = False
+
+    def _open(self, now):
+        self.opened_at = now
+        self.stats["opened"] += 1
+        self._outcomes.clear()
+        self._transition(OPEN)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {"state": self.state, **self.stats}
+            if self.state == OPEN:
+                snapshot["retry_after"] = self.retry_after()
+        return snapshot
+
+
+class RetryBudget:
+    """
+    Caps retries (and hedged duplicates) at `ratio` of recent requests, plus
+    min_per_second, so a struggling upstream is not hit with a multiple of the normal load.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=1.0, window=10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._requests = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+        self.stats = {"retries": 0, "exhausted": 0}
+
+    def _trim(self, now):
+        for events in (self._requests, self._retries):
+            while events and events[0] < now - self.window:
+                events.popleft()
+
+    def request(self):
+        now = time.monotonic()
+        with self._lock:
+            self._requests.append(now)
+            self._trim(now)
+
+    def try_retry(self):
+        """
+        True (and the retry is counted) if the budget has room for one more retry.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            allowed = self.ratio * len(self._requests) + self.min_per_second * self.window
+            if len(self._retries) >= allowed:
+                self.stats["exhausted"] += 1
+                return False
+            self._retries.append(now)
+            self.stats["retries"] += 1
+            return True
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return {**self.stats, "recent_requests": len(self._requests), "recent_retries": len(self._retries)}
+
+
+class LatencyTracker:
+    """
+    Durations of the last `size` successful calls, for percentile-based hedge delays.
+    """
+
+    def __init__(self, size=200):
+        self._durations = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._durations.append(seconds)
+
+    def __len__(self):
+        return len(self._durations)
+
+    def percentile(self, pct):
+        # Nearest-rank percentile
+        with self._lock:
+            ordered = sorted(self._durations)
+        if not ordered:
+            return None
+        rank = max(1, min(len(ordered), round(pct / 100 * len(ordered) + 0.5)))
+        return ordered[rank - 1]
+
+
+class Hedger:
+    """
+    Hedged requests for one idempotent upstream call: if the first attempt has not
+    finished after the p95 of recent calls, a second one is started and whichever finishes
+    first wins; the other is cancelled. No hedge is sent until min_samples calls were seen,
+    nor when the retry budget is spent.
+    """
+
+    def __init__(self, name, percentile=95, min_samples=20, min_delay=1.0, budget=None):
+        self.name = name
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = budget or RetryBudget()
+        self.latency = LatencyTracker()
+        self.stats = {"calls": 0, "hedged": 0, "hedge_wins": 0}
+
+    def delay(self):
+        if len(self.latency) < self.min_samples:
+            return None
+        return max(self.min_delay, self.latency.percentile(self.percentile))
+
+    async def call(self, make_call):
+        """
+        Awaits make_call() (a coroutine function), hedged as described above.
+        """
+        self.stats["calls"] += 1
+        self.budget.request()
+        started = time.monotonic()
+        delay = self.delay()
+        primary = asyncio.ensure_future(make_call())
+        tasks = [primary]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.budget.try_retry():
+                    self.stats["hedged"] += 1
+                    HEDGED_CALLS.inc(upstream=self.name, outcome="fired")
+                    tasks.append(asyncio.ensure_future(make_call()))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.stats["hedge_wins"] += 1
+                            HEDGED_CALLS.inc(upstream=self.name, outcome="won")
+                        self.latency.observe(time.monotonic() - started)
+                        return task.result()
+                    # The first error is reported unless another attempt succeeds
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            # Let cancelled attempts unwind (release limiter leases) before returning
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def snapshot(self):
+        delay = self.delay()
+        hedged = self.stats["hedged"]
+        return {
+            **self.stats,
+            "hedge_rate": round(hedged / self.stats["calls"], 4) if self.stats["calls"] else 0.0,
+            "hedge_win_rate": round(self.stats["hedge_wins"] / hedged, 4) if hedged else 0.0,
+            "hedge_delay_s": round(delay, 3) if delay is not None else None,
+            "latency_s": {f"p{p}": _rounded(self.latency.percentile(p)) for p in (50, 95, 99)},
+            "retry_budget": self.budget.snapshot(),
+        }
+
+
+def _rounded(value):
+    return round(value, 3) if value is not None else None
+
+
+def is_upstream_failure(error):
+    """
+    True for errors that say the upstream itself is struggling: timeouts, connection
+    errors and 5xx responses (google.api_core errors carry the HTTP status as .code).
+    Quota and client errors are not.
+    """
+    if isinstance(error, AdmissionRejected):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    return isinstance(code, int) and code >= 500
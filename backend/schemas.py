@@ -0,0 +1,104 @@
+from typing import List, Optional
+
+from pydantic import BaseModel, ConfigDict
+
+
+class SchemaModel(BaseModel):
+    # Amounts stay strings, as the prompt always asked: suppliers print "1,098.25" or "SAR 1098.25"
+    # and invoice_checks.to_amount / the Zoho client parse them downstream. A bare number is accepted too.
+    model_config = ConfigDict(coerce_numbers_to_str=True)
+
+
+class Seller(SchemaModel):
+    name_english: Optional[str] = None
+    name_arabic: Optional[str] = None
+    address: Optional[str] = None
+    vat_number: Optional[str] = None
+    cr_number: Optional[str] = None
+
+
+class Buyer(SchemaModel):
+    name: Optional[str] = None
+    address: Optional[str] = None
+    vat_number: Optional[str] = None
+
+
+class LineItem(SchemaModel):
+    description: Optional[str] = None
+    quantity: Optional[str] = None
+    unit_price: Optional[str] = None
+    total: Optional[str] = None
+
+
+class Totals(SchemaModel):
+    subtotal: Optional[str] = None
+    vat_amount: Optional[str] = None
+    grand_total: Optional[str] = None
+
+
+class BankDetails(SchemaModel):
+    bank_name: Optional[str] = None
+    account_number: Optional[str] = None
+    iban: Optional[str] = None
+
+
+class Invoice(SchemaModel):
+    """
+    The extraction schema. Models are the single source for both the Gemini
+    response_schema and the validation of what comes back.
+    """
+
+    invoice_number: Optional[str] = None
+    invoice_date: Optional[str] = None
+    due_date: Optional[str] = None
+    seller: Seller = Seller()
+    buyer: Buyer = Buyer()
+    line_items: List[LineItem] = []
+    totals: Totals = Totals()
+    bank_details: BankDetails = BankDetails()
+
+
+class InvoiceBundle(SchemaModel):
+    """
+    Response for one chunk of a large or multi-invoice PDF.
+    Strict, so a bare invoice (the model ignoring the wrapper) fails validation and goes
+    down the schema-failure path instead of passing as an empty bundle.
+    """
+
+    model_config = ConfigDict(extra="forbid")
+
+    invoices: List[Invoice]
+
+
+def gemini_schema(model):
+    """
+    Converts a Pydantic model to the OpenAPI subset Gemini accepts as response_schema
+    (type, properties, required, items, nullable). Defaults, titles and $refs are not
+    supported there, so they are dropped or inlined.
+    """
+    schema = model.model_json_schema()
+    return _convert(schema, schema.get("$defs", {}))
+
+
+def _convert(node, defs):
+    if "$ref" in node:
+        return _convert(defs[node["$ref"].rsplit("/", 1)[-1]], defs)
+
+    nullable = False
+    if "anyOf" in node:
+        options = [option for option in node["anyOf"] if option.get("type") != "null"]
+        nullable = len(options) < len(node["anyOf"])
+        node = options[0]
+        if "$ref" in node:
+            node = defs[node["$ref"].rsplit("/", 1)[-1]]
+
+    converted = {"type": node["type"]}
+    if node["type"] == "object":
+        converted["properties"] = {name: _convert(prop, defs) for name, prop in node["properties"].items()}
+        # Ask for every key so the model returns null rather than dropping a field
+        converted["required"] = list(node["properties"])
+    elif node["type"] == "array":
+        converted["items"] = _convert(node["items"], defs)
+    if nullable:
+        converted["nullable"] = True
+    return converted
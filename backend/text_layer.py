@@ -0,0 +1,62 @@
+import io
+import logging
+
+from parser import parse_invoice_fields
+from invoice_checks import check_invoice
+
+logger = logging.getLogger(__name__)
+
+# Below this many characters the PDF is treated as a scan without a usable text layer
+MIN_TEXT_CHARS = 200
+
+
+def load_pypdf():
+    """
+    Imports pypdf on first use (it adds ~0.2 s to startup) and returns the module,
+    or None when it is not installed. The fast path is optional; without pypdf every
+    PDF goes to the model.
+    """
+    try:
+        import pypdf
+    except ImportError:
+        return None
+    return pypdf
+
+
+def extract_text_layer(file_content, max_pages=20):
+    """
+    Returns the embedded text of the PDF (bytes or a binary file object), or None for
+    scans, unreadable files or when pypdf is not installed.
+    """
+    pypdf = load_pypdf()
+    if pypdf is None:
+        return None
+    try:
+        stream = file_content if hasattr(file_content, "read") else io.BytesIO(file_content)
+        reader = pypdf.PdfReader(stream)
+        pages = [page.extract_text() or "" for page in reader.pages[:max_pages]]
+    except Exception as e:
+        logger.warning("Text layer extraction failed: %s", e)
+        return None
+
+    text = "\n".join(pages)
+    if len(text.strip()) < MIN_TEXT_CHARS:
+        return None
+    return text
+
+
+def extract_from_text_layer(file_content, min_confidence=1.0):
+    """
+    Local pre-extraction: parses the PDF text layer into the Gemini schema and scores it.
+    Returns (data, report). data is None when there is no text layer or the result
+    does not reach min_confidence, in which case the caller should use the model.
+    """
+    text = extract_text_layer(file_content)
+    if text is None:
+        return None, {"confidence": 0.0, "issues": ["no text layer"], "codes": ["no_text_layer"], "reconciled": False}
+
+    data = parse_invoice_fields(text)
+    report = check_invoice(data)
+    if report["confidence"] < min_confidence:
+        return None, report
+    return data, report
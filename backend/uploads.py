@@ -0,0 +1,116 @@
+import io
+import time
+import hashlib
+import tempfile
+import threading
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes):
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes // (1024 * 1024)} MB")
+        self.max_bytes = max_bytes
+
+
+class PdfUpload:
+    """
+    A PDF held in a spooled temporary file (memory up to a threshold, then disk),
+    with its SHA-256 digest and size computed while it was written.
+    """
+
+    def __init__(self, fileobj, digest, size, filename=None):
+        self.file = fileobj
+        self.digest = digest
+        self.size = size
+        self.filename = filename
+
+    @classmethod
+    def from_bytes(cls, data, filename=None):
+        return cls(io.BytesIO(data), hashlib.sha256(data).hexdigest(), len(data), filename)
+
+    def open(self):
+        """
+        Returns the underlying file object, rewound to the start.
+        """
+        self.file.seek(0)
+        return self.file
+
+    def read(self):
+        return self.open().read()
+
+    def close(self):
+        self.file.close()
+
+
+async def spool_upload(upload, max_bytes, memory_bytes=CHUNK_SIZE):
+    """
+    Copies a FastAPI UploadFile chunk by chunk into a SpooledTemporaryFile, hashing as it
+    goes and stopping with UploadTooLarge as soon as max_bytes is exceeded, so the whole
+    upload is never held in memory at once.
+    """
+    spooled = tempfile.SpooledTemporaryFile(max_size=memory_bytes)
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            sha256.update(chunk)
+            spooled.write(chunk)
+    except BaseException:
+        spooled.close()
+        raise
+    return PdfUpload(spooled, sha256.hexdigest(), size, upload.filename)
+
+
+class GeminiFileRegistry:
+    """
+    Uploads large PDFs once through the Gemini File API and hands out the file handle
+    for every later call on the same bytes (retries, re-extractions, other prompts).
+    Files are named after their SHA-256, so other workers find them too.
+    The File API keeps files for 48 hours; handles are refreshed a little before that.
+    """
+
+    TTL_SECONDS = 46 * 3600
+
+    def __init__(self, sdk):
+        # sdk() returns the configured google.generativeai module (imported on first use)
+        self.sdk = sdk
+        self._handles = {}
+        self._lock = threading.Lock()
+        self.stats = {"uploads": 0, "reuses": 0}
+
+    def get_or_upload(self, pdf):
+        name = f"files/pdf-{pdf.digest[:36]}"
+
+        with self._lock:
+            cached = self._handles.get(pdf.digest)
+            if cached and time.time() - cached[1] < self.TTL_SECONDS:
+                self.stats["reuses"] += 1
+                return cached[0]
+
+        try:
+            handle = self.sdk().get_file(name)
+            self.stats["reuses"] += 1
+        except Exception:
+            handle = self.sdk().upload_file(
+                pdf.open(), mime_type="application/pdf", name=name, display_name=pdf.filename or name
+            )
+            self.stats["uploads"] += 1
+            handle = self._wait_until_active(handle)
+
+        with self._lock:
+            self._handles[pdf.digest] = (handle, time.time())
+        return handle
+
+    def _wait_until_active(self, handle, timeout=120):
+        deadline = time.time() + timeout
+        while getattr(handle.state, "name", "ACTIVE") == "PROCESSING" and time.time() < deadline:
+            time.sleep(1)
+            handle = self.sdk().get_file(handle.name)
+        return handle
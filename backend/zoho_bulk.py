@@ -0,0 +1,108 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from push_ledger import ledger_key_for
+
+# Zoho Books also caps concurrent in-flight calls per organization (5 on the lower plans)
+BULK_CONCURRENCY = int(os.getenv("ZOHO_BULK_CONCURRENCY", "5"))
+
+
+def _push_one(client, index, customer_name, invoice_data):
+    started = time.monotonic()
+    result = {"index": index, "customer_name": customer_name, "reference_number": invoice_data.get("invoice_number")}
+
+    try:
+        pushed = client.find_pushed_invoice(invoice_data)
+        if pushed:
+            invoice = pushed["invoice"]
+            result.update({
+                "status": "duplicate",
+                "invoice_id": invoice.get("invoice_id"),
+                "invoice_number": invoice.get("invoice_number"),
+            })
+            return result
+
+        seller = invoice_data.get("seller") or {}
+        customer_id = client.search_customer(customer_name, vat_number=seller.get("vat_number"))
+        if not customer_id:
+            result.update({"status": "error", "error": f"Customer '{customer_name}' not found in Zoho Books."})
+        else:
+            created = client.create_invoice(invoice_data, customer_id)
+            if "error" in created:
+                result.update({"status": "error", "error": created["error"], "status_code": created.get("status_code")})
+            else:
+                invoice = created.get("invoice", {})
+                result.update({
+                    "status": "duplicate" if created.get("duplicate") else "created",
+                    "invoice_id": invoice.get("invoice_id"),
+                    "invoice_number": invoice.get("invoice_number"),
+                })
+    except Exception as e:
+        result.update({"status": "error", "error": str(e)})
+    finally:
+        result["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    return result
+
+
+def push_invoices(client, invoices, max_workers=BULK_CONCURRENCY):
+    """
+    Creates many invoices in Zoho Books.
+    invoices is a list of (customer_name, invoice_data) pairs. Requests run on up to
+    max_workers threads; the client's token bucket keeps the aggregate rate within
+    Zoho's per-minute limit and its retry loop absorbs 429/5xx responses.
+    Invoices already in the push ledger are reported as duplicates without an API call.
+    Returns a report with one result per invoice, in input order.
+    """
+    started = time.monotonic()
+
+    # The same supplier invoice twice in one batch is pushed once; the copies reuse its result
+    first_index = {}
+    duplicate_of = {}
+    for index, (_, invoice_data) in enumerate(invoices):
+        key = ledger_key_for(invoice_data)
+        if key in first_index:
+            duplicate_of[index] = first_index[key]
+        elif key:
+            first_index[key] = index
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        futures = {
+            index: pool.submit(_push_one, client, index, customer_name, invoice_data)
+            for index, (customer_name, invoice_data) in enumerate(invoices)
+            if index not in duplicate_of
+        }
+        pushed = {index: future.result() for index, future in futures.items()}
+
+    results = []
+    for index, (customer_name, invoice_data) in enumerate(invoices):
+        if index in pushed:
+            results.append(pushed[index])
+            continue
+        original = pushed[duplicate_of[index]]
+        result = {
+            "index": index,
+            "customer_name": customer_name,
+            "reference_number": invoice_data.get("invoice_number"),
+            "duplicate_of": duplicate_of[index],
+            "elapsed_seconds": 0.0,
+        }
+        if original["status"] == "error":
+            result.update({"status": "error", "error": original["error"]})
+        else:
+            result.update({
+                "status": "duplicate",
+                "invoice_id": original.get("invoice_id"),
+                "invoice_number": original.get("invoice_number"),
+            })
+        results.append(result)
+
+    created = sum(1 for r in results if r["status"] == "created")
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
+    return {
+        "total": len(results),
+        "created": created,
+        "duplicates": duplicates,
+        "failed": len(results) - created - duplicates,
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+        "results": results,
+    }
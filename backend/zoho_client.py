@@ -1,7 +1,75 @@
 import requests
 import os
-import json
+import time
+import random
+import logging
+import threading
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from zoho_contacts import ContactIndex, normalize_name
+from push_ledger import PushLedger, ledger_key_for, ledger_key_from_notes, ledger_note, slim_invoice
+from metrics import stage
+from resilience import CircuitBreaker, RetryBudget
+from normalize import parse_date, parse_amount, seller_key
+
+logger = logging.getLogger(__name__)
+
+# Refresh the access token this many seconds before Zoho says it expires
+TOKEN_REFRESH_MARGIN = 300
+
+# Minimum seconds between index syncs triggered by a customer lookup miss
+CONTACT_SYNC_INTERVAL = int(os.getenv("ZOHO_CONTACT_SYNC_INTERVAL", "60"))
+
+# Zoho Books allows 100 API requests per minute per organization
+REQUESTS_PER_MINUTE = int(os.getenv("ZOHO_REQUESTS_PER_MINUTE", "100"))
+REQUEST_BURST = int(os.getenv("ZOHO_REQUEST_BURST", "5"))
+MAX_RETRIES = int(os.getenv("ZOHO_MAX_RETRIES", "5"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# A 5xx to a POST may come after the invoice was created, so only a rate-limit rejection is retried
+NON_IDEMPOTENT_RETRY_STATUS_CODES = {429}
+# Seconds to connect and to wait for a response, per HTTP request; and the total a call may
+# spend including retries and backoff
+CONNECT_TIMEOUT = float(os.getenv("ZOHO_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("ZOHO_READ_TIMEOUT", "30"))
+REQUEST_DEADLINE = float(os.getenv("ZOHO_REQUEST_DEADLINE", "120"))
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    Refilling at (per_minute - burst) / 60 tokens per second with room for `burst` tokens
+    admits at most per_minute requests in any 60 second window, so a steady stream of
+    requests runs at the quota without tripping it.
+    """
+
+    def __init__(self, per_minute=100, burst=5):
+        self.capacity = burst
+        self.rate = max(per_minute - burst, 1) / 60.0
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Empties the bucket so no request is sent for `seconds` (used after a 429).
+        """
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+            self.updated = time.monotonic()
 
 class ZohoClient:
     def __init__(self):
@@ -30,17 +98,45 @@ class ZohoClient:
 
         self.base_url = f"{self.api_url_map.get(self.dc, self.api_url_map['com'])}/books/v3"
         self.access_token = None
+        self.token_expires_at = 0
+        self._token_lock = threading.Lock()
+
+        # One pooled keep-alive session for both the accounts and the Books API hosts
+        pool_size = int(os.getenv("ZOHO_HTTP_POOL_SIZE", "10"))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.rate_limiter = TokenBucket(per_minute=REQUESTS_PER_MINUTE, burst=REQUEST_BURST)
+        # Fails fast (CircuitOpen) while Zoho keeps timing out or answering 5xx
+        self.breaker = CircuitBreaker("zoho")
+        self.retry_budget = RetryBudget()
+
+        self.contact_index = ContactIndex(os.getenv("ZOHO_CONTACTS_INDEX", "data/zoho_contacts.json"))
+        self.push_ledger = PushLedger(os.getenv("ZOHO_PUSH_LEDGER", "data/push_ledger.db"))
         
         if not all([self.client_id, self.client_secret, self.refresh_token, self.org_id]):
-            print("Warning: Zoho credentials not fully configured in environment.")
+            logger.warning("Zoho credentials not fully configured in environment")
 
-        print(f"ZohoClient Initialized. DC: {self.dc}, Org: {self.org_id}")
+        logger.info("ZohoClient initialized", extra={"dc": self.dc, "org_id": self.org_id})
         
-    def _get_access_token(self):
+    def _get_access_token(self, stale_token=None):
         """
-        Refreshes the access token using the refresh token.
+        Returns a valid access token, refreshing it with the refresh token when needed.
+        The cached token is reused until TOKEN_REFRESH_MARGIN seconds before `expires_in` runs out.
+        Pass stale_token (a token the API rejected) to force a refresh; if another thread
+        already replaced it, the new token is returned without a second refresh.
         Example response: {"access_token": "...", "api_domain": "...", "token_type": "Bearer", "expires_in": 3600}
         """
+        with self._token_lock:
+            token_valid = self.access_token and time.time() < self.token_expires_at - TOKEN_REFRESH_MARGIN
+            if token_valid and self.access_token != stale_token:
+                return self.access_token
+            return self._refresh_access_token()
+
+    def _refresh_access_token(self):
+        # Caller holds _token_lock, so concurrent requests never refresh in parallel
         accounts_url = self.accounts_url_map.get(self.dc, self.accounts_url_map["com"])
         url = f"{accounts_url}/oauth/v2/token"
         params = {
@@ -51,7 +147,8 @@ class ZohoClient:
         }
         
         try:
-            response = requests.post(url, params=params)
+            with stage("zoho_token_refresh"):
+                response = self.session.post(url, params=params, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
             response.raise_for_status()
             data = response.json()
             
@@ -59,45 +156,181 @@ class ZohoClient:
                 raise Exception(f"Zoho Auth Error: {data.get('error')}")
                 
             self.access_token = data.get("access_token")
+            self.token_expires_at = time.time() + int(data.get("expires_in", 3600))
             return self.access_token
             
         except Exception as e:
-            print(f"Failed to refresh token: {e}")
+            logger.error("Failed to refresh Zoho token: %s", e)
             raise
 
-    def _get_headers(self):
-        if not self.access_token:
-            self._get_access_token()
+    def _get_headers(self, token=None):
+        token = token or self._get_access_token()
         return {
-            "Authorization": f"Zoho-oauthtoken {self.access_token}",
+            "Authorization": f"Zoho-oauthtoken {token}",
             "Content-Type": "application/json"
         }
 
-    def search_customer(self, customer_name):
+    def _request(self, method, path, **kwargs):
+        """
+        Sends a Books API request on the pooled session, within the per-minute rate limit.
+        A 401 means the token was revoked or expired early: refresh once and retry.
+        429 and 5xx responses to GET are retried up to MAX_RETRIES times with exponential
+        backoff and full jitter, honouring Retry-After when Zoho sends it. Other methods are
+        retried on 429 only: after a 5xx, timeout or connection error a POST may already
+        have been applied.
+        Retries stop early when the shared retry budget is spent or the next attempt would
+        end after REQUEST_DEADLINE. Raises CircuitOpen while Zoho is failing.
+        """
+        url = f"{self.base_url}/{path}"
+        token = self._get_access_token()
+        token_refreshed = False
+        attempt = 0
+        deadline = time.monotonic() + REQUEST_DEADLINE
+        retry_status_codes = RETRY_STATUS_CODES if method == "GET" else NON_IDEMPOTENT_RETRY_STATUS_CODES
+        self.retry_budget.request()
+
+        while True:
+            self.breaker.check()
+            with stage("zoho_rate_wait"):
+                self.rate_limiter.acquire()
+            error = None
+            try:
+                with stage("zoho_api"):
+                    response = self.session.request(
+                        method, url, headers=self._get_headers(token),
+                        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), **kwargs
+                    )
+            except (requests.Timeout, requests.ConnectionError) as e:
+                self.breaker.record(False)
+                if method != "GET":
+                    raise
+                error, status = e, type(e).__name__
+            else:
+                self.breaker.record(response.status_code < 500)
+                status = response.status_code
+
+            if error is None and response.status_code == 401 and not token_refreshed:
+                token = self._get_access_token(stale_token=token)
+                token_refreshed = True
+                continue
+
+            if error is None and response.status_code not in retry_status_codes:
+                return response
+
+            delay = random.uniform(0, min(60, 2 ** attempt))
+            retry_after = response.headers.get("Retry-After") if error is None else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            if error is None and response.status_code == 429:
+                # Everyone sharing this client backs off, not just this request
+                self.rate_limiter.pause(delay)
+
+            if (attempt >= MAX_RETRIES or time.monotonic() + delay + READ_TIMEOUT > deadline
+                    or not self.retry_budget.try_retry()):
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            logger.warning(
+                "Zoho request retried",
+                extra={"method": method, "path": path, "status": status,
+                       "attempt": attempt, "max_retries": MAX_RETRIES, "delay_s": round(delay, 1)},
+            )
+            time.sleep(delay)
+
+    def list_contacts(self, page=1, per_page=200, **filters):
+        """
+        Returns (contacts, has_more_page) for one page of the contact list.
+        """
+        params = {"organization_id": self.org_id, "page": page, "per_page": per_page, **filters}
+        response = self._request("GET", "contacts", params=params)
+        response.raise_for_status()
+        data = response.json()
+        return data.get("contacts", []), data.get("page_context", {}).get("has_more_page", False)
+
+    def iter_invoices(self, per_page=200, **filters):
+        """
+        Yields every invoice matching filters (e.g. reference_number), page by page.
+        """
+        page = 1
+        while True:
+            params = {"organization_id": self.org_id, "page": page, "per_page": per_page, **filters}
+            response = self._request("GET", "invoices", params=params)
+            response.raise_for_status()
+            data = response.json()
+            yield from data.get("invoices", [])
+            if not data.get("page_context", {}).get("has_more_page", False):
+                return
+            page += 1
+
+    def get_invoice(self, invoice_id):
+        """
+        Returns one invoice with all its fields (the list omits some, e.g. notes), or None.
+        """
+        response = self._request("GET", f"invoices/{invoice_id}", params={"organization_id": self.org_id})
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json().get("invoice")
+
+    def find_pushed_invoice(self, invoice_data):
+        """
+        Returns the create_invoice-style result recorded for an invoice that was already
+        pushed, or None. Purely local, no API call.
+        """
+        recorded = self.push_ledger.get(ledger_key_for(invoice_data))
+        if recorded is None:
+            return None
+        return self._duplicate_result(recorded)
+
+    def _duplicate_result(self, recorded):
+        return {
+            "code": 0,
+            "message": "Invoice already pushed to Zoho Books.",
+            "duplicate": True,
+            "invoice": recorded,
+        }
+
+    def search_customer(self, customer_name, vat_number=None):
         """
-        Searches for a customer by name.
-        Returns the first match's contact_id.
+        Resolves a customer to a contact_id.
+        Uses the local contact index first (VAT, exact, normalized and fuzzy name match).
+        On a miss the index is synced incrementally (at most every CONTACT_SYNC_INTERVAL
+        seconds) and, if that finds nothing either, the live contact search is used.
         """
-        url = f"{self.base_url}/contacts"
+        contact_id, match_type = self.contact_index.lookup(customer_name, vat_number)
+        if contact_id:
+            return contact_id
+
+        if time.time() - self.contact_index.synced_at > CONTACT_SYNC_INTERVAL:
+            try:
+                self.contact_index.sync(self)
+                contact_id, match_type = self.contact_index.lookup(customer_name, vat_number)
+                if contact_id:
+                    return contact_id
+            except Exception as e:
+                logger.warning("Contact index sync failed: %s", e)
+
         params = {
             "organization_id": self.org_id,
             "contact_name": customer_name
         }
         
-        response = requests.get(url, headers=self._get_headers(), params=params)
-        
-        if response.status_code == 401:
-            # Token might be expired, retry once
-            self._get_access_token()
-            response = requests.get(url, headers=self._get_headers(), params=params)
+        response = self._request("GET", "contacts", params=params)
             
         if response.status_code != 200:
-            print(f"Error searching customer: {response.text}")
+            logger.error("Error searching customer", extra={"status": response.status_code, "response": response.text})
             return None
             
         data = response.json()
         contacts = data.get("contacts", [])
         
+        # Prefer a contact whose name actually matches over whatever Zoho ranked first
+        wanted = normalize_name(customer_name)
+        for contact in contacts:
+            if normalize_name(contact.get("contact_name")) == wanted:
+                return contact.get("contact_id")
         if contacts:
             return contacts[0].get("contact_id")
         return None
@@ -105,12 +338,68 @@ class ZohoClient:
     def create_invoice(self, invoice_data, customer_id):
         """
         Creates an invoice in Zoho Books.
+        Invoices already recorded in the push ledger (same seller VAT, invoice number and
+        grand total) are not created again; the recorded result is returned instead.
+        When a POST may have gone through without an answer (timeout, dropped connection,
+        5xx), the reservation stays pending; the push after PENDING_TIMEOUT first looks the
+        invoice up in Zoho by its ledger note.
+        """
+        key = ledger_key_for(invoice_data)
+        if key:
+            can_push, recorded, stale = self.push_ledger.reserve(key)
+            if not can_push:
+                if recorded is None:
+                    return {"error": "This invoice is already being pushed.", "status_code": 409}
+                return self._duplicate_result(recorded)
+            if stale:
+                try:
+                    existing = self.find_invoice_by_ledger_key(key, invoice_data.get("invoice_number"))
+                except Exception:
+                    self.push_ledger.release(key)
+                    raise
+                if existing is not None:
+                    recorded = slim_invoice(existing)
+                    self.push_ledger.record(key, recorded)
+                    return self._duplicate_result(recorded)
+
+        try:
+            result = self._create_invoice(invoice_data, customer_id, key)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            # Nothing was sent only if the connection never opened
+            if key and isinstance(e, requests.ConnectTimeout):
+                self.push_ledger.release(key)
+            raise
+        except Exception:
+            if key:
+                self.push_ledger.release(key)
+            raise
+
+        if key:
+            if "error" not in result:
+                self.push_ledger.record(key, slim_invoice(result.get("invoice", {})))
+            elif result.get("status_code", 0) < 500:
+                self.push_ledger.release(key)
+        return result
+
+    def find_invoice_by_ledger_key(self, key, reference_number):
+        """
+        Returns the Zoho invoice whose notes carry key (see push_ledger.ledger_note), or None.
         """
-        url = f"{self.base_url}/invoices"
+        if not reference_number:
+            return None
+        for invoice in self.iter_invoices(reference_number=reference_number):
+            notes = invoice.get("notes")
+            if notes is None:
+                notes = (self.get_invoice(invoice["invoice_id"]) or {}).get("notes")
+            if ledger_key_from_notes(notes) == key:
+                return invoice
+        return None
+
+    def _create_invoice(self, invoice_data, customer_id, key=None):
         params = {"organization_id": self.org_id}
         
         # Format date format YYYY-MM-DD
-        date_str = self._format_date_for_zoho(invoice_data.get("invoice_date"))
+        date_str = self._format_date_for_zoho(invoice_data.get("invoice_date"), seller_key(invoice_data))
         
         line_items = []
         for item in invoice_data.get("line_items", []):
@@ -128,58 +417,55 @@ class ZohoClient:
             "line_items": line_items,
             # "due_date": invoice_data.get("due_date"), # Optional
         }
+        if key:
+            # Read back by push_ledger.reconcile
+            payload["notes"] = ledger_note(key)
         
-        print(f"Creating invoice with payload: {json.dumps(payload, indent=2)}")
+        logger.debug("Creating invoice", extra={"payload": payload})
         
-        response = requests.post(url, headers=self._get_headers(), params=params, json=payload)
+        response = self._request("POST", "invoices", params=params, json=payload)
         
         if response.status_code == 201:
             return response.json()
         else:
-            print(f"Failed to create invoice. Status: {response.status_code}. Response: {response.text}")
+            logger.error("Failed to create invoice", extra={"status": response.status_code, "response": response.text})
             # Identify error message
             try:
                 err = response.json()
-                return {"error": err.get("message", "Unknown error")}
+                return {"error": err.get("message", "Unknown error"), "status_code": response.status_code}
             except:
-                return {"error": response.text}
+                return {"error": response.text, "status_code": response.status_code}
 
-    def _format_date_for_zoho(self, date_str):
+    def _format_date_for_zoho(self, date_str, seller=None):
         """
-        Parses various date formats and converts to YYYY-MM-DD for Zoho.
+        Converts the extracted date (any layout normalize.parse_date reads, including
+        Hijri dates and Arabic-Indic digits) to YYYY-MM-DD for Zoho.
         """
         if not date_str:
             return datetime.today().strftime('%Y-%m-%d')
-            
-        # List of supported formats
-        formats = [
-            "%b %d, %Y",       # Aug 14, 2025
-            "%B %d, %Y",       # August 14, 2025
-            "%d %b %Y",        # 14 Aug 2025
-            "%d %B %Y",        # 14 August 2025
-            "%Y-%m-%d",        # 2025-08-14
-            "%d-%m-%Y",        # 14-08-2025
-            "%d/%m/%Y",        # 14/08/2025
-            "%m/%d/%Y",        # 08/14/2025
-            "%Y/%m/%d"         # 2025/08/14
-        ]
-        
-        for fmt in formats:
-            try:
-                dt = datetime.strptime(date_str.strip(), fmt)
-                return dt.strftime('%Y-%m-%d')
-            except ValueError:
-                continue
-        
-        print(f"Warning: Could not parse date '{date_str}'. Sending original.")
-        return date_str
+
+        iso_date = parse_date(date_str, seller)
+        if iso_date is None:
+            logger.warning("Could not parse date %r, sending original", date_str)
+            return date_str
+        return iso_date
 
     def _parse_float(self, value):
-        if not value: return 0.0
-        if isinstance(value, (int, float)): return float(value)
-        try:
-            # Clean string "1,200.00" -> 1200.00
-            clean = str(value).replace(",", "").replace("$", "").strip()
-            return float(clean)
-        except:
-            return 0.0
+        # "1,200.00" / "SAR 1200" / "١٬٢٠٠٫٠٠" -> 1200.0; 0.0 when there is no number
+        return parse_amount(value) or 0.0
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_zoho_client():
+    """
+    Returns the process-wide ZohoClient, so the access token and the
+    connection pool are shared by every request.
+    """
+    global _shared_client
+    if _shared_client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = ZohoClient()
+    return _shared_client
@@ -0,0 +1,231 @@
+import os
+import re
+import json
+import time
+import difflib
+import argparse
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# Arabic diacritics (tashkeel) and tatweel carry no meaning for matching
+ARABIC_MARKS_PATTERN = re.compile(r'[\u064B-\u0652\u0670\u0640]')
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+VAT_DIGITS_PATTERN = re.compile(r'\D')
+
+ARABIC_LETTER_MAP = str.maketrans({
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا",
+    "ى": "ي",
+    "ة": "ه",
+    "ؤ": "و",
+    "ئ": "ي",
+})
+
+# Legal-form words that suppliers add or drop between documents
+LEGAL_FORM_WORDS = {
+    "co", "company", "corp", "corporation", "est", "establishment", "inc", "llc", "ltd",
+    "limited", "the", "and", "for", "wll",
+    # Arabic entries are in normalized form (ة -> ه, ؤ -> و)
+    "شركه", "موسسه", "ذ", "م", "ذمم",
+}
+
+# Zoho Books returns the tax registration under a different field depending on the edition
+VAT_FIELDS = ("tax_reg_no", "vat_reg_no", "tax_registration_number", "gst_no")
+
+
+def normalize_name(name):
+    """
+    Folds spelling variants of a company name onto one key:
+    case, punctuation, Arabic letter forms and diacritics, and legal-form words.
+    "Grand Information Trading Co." and "GRAND INFORMATION TRADING COMPANY" both give
+    "grand information trading".
+    """
+    if not name:
+        return ""
+    text = unicodedata.normalize("NFKC", name).casefold()
+    text = ARABIC_MARKS_PATTERN.sub("", text).translate(ARABIC_LETTER_MAP)
+    text = PUNCTUATION_PATTERN.sub(" ", text)
+    words = [w for w in WHITESPACE_PATTERN.split(text) if w and w not in LEGAL_FORM_WORDS]
+    return " ".join(words)
+
+
+def normalize_vat(vat_number):
+    if not vat_number:
+        return ""
+    return VAT_DIGITS_PATTERN.sub("", unicodedata.normalize("NFKC", str(vat_number)))
+
+
+class ContactIndex:
+    """
+    Local copy of the Zoho Books contact list for customer resolution without a network call.
+
+    Lookups try, in order: VAT number, exact name, normalized name, then fuzzy match on the
+    normalized name. The index is filled by a full paginated pull and then kept current with
+    incremental syncs ordered by last_modified_time, and is saved to a JSON snapshot.
+    """
+
+    def __init__(self, path="data/zoho_contacts.json", fuzzy_cutoff=0.88):
+        self.path = path
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.contacts = {}
+        # Newest last_modified_time seen; incremental syncs stop once they reach it
+        self.watermark = None
+        self.synced_at = 0
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._by_name = {}
+        self._by_normalized = {}
+        self._by_vat = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Could not load contact index %s: %s", self.path, e)
+            return
+        with self._lock:
+            self.contacts = {c["contact_id"]: c for c in snapshot.get("contacts", [])}
+            self.watermark = snapshot.get("watermark")
+            self.synced_at = snapshot.get("synced_at", 0)
+            self._rebuild()
+
+    def save(self):
+        with self._lock:
+            snapshot = {
+                "watermark": self.watermark,
+                "synced_at": self.synced_at,
+                "contacts": list(self.contacts.values()),
+            }
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def sync(self, client, full=False):
+        """
+        Pulls contacts from Zoho Books.
+        full=True (or an empty index) pages through every contact; otherwise only contacts
+        modified since the watermark are fetched, newest first.
+        Returns the number of contacts added or updated.
+        """
+        with self._sync_lock:
+            return self._sync(client, full)
+
+    def _sync(self, client, full):
+        full = full or self.watermark is None
+        sort_kwargs = {} if full else {"sort_column": "last_modified_time", "sort_order": "D"}
+        fetched = []
+        page = 1
+        while True:
+            contacts, has_more = client.list_contacts(page=page, **sort_kwargs)
+            if full:
+                fetched.extend(contacts)
+            else:
+                newer = [c for c in contacts if (c.get("last_modified_time") or "") > self.watermark]
+                fetched.extend(newer)
+                if len(newer) < len(contacts):
+                    break
+            if not has_more:
+                break
+            page += 1
+
+        with self._lock:
+            if full:
+                self.contacts = {}
+            for contact in fetched:
+                self.contacts[contact["contact_id"]] = self._slim(contact)
+            self.watermark = max(
+                (c["last_modified_time"] for c in self.contacts.values() if c.get("last_modified_time")),
+                default="",
+            )
+            self.synced_at = time.time()
+            self._rebuild()
+        self.save()
+        return len(fetched)
+
+    def lookup(self, name, vat_number=None):
+        """
+        Returns (contact_id, match_type) or (None, None).
+        match_type is one of "vat", "exact", "normalized", "fuzzy".
+        """
+        with self._lock:
+            vat = normalize_vat(vat_number)
+            if vat and vat in self._by_vat:
+                return self._by_vat[vat], "vat"
+
+            if name in self._by_name:
+                return self._by_name[name], "exact"
+
+            normalized = normalize_name(name)
+            if not normalized:
+                return None, None
+            if normalized in self._by_normalized:
+                return self._by_normalized[normalized], "normalized"
+
+            close = difflib.get_close_matches(normalized, self._by_normalized.keys(), n=1, cutoff=self.fuzzy_cutoff)
+            if close:
+                return self._by_normalized[close[0]], "fuzzy"
+        return None, None
+
+    def __len__(self):
+        return len(self.contacts)
+
+    def _slim(self, contact):
+        # Keep only what lookups need; the full contact payload is large
+        vat = next((contact.get(f) for f in VAT_FIELDS if contact.get(f)), None)
+        return {
+            "contact_id": contact["contact_id"],
+            "contact_name": contact.get("contact_name"),
+            "company_name": contact.get("company_name"),
+            "vat_number": vat,
+            "last_modified_time": contact.get("last_modified_time"),
+        }
+
+    def _rebuild(self):
+        self._by_name = {}
+        self._by_normalized = {}
+        self._by_vat = {}
+        # Sorted so that duplicate keys resolve the same way on every rebuild
+        for contact_id in sorted(self.contacts):
+            contact = self.contacts[contact_id]
+            for name in (contact.get("contact_name"), contact.get("company_name")):
+                if name:
+                    self._by_name.setdefault(name, contact_id)
+                    key = normalize_name(name)
+                    if key:
+                        self._by_normalized.setdefault(key, contact_id)
+            vat = normalize_vat(contact.get("vat_number"))
+            if vat:
+                self._by_vat.setdefault(vat, contact_id)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from zoho_client import get_zoho_client
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Sync or query the local Zoho Books contact index")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync_parser = sub.add_parser("sync", help="Pull contacts from Zoho Books")
+    sync_parser.add_argument("--full", action="store_true", help="Re-download every contact instead of only recent changes")
+    lookup_parser = sub.add_parser("lookup", help="Resolve a customer name against the index")
+    lookup_parser.add_argument("name")
+    lookup_parser.add_argument("--vat", default=None, help="Seller VAT number")
+    args = parser.parse_args()
+
+    zoho = get_zoho_client()
+    if args.command == "sync":
+        count = zoho.contact_index.sync(zoho, full=args.full)
+        print(f"Synced {count} contacts. Index size: {len(zoho.contact_index)}")
+    else:
+        print(zoho.contact_index.lookup(args.name, args.vat))
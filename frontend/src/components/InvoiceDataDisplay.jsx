@@ -1,6 +1,7 @@
 import React from 'react';
 
-const InvoiceDataDisplay = ({ data }) => {
+// partial: fields are still streaming in, so the Zoho push is held back until the result
+const InvoiceDataDisplay = ({ data, partial = false }) => {
     if (!data) return null;
 
     // Generalized Key formatter
@@ -112,8 +113,12 @@ const InvoiceDataDisplay = ({ data }) => {
                 </div>
             )}
 
-            {/* Zoho Integration Section */}
-            <ZohoIntegration data={data} />
+            {partial ? (
+                <p className="text-secondary">Extracting remaining fields...</p>
+            ) : (
+                /* Zoho Integration Section */
+                <ZohoIntegration data={data} />
+            )}
         </div>
     );
 };
@@ -1,10 +1,35 @@
 import { useState } from 'react';
 import InvoiceDataDisplay from './InvoiceDataDisplay';
 
+// Reads a text/event-stream body and calls onEvent(event, data) for each message
+const readEvents = async (response, onEvent) => {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let end;
+        while ((end = buffer.indexOf('\n\n')) !== -1) {
+            const message = buffer.slice(0, end);
+            buffer = buffer.slice(end + 2);
+            let event = 'message';
+            let data = '';
+            for (const line of message.split('\n')) {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            }
+            if (data) onEvent(event, JSON.parse(data));
+        }
+    }
+};
+
 const InvoiceUpload = () => {
     const [file, setFile] = useState(null);
     const [loading, setLoading] = useState(false);
     const [result, setResult] = useState(null);
+    const [partial, setPartial] = useState(null);
     const [error, setError] = useState(null);
 
     const handleFileChange = (e) => {
@@ -12,6 +37,7 @@ const InvoiceUpload = () => {
             setFile(e.target.files[0]);
             setError(null);
             setResult(null);
+            setPartial(null);
         }
     };
 
@@ -24,12 +50,14 @@ const InvoiceUpload = () => {
         setLoading(true);
         setError(null);
         setResult(null);
+        setPartial(null);
 
         const formData = new FormData();
         formData.append('file', file);
 
         try {
-            const response = await fetch('http://localhost:8000/extract', {
+            // Fields are shown as the model produces them; the final result replaces them
+            const response = await fetch('http://localhost:8000/extract/stream', {
                 method: 'POST',
                 body: formData,
             });
@@ -45,8 +73,25 @@ const InvoiceUpload = () => {
                 throw new Error(`Upload failed: ${errorMessage}`);
             }
 
-            const data = await response.json();
-            setResult(data);
+            let failure = null;
+            await readEvents(response, (event, data) => {
+                if (event === 'model') {
+                    // A retry with a stronger model starts over
+                    setPartial({ line_items: [] });
+                } else if (event === 'field') {
+                    setPartial((prev) => ({ ...(prev || { line_items: [] }), [data.name]: data.value }));
+                } else if (event === 'line_item') {
+                    setPartial((prev) => {
+                        const current = prev || { line_items: [] };
+                        return { ...current, line_items: [...current.line_items, data.item] };
+                    });
+                } else if (event === 'result') {
+                    setResult(data);
+                } else if (event === 'error') {
+                    failure = data.detail;
+                }
+            });
+            if (failure) throw new Error(`Extraction failed: ${failure}`);
         } catch (err) {
             setError(err.message);
         } finally {
@@ -79,7 +124,7 @@ const InvoiceUpload = () => {
                 </button>
             </div>
 
-            {loading && <div className="spinner"></div>}
+            {loading && !partial && <div className="spinner"></div>}
 
             {error && (
                 <div className="status-box" style={{ borderColor: 'var(--error)', color: '#fca5a5' }}>
@@ -87,8 +132,10 @@ const InvoiceUpload = () => {
                 </div>
             )}
 
-            {result && (
+            {result ? (
                 <InvoiceDataDisplay data={result.raw_response} />
+            ) : partial && (
+                <InvoiceDataDisplay data={partial} partial />
             )}
         </div>
     );